@@ -0,0 +1,184 @@
+'''
+Benchmark of the embedding backends and store dtypes in embedding_store, against the torch float32 model semantic
+scoring has always used
+
+Its results decide which backends semantic_shift_job.py offers (semantic_shift_job.JOB_BACKENDS). The onnx backends
+need the ONNX extras, which aren't in requirements.txt: pip install sentence-transformers[onnx]. A backend whose
+dependencies aren't installed is reported and skipped
+
+Transcript minutes are read from bdv.fct_video_transcript_segment (the first --max-videos videos), the same way
+semantic_shift_job.py reads them. For each backend it reports:
+1. model load time, and encoding throughput at each batch size
+2. for each store dtype: bytes per stored vector, how close the stored embeddings are to the baseline's
+(mean and min cosine similarity), and what that does to the semantic shift scores - mean and max absolute
+difference per context window, and the share of minutes that land in a different semantic_shift_5m band
+
+Usage:
+    python data_dashboard/benchmark_embedding_backends.py --max-videos 20 --batch-sizes 16 64 256
+'''
+
+import os
+import sys
+import argparse
+import time
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_preprocessing'))
+import db_pool
+import embedding_store
+import content_mapping
+import semantic_shift_job
+
+BASELINE = ('torch', 'float32')
+
+BANDS = ['Very Low Change', 'Low Change', 'Moderate Change', 'High Change', 'Very High Change']
+
+
+def semantic_shift_bands(shift):
+    '''
+    Bands semantic shift scores by standard deviations from the mean of the non-zero scores, as content_mapping.py does
+    '''
+    scored = shift[shift != 0]
+    avg, std = np.nanmean(scored), np.nanstd(scored, ddof=1)
+    conditions = [
+        shift < avg - 2 * std,
+        (shift >= avg - 2 * std) & (shift < avg - std),
+        (shift >= avg - std) & (shift <= avg + std),
+        (shift > avg + std) & (shift <= avg + 2 * std),
+        shift > avg + 2 * std,
+    ]
+    return np.select(conditions, BANDS, default='NULL')
+
+
+def encode_minutes(model, texts, batch_size):
+    '''
+    Embeds the non-empty minutes, leaving empty ones as NaN like EmbeddingStore.embed(). Returns (embeddings, seconds)
+    '''
+    has_text = np.array([bool(text) for text in texts])
+    start_time = time.perf_counter()
+    encoded = model.encode([text for text in texts if text], batch_size=batch_size, convert_to_numpy=True)
+    secs = time.perf_counter() - start_time
+
+    embeddings = np.full((len(texts), encoded.shape[1]), np.nan, dtype=np.float32)
+    embeddings[has_text] = encoded
+    return embeddings, secs
+
+
+def main(max_videos, backends, store_dtypes, batch_sizes, context_windows):
+    load_dotenv()
+    df = semantic_shift_job.fetch_unscored_minutes(os.getenv('DBL_URL'), rescore_all=True)
+    df = df[df['video_id'].isin(df['video_id'].drop_duplicates().head(max_videos))].reset_index(drop=True)
+
+    texts = np.where(df['duration_text_coverage_pct'] < 0.50, '', df['text']).tolist()
+    print(f"{df['video_id'].nunique()} videos | {len(df)} minutes | {sum(map(bool, texts))} with text")
+
+    speed = []
+    accuracy = []
+    baseline = None
+    for backend in [BASELINE[0], *[b for b in backends if b != BASELINE[0]]]:
+        start_time = time.perf_counter()
+        try:
+            model = embedding_store.get_model(embedding_store.MODEL_NAME, backend)
+        except ImportError as e:
+            print(f'Skipping {backend}: {e}')
+            continue
+        load_secs = time.perf_counter() - start_time
+        encode_minutes(model, texts[:batch_sizes[0]], batch_sizes[0]) # warm up
+
+        for batch_size in batch_sizes:
+            embeddings, secs = encode_minutes(model, texts, batch_size)
+            speed.append({
+                'backend': backend,
+                'batch_size': batch_size,
+                'load_secs': round(load_secs, 1),
+                'encode_secs': round(secs, 2),
+                'minutes_per_sec': round(sum(map(bool, texts)) / secs, 1),
+            })
+            print(speed[-1])
+
+        valid = ~np.isnan(embeddings).all(axis=1)
+        for store_dtype in [BASELINE[1], *[d for d in store_dtypes if d != BASELINE[1]]]:
+            # What EmbeddingStore would hand back after storing the embeddings as store_dtype
+            vectors, scales = embedding_store.quantise(embeddings[valid], store_dtype)
+            stored = embeddings.copy()
+            stored[valid] = embedding_store.dequantise(vectors, scales)
+
+            shifts = content_mapping.video_transcript_semantic_shift(df, context_windows, embeddings=stored)
+            if baseline is None:
+                baseline_embeddings, baseline = stored, shifts
+
+            cosine = np.sum(stored[valid] * baseline_embeddings[valid], axis=1) / (
+                np.linalg.norm(stored[valid], axis=1) * np.linalg.norm(baseline_embeddings[valid], axis=1)
+            )
+
+            row = {
+                'backend': backend,
+                'store_dtype': store_dtype,
+                'bytes_per_vector': vectors.shape[1] * vectors.itemsize + (4 if scales is not None else 0),
+                'embedding_cosine_mean': round(float(cosine.mean()), 5),
+                'embedding_cosine_min': round(float(cosine.min()), 5),
+            }
+            for k in context_windows:
+                diff = np.abs(shifts[f'semantic_shift_{k}m'] - baseline[f'semantic_shift_{k}m'])
+                row[f'shift_{k}m_mean_abs_diff'] = round(float(np.nanmean(diff)), 5)
+                row[f'shift_{k}m_max_abs_diff'] = round(float(np.nanmax(diff)), 5)
+
+            band_window = f'semantic_shift_{context_windows[0]}m'
+            bands = semantic_shift_bands(shifts[band_window].to_numpy())
+            baseline_bands = semantic_shift_bands(baseline[band_window].to_numpy())
+            row[f'band_{context_windows[0]}m_changed_pct'] = round(float(np.mean(bands != baseline_bands)) * 100, 2)
+
+            accuracy.append(row)
+            print(row)
+
+    print(pd.DataFrame(speed).to_string(index=False))
+    print(pd.DataFrame(accuracy).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--max-videos',
+        type=int,
+        default=20
+    )
+
+    parser.add_argument(
+        '--backends',
+        nargs='+',
+        choices=embedding_store.BACKENDS,
+        default=list(embedding_store.BACKENDS)
+    )
+
+    parser.add_argument(
+        '--store-dtypes',
+        nargs='+',
+        choices=list(embedding_store.STORE_DTYPES),
+        default=list(embedding_store.STORE_DTYPES)
+    )
+
+    parser.add_argument(
+        '--batch-sizes',
+        type=int,
+        nargs='+',
+        default=[16, 64, 256]
+    )
+
+    parser.add_argument(
+        '--context-windows',
+        type=int,
+        nargs='+',
+        default=[5, 1],
+        help='The first one is used for the change bands'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        main(args.max_videos, args.backends, args.store_dtypes, args.batch_sizes, args.context_windows)
+    finally:
+        db_pool.close_pools()
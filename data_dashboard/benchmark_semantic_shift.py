@@ -0,0 +1,112 @@
+'''
+Micro-benchmark of semantic shift scoring: the original per-minute loop in content_mapping.video_transcript_semantic_shift()
+against semantic_shift.rolling_semantic_shift()
+
+Synthetic embeddings are used (normalised random vectors, with some minutes left empty as NaN), so no model is needed.
+The loop is run once per context window, as it used to be, and the rolling version once for all of them. It also reports
+the largest difference between the two sets of scores and whether they agree on which minutes are scored.
+
+The loop's sklearn cosine_similarity() call is swapped for the same calculation in numpy, so it runs without sklearn.
+
+Usage:
+    python data_dashboard/benchmark_semantic_shift.py --minutes 1000 10000 100000 --context-windows 5 4 3 2 1
+'''
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from semantic_shift import rolling_semantic_shift
+
+
+def per_minute_loop_shift(embeddings, context_window):
+    '''
+    The scoring loop as it was written in video_transcript_semantic_shift() before it was vectorised, kept as the baseline
+    '''
+    topic_shift = [0] * context_window
+    for i in range(context_window, len(embeddings)):
+        current = embeddings[i]
+        window = embeddings[i-context_window:i]
+
+        valid_embeddings = [
+            e for e in window
+            if not np.isnan(e).all()
+        ]
+
+        if (context_window == 5) and (len(valid_embeddings) >= 3):
+            avg = np.mean(valid_embeddings, axis=0)
+        elif (context_window == 4) and (len(valid_embeddings) >= 2):
+            avg = np.mean(valid_embeddings, axis=0)
+        elif (context_window in [3, 2, 1]) and (len(valid_embeddings) >= 1):
+            avg = np.mean(valid_embeddings, axis=0)
+        else:
+            avg = np.nan
+
+        if (np.isnan(current).all() == True) or (np.isnan(avg).all() == True):
+            topic_shift.append(None)
+        else:
+            similarity = np.dot(current, avg) / (np.linalg.norm(current) * np.linalg.norm(avg))
+            topic_shift.append(1 - similarity)
+
+    return np.array(topic_shift, dtype=np.float64)
+
+
+def synthetic_embeddings(minutes, rng, dimensions=384, empty_share=0.2):
+    # Consecutive minutes drift slowly, so scores look more like a real stream than pure noise
+    embeddings = np.cumsum(rng.normal(size=(minutes, dimensions)), axis=0).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings[rng.random(minutes) < empty_share] = np.nan
+    return embeddings
+
+
+def main(minutes_list, context_windows):
+    rng = np.random.default_rng(0)
+
+    results = []
+    for minutes in minutes_list:
+        embeddings = synthetic_embeddings(minutes, rng)
+        video_ids = np.zeros(minutes, dtype=int)
+
+        start_time = time.perf_counter()
+        baseline = {k: per_minute_loop_shift(embeddings, k) for k in context_windows}
+        baseline_secs = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        rolling = rolling_semantic_shift(embeddings, video_ids, context_windows)
+        rolling_secs = time.perf_counter() - start_time
+
+        results.append({
+            'minutes': minutes,
+            'windows': len(context_windows),
+            'loop_secs': round(baseline_secs, 3),
+            'rolling_secs': round(rolling_secs, 3),
+            'speedup': round(baseline_secs / rolling_secs, 1),
+            'same_minutes_scored': all(np.array_equal(np.isnan(baseline[k]), np.isnan(rolling[k])) for k in context_windows),
+            'max_abs_diff': float(max(np.nanmax(np.abs(baseline[k] - rolling[k]), initial=0) for k in context_windows)),
+        })
+        print(results[-1])
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--minutes',
+        type=int,
+        nargs='+',
+        default=[1000, 10000, 100000]
+    )
+
+    parser.add_argument(
+        '--context-windows',
+        type=int,
+        nargs='+',
+        default=[5, 4, 3, 2, 1]
+    )
+
+    args = parser.parse_args()
+
+    main(args.minutes, args.context_windows)
@@ -5,8 +5,12 @@ import numpy as np
 import math
 import os
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_preprocessing'))
+import transcript_processing
+import embedding_store
+import semantic_shift
 
 load_dotenv()
 
@@ -41,7 +45,7 @@ def video_transcript_convert(id):
     3. Identify gaps between consecutive transcript segments and create empty rows to represent periods where no transcript
     text exists (typically due to audio dropouts, livestream issues, or transcript extraction failures)
 
-    4. Split transcript segments that span multiple 60-second buckets.
+    4. Split transcript segments that span multiple 60-second buckets (any number of them).
     Example: 354.12 -> 368.08
     Becomes: 354.12 -> 360.00 and 360.00 -> 368.08
     This ensures each transcript segment belongs entirely to a single 60-second bucket and prevents text from being incorrectly 
@@ -84,117 +88,53 @@ def video_transcript_convert(id):
 
     video_transcript_path = f'data_dashboard/video_transcripts/{id}.txt'
 
-    df_transcript = pd.read_csv(
-        video_transcript_path,
-        sep=']',
-        names=['time', 'text']
-    )
-
-    df_transcript['video_id'] = id
-
-    df_transcript['time'] = df_transcript['time'].str.replace('[', '')
-
-    df_transcript[['start_time', 'end_time']] = (
-        df_transcript['time']
-        .str.split('->', expand=True)
-        .astype(float)
-    )
-
-    empty_rows = []
-
-    for i in range(len(df_transcript) - 1): # this current logic won't work for the last row, as there's no next_start for it, so we need '-1'
-
-        current_end = df_transcript.iloc[i]['end_time']
-        next_start = df_transcript.iloc[i+1]['start_time']
+    df_transcript = transcript_processing.read_transcript_file(video_transcript_path, id)
 
-        if current_end != next_start:
-            empty_rows.append({
-                'start_time': current_end,
-                'end_time': next_start,
-                'text': '',
-                'video_id': id
-            })
-
-    df_empty_rows = pd.DataFrame(empty_rows)
-
-    df_transcript = pd.concat([df_transcript, df_empty_rows]).sort_values('start_time', ascending=True)
+    df_transcript = transcript_processing.insert_gap_rows(df_transcript, id)
 
     '''
     354.12 -> 368.08 falls in 2 buckets - 300 - 360 and 360 - 420
     Need to split it like this - 354.12-360 goes into the bucket 300-360 and 360-368.08 goes into the bucket 360-420
 
-    First need to identify whether a timestamp crosses multiple buckets. If the lower boundary of the 'multiple of 60' bucket is the same number for start time 
-    and end time then it doesn't.
+    Gap rows can span more than 2 buckets, so every row is split at every 60 second boundary it crosses,
+    then the text and valid duration are summed per bucket
     '''
-    df_transcript['start_time_lb_60'] = (df_transcript['start_time'] // 60 * 60).astype(int)
-    df_transcript['end_time_lb_60'] = (df_transcript['end_time'] // 60 * 60).astype(int)
-    df_transcript['multiple_bucket_span'] = df_transcript['start_time_lb_60'] != df_transcript['end_time_lb_60']
-
-    df_transcript_multi_span_one = df_transcript[df_transcript['multiple_bucket_span'] == True]
-    df_transcript_multi_span_one['end_time'] = df_transcript_multi_span_one['end_time_lb_60']
-
-    df_transcript_multi_span_two = df_transcript[df_transcript['multiple_bucket_span'] == True]
-    df_transcript_multi_span_two['start_time'] = df_transcript_multi_span_two['end_time_lb_60']
-
-    df_transcript_single_span = df_transcript[df_transcript['multiple_bucket_span'] == False]
+    df_transcript_grouped = transcript_processing.transcript_buckets(df_transcript, bucket_secs=60)
 
-    df_transcript_ts_update = (
-        pd.concat([df_transcript_multi_span_one, df_transcript_multi_span_two, df_transcript_single_span])
-        .sort_values('start_time', ascending=True)
-    )[['time', 'text', 'video_id', 'start_time', 'end_time']]
-
-    df_transcript_ts_update['duration_secs'] = df_transcript_ts_update['end_time'] - df_transcript_ts_update['start_time']
-
-    df_transcript_ts_update['duration_secs_valid'] = np.where(
-        df_transcript_ts_update['text'] != '',
-        df_transcript_ts_update['duration_secs'],
-        0
-    )
+    # df_comb = (
+    #     df[df['video_id'] == id]
+    #     .merge(df_transcript_grouped, left_on=['video_id', 'livestream_position'], right_on=['video_id', 'start_time_lb_60'], how='left')
+    # )[['video_id', 'livestream_position', 'peak_concurrent_viewers', 'average_concurrent_viewers', 'text', 'duration_secs_valid', 'duration_text_coverage_pct']]
 
-    df_transcript_ts_update['start_time_lb_60'] = ((
-        df_transcript_ts_update['start_time'] // 60 * 60)
-        .astype(int) 
-    ) # check which lower boundary of 60 seconds this belongs in
+    df_transcript_grouped['text'] = df_transcript_grouped['text'].fillna('')
 
-    df_transcript_ts_update['start_time_ub_60'] = (((
-        df_transcript_ts_update['start_time'] // 60 * 60) + 60)
-        .astype(int)
-    ) # check which upper boundary of 60 seconds this belongs in
+    return df_transcript_grouped
 
-    df_transcript_ts_update['minute_boundaries'] = (
-        df_transcript_ts_update['start_time_lb_60'].astype(str)
-        + '-'
-        + df_transcript_ts_update['start_time_ub_60'].astype(str)
-    )
 
-    # Example of 2 60s boundaries
-    # df_transcript_ts_update[df_transcript_ts_update['time'] == '117.00 -> 125.00']
+def minute_embeddings(df, store=None):
+    '''
+    Embeds each minute's transcript text through the embedding store, so minutes already encoded in an earlier run
+    (or for another context window) aren't encoded again. Minutes with under 50% text coverage count as empty
+    and get a row of NaN
 
-    df_transcript_grouped = (
-        df_transcript_ts_update
-        .groupby(
-            ['video_id', 'start_time_lb_60', 'start_time_ub_60', 'minute_boundaries'],
-            as_index=False
-        )
-        .agg(
-            text=('text', ''.join),
-            duration_secs_valid=('duration_secs_valid', 'sum')
-        )
-    )
+    Params:
+    df: pd.DataFrame
+        Minute buckets from video_transcript_convert(), for any number of videos
+    store: embedding_store.EmbeddingStore
+        Defaults to the store in data_dashboard/embedding_store
 
-    df_transcript_grouped['duration_text_coverage_pct'] = df_transcript_grouped['duration_secs_valid'] / 60
+    Returns: np.ndarray
+        One embedding per row of df
+    '''
 
-    # df_comb = (
-    #     df[df['video_id'] == id]
-    #     .merge(df_transcript_grouped, left_on=['video_id', 'livestream_position'], right_on=['video_id', 'start_time_lb_60'], how='left')
-    # )[['video_id', 'livestream_position', 'peak_concurrent_viewers', 'average_concurrent_viewers', 'text', 'duration_secs_valid', 'duration_text_coverage_pct']]
+    store = store or embedding_store.EmbeddingStore()
 
-    df_transcript_grouped['text'] = df_transcript_grouped['text'].fillna('')
+    text = np.where(df['duration_text_coverage_pct'] < 0.50, '', df['text'])
 
-    return df_transcript_grouped
+    return store.embed(df['video_id'], df['start_time_lb_60'], text)
 
 
-def video_transcript_semantic_shift(df, context_window):
+def video_transcript_semantic_shift(df, context_windows, min_valid_ratios=None, embeddings=None):
     '''
     Calculate semnatic topic shifts throughout a livestream 
 
@@ -211,20 +151,34 @@ def video_transcript_semantic_shift(df, context_window):
     The resulting semantic shift scores can be analysed alongside viewer metrics to identify 
     whether a topic changes are associated with increases or decreases in audience retention.
 
+    All context windows are worked out together from running sums over the embedding matrix (see
+    semantic_shift.rolling_semantic_shift()), so there's no loop over minutes and no merge per window
+
     Params:
     df: pd.DataFrame
-        Cleaned transcript file segmented by minute buckets with corresponding text and viewer metrics. Converted into a dataframe
+        Cleaned transcript file segmented by minute buckets with corresponding text and viewer metrics. Converted into a dataframe.
+        Can hold several videos, as long as each video's minutes are together and in order
 
-    context_window: int
-        Compare the current minute to the average of the previous N minutes. 
+    context_windows: int or list
+        Compare the current minute to the average of the previous N minutes, for each N given. 
         context_window = 1 compares the current minute to the immediately preceding minute. This measures short term semantic movement.
         context_window = 5 compares the current minute to the average of previous 5 minutes. This measures movement to the recent discussion
 
+    min_valid_ratios: float or list
+        Share of the previous N minutes that must have text for the current minute to be scored, either one for all windows
+        or one per window. Defaults to 3 of 5, 2 of 4, 1 of 3, 1 of 2, 1 of 1 and half of any other window
+
+    embeddings: np.ndarray
+        Optional embeddings for each row of df from minute_embeddings(). If not given they're looked up in (or added to) the embedding store
+
     Returns: pd.DataFrame
-        Livestream min by min metrics merged with transcript text per min and semantic shift scores
+        Livestream min by min metrics merged with transcript text per min and a semantic_shift_{N}m column per context window
     
     '''
 
+    if np.isscalar(context_windows):
+        context_windows = [context_windows]
+
     df = df.copy()
 
     df['text'] = (
@@ -234,137 +188,44 @@ def video_transcript_semantic_shift(df, context_window):
         )
     )
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    embeddings = model.encode(
-        df['text'].tolist(),
-        convert_to_numpy=True
-    )
+    if embeddings is None:
+        embeddings = minute_embeddings(df)
+    embeddings = np.array(embeddings, dtype=np.float32) # copy, so the caller's embeddings aren't changed below
 
-    # Change the embedding vectors to 0, for rows where text is ''
-    mask = df['text'].eq('')
+    # Change the embedding vectors to NaN, for rows where text is ''
+    mask = df['text'].eq('').to_numpy()
     embeddings[mask] = np.nan
 
-    # Compare embedding vectors of current vs average of previous 5
-    # Need the first 5 to begin with 0 as there's no previous average to compare with
-    topic_shift = [0] * context_window
-    for i in range(context_window, len(embeddings)):
-        # print(i)
-        current = embeddings[i]
-        window = embeddings[i-context_window:i]
-
-        valid_embeddings = [
-            e for e in window
-            if not np.isnan(e).all()
-        ]
-
-        if (context_window == 5) and (len(valid_embeddings) >= 3):
-            avg = np.mean(
-                valid_embeddings,
-                axis=0
-            )
-
-        elif (context_window == 4) and (len(valid_embeddings) >= 2):
-            avg = np.mean(
-                valid_embeddings,
-                axis=0
-            )
-
-        elif (context_window in [3, 2, 1]) and (len(valid_embeddings) >= 1):
-            avg = np.mean(
-                valid_embeddings,
-                axis=0
-            )
-
-        else:
-            avg = np.nan
-
-        if (np.isnan(current).all() == True) or (np.isnan(avg).all() == True):
-            topic_shift.append(None)
-        else:
-            similarity = cosine_similarity(
-                [current],
-                [avg]
-            )[0][0]
-
-            topic_shift.append(
-                1 - similarity
-            )
-
-    df[f'semantic_shift_{context_window}m'] = topic_shift
+    shifts = semantic_shift.rolling_semantic_shift(embeddings, df['video_id'], context_windows, min_valid_ratios)
+    for context_window, shift in shifts.items():
+        df[f'semantic_shift_{context_window}m'] = shift
 
     return df
 
-query = """
-    with min_viewers as (
-        select
-            video_id
-            , livestream_position 
-            , peak_concurrent_viewers 
-            , average_concurrent_viewers 
-            , row_number() over(partition by video_id, livestream_position order by load_ts desc) as rn
-            
-        from rdv.social_content_sat_min_viewers 
-    )
-
-    , video_details as (
-        select distinct 
-            video_id
-            , video_duration_sec
-        
-        from rdv.social_content_sat_details 
-    )
-
-    , base as (
-        select 
-            mv.video_id
-            , mv.livestream_position 
-            , mv.peak_concurrent_viewers 
-            , mv.average_concurrent_viewers 
-        
-        from min_viewers as mv 
-        
-        left join video_details as vd 
-            on mv.video_id = vd.video_id
-        
-        where 1=1 
-            and mv.rn = 1
-            and video_duration_sec < 5400
-    )
-
-    select *
-    from base
-"""
-
-df_orig = run_sql_query(query)
-ids = ['7JgONHx-7TQ', 'Exf9BUhrUPU', 'iBxZe4V9bCw', 'oW9bkXo8zjc', 'pCHJLbidaZ4']
-
-df_all = []
-for id in ids: 
+def viewer_shift_segments(df):
+    '''
+    Adds the minute on minute change in average viewers (viewer_shift) and buckets it into viewer_shift_segment:
+    Gain (up 2 or more), Retain (within 1 either way) or Dip (down more than 1). Anything else is 'NULL'
 
-    df_transcript_clean = video_transcript_convert(df_orig, id)
-    df_semantic_context_analysis = video_transcript_semantic_shift(df_transcript_clean, 5)
-    df_semantic_local_analysis = video_transcript_semantic_shift(df_transcript_clean, 1)
+    Params:
+    df: pd.DataFrame
+        Min by min metrics for any number of videos, with each video's minutes in order
 
-    df_semantic_shift_all = (
-        df_semantic_context_analysis
-        .merge(df_semantic_local_analysis[['video_id', 'livestream_position', 'semantic_shift_1m']]
-            , on=['video_id', 'livestream_position']
-            , how='left')
-    )
+    Returns: pd.DataFrame
+    '''
 
-## --------- NEED TO EMBED INTO A FUNCTION
+    df = df.copy()
 
-    df_semantic_shift_all['viewer_shift'] = (
-        df_semantic_shift_all
+    df['viewer_shift'] = (
+        df
         .groupby('video_id')['average_concurrent_viewers']
         .diff()
     )
 
-    df_semantic_shift_all['viewer_shift_segment'] = np.select(
-        [(df_semantic_shift_all['viewer_shift'] >= 2),
-        (df_semantic_shift_all['viewer_shift'].between(-1, 1)), 
-        (df_semantic_shift_all['viewer_shift'] < -1), 
+    df['viewer_shift_segment'] = np.select(
+        [(df['viewer_shift'] >= 2),
+        (df['viewer_shift'].between(-1, 1)), 
+        (df['viewer_shift'] < -1), 
         ],
 
         ['Gain', 
@@ -375,73 +236,127 @@ for id in ids:
         default='NULL'
     ) 
 
-    df_all.append(df_semantic_shift_all)
+    return df
 
-df_all = pd.concat(df_all, ignore_index=True)
+if __name__ == "__main__":
 
-avg = df_all[df_all['semantic_shift_5m'] != 0]['semantic_shift_5m'].mean()
-std = df_all[df_all['semantic_shift_5m'] != 0]['semantic_shift_5m'].std()
+    # Ad hoc look at a few videos. Every video is scored into bdv.fct_video_semantic_shift by semantic_shift_job.py
 
-# 1 SD boundaries 
-lower_1sd = avg - std 
-upper_1sd = avg + std 
+    query = """
+        with min_viewers as (
+            select
+                video_id
+                , livestream_position 
+                , peak_concurrent_viewers 
+                , average_concurrent_viewers 
+                , row_number() over(partition by video_id, livestream_position order by load_ts desc) as rn
 
-# 2 SD boundaries 
-lower_2sd = avg - 2 * std
-upper_2sd = avg + 2 * std
+            from rdv.social_content_sat_min_viewers 
+        )
 
-conditions = [
-    df_all['semantic_shift_5m'] < lower_2sd, 
-    (df_all['semantic_shift_5m'] >= lower_2sd) & (df_all['semantic_shift_5m'] < lower_1sd), 
-    (df_all['semantic_shift_5m'] >= lower_1sd) & (df_all['semantic_shift_5m'] <= upper_1sd), 
-    (df_all['semantic_shift_5m'] > upper_1sd) & (df_all['semantic_shift_5m'] <= upper_2sd), 
-    df_all['semantic_shift_5m'] > upper_2sd, 
-]
+        , video_details as (
+            select distinct 
+                video_id
+                , video_duration_sec
 
-bands = [
-    'Very Low Change',
-    'Low Change', 
-    'Moderate Change', 
-    'High Change',
-    'Very High Change'
-]
+            from rdv.social_content_sat_details 
+        )
 
-df_all['semantic_shift_5m_seg'] = np.select(
-    conditions,
-    bands,
-    default='NULL'
-) 
+        , base as (
+            select 
+                mv.video_id
+                , mv.livestream_position 
+                , mv.peak_concurrent_viewers 
+                , mv.average_concurrent_viewers 
 
-df_all.to_clipboard()
+            from min_viewers as mv 
 
+            left join video_details as vd 
+                on mv.video_id = vd.video_id
 
+            where 1=1 
+                and mv.rn = 1
+                and video_duration_sec < 5400
+        )
 
+        select *
+        from base
+    """
 
+    df_orig = run_sql_query(query)
+    ids = ['7JgONHx-7TQ', 'Exf9BUhrUPU', 'iBxZe4V9bCw', 'oW9bkXo8zjc', 'pCHJLbidaZ4']
 
+    # Merge each video's minute buckets with its min-level viewer numbers
+    df_transcripts_all = pd.concat(
+        [
+            df_orig[df_orig['video_id'] == id]
+            .merge(video_transcript_convert(id), left_on=['video_id', 'livestream_position'], right_on=['video_id', 'start_time_lb_60'], how='left')
+            for id in ids
+        ],
+        ignore_index=True
+    )
+    df_transcripts_all['text'] = df_transcripts_all['text'].fillna('')
+    df_transcripts_all['start_time_lb_60'] = df_transcripts_all['livestream_position']
+
+    # Embed every minute of every video in one go. Minutes already in the store from earlier runs aren't encoded again
+    store = embedding_store.EmbeddingStore()
+    embeddings_all = minute_embeddings(df_transcripts_all, store)
+    print(store.summary())
+
+    # Scores for every video and context window in one pass. Windows don't reach back across videos
+    df_all = video_transcript_semantic_shift(df_transcripts_all, [5, 1], embeddings=embeddings_all)
+
+    df_all = viewer_shift_segments(df_all)
+
+    avg = df_all[df_all['semantic_shift_5m'] != 0]['semantic_shift_5m'].mean()
+    std = df_all[df_all['semantic_shift_5m'] != 0]['semantic_shift_5m'].std()
+
+    # 1 SD boundaries 
+    lower_1sd = avg - std 
+    upper_1sd = avg + std 
+
+    # 2 SD boundaries 
+    lower_2sd = avg - 2 * std
+    upper_2sd = avg + 2 * std
+
+    conditions = [
+        df_all['semantic_shift_5m'] < lower_2sd, 
+        (df_all['semantic_shift_5m'] >= lower_2sd) & (df_all['semantic_shift_5m'] < lower_1sd), 
+        (df_all['semantic_shift_5m'] >= lower_1sd) & (df_all['semantic_shift_5m'] <= upper_1sd), 
+        (df_all['semantic_shift_5m'] > upper_1sd) & (df_all['semantic_shift_5m'] <= upper_2sd), 
+        df_all['semantic_shift_5m'] > upper_2sd, 
+    ]
+
+    bands = [
+        'Very Low Change',
+        'Low Change', 
+        'Moderate Change', 
+        'High Change',
+        'Very High Change'
+    ]
+
+    df_all['semantic_shift_5m_seg'] = np.select(
+        conditions,
+        bands,
+        default='NULL'
+    ) 
 
-######## IMAM HELP
+    df_all.to_clipboard()
 
-id = 'fget.io_1781683202574'
 
-video_transcript_path = f'data_dashboard/video_transcripts/{id}.txt'
 
-df_transcript = pd.read_csv(
-    video_transcript_path,
-    sep=']',
-    names=['time', 'text']
-)
 
-df_transcript['video_id'] = id
 
-df_transcript['time'] = df_transcript['time'].str.replace('[', '')
 
-df_transcript[['start_time', 'end_time']] = (
-    df_transcript['time']
-    .str.split('->', expand=True)
-    .astype(float)
-)
+    ######## IMAM HELP
+
+    id = 'fget.io_1781683202574'
+
+    video_transcript_path = f'data_dashboard/video_transcripts/{id}.txt'
+
+    df_transcript = transcript_processing.read_transcript_file(video_transcript_path, id)
 
-df_imam = ''.join(df_transcript['text'].astype(str))
+    df_imam = ''.join(df_transcript['text'].astype(str))
 
-pd.Series([df_imam]).to_clipboard()
+    pd.Series([df_imam]).to_clipboard()
 
@@ -0,0 +1,390 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+STORE_DIR = 'data_dashboard/embedding_store'
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Ways of running the model on CPU:
+# torch - the sentence transformer as it comes, in float32
+# torch-int8 - the same with its Linear layers dynamically quantised to int8
+# onnx - exported to ONNX and run with ONNX Runtime
+# onnx-int8 - the int8 quantised ONNX export from the model's hub repo (ONNX_INT8_FILE)
+# The onnx backends need ONNX Runtime and optimum: pip install sentence-transformers[onnx]. Only torch is in
+# requirements.txt and offered by semantic_shift_job.py until the others are benchmarked (see benchmark_embedding_backends.py)
+BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+ONNX_INT8_FILE = 'onnx/model_quint8_avx2.onnx'
+
+# How embeddings are kept on disk, and the matrix file extension for each. int8 vectors get a float32 scale each
+STORE_DTYPES = {'float32': 'f32', 'float16': 'f16', 'int8': 'i8'}
+
+# Rows copied at a time when compacting the matrix, so it's never read into memory whole
+COMPACT_CHUNK_ROWS = 65536
+
+# One loaded model per name and backend, shared by everything in the process
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_model(model_name, backend):
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+
+    if backend == 'torch-int8':
+        import torch
+        return torch.quantization.quantize_dynamic(SentenceTransformer(model_name, device='cpu'), {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend in ('onnx', 'onnx-int8'):
+        # sentence-transformers only says the extras are missing with a bare Exception, so check for them up front
+        try:
+            import optimum.onnxruntime
+        except ImportError:
+            raise ImportError('the onnx backends need the ONNX extras: pip install sentence-transformers[onnx]')
+
+    if backend == 'onnx':
+        return SentenceTransformer(model_name, backend='onnx')
+
+    if backend == 'onnx-int8':
+        return SentenceTransformer(model_name, backend='onnx', model_kwargs={'file_name': ONNX_INT8_FILE})
+
+    raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+
+
+def get_model(model_name=MODEL_NAME, backend='torch'):
+    '''
+    Returns a loaded sentence transformer, loading it the first time it's asked for in this process
+    '''
+    with _models_lock:
+        model = _models.get((model_name, backend))
+        if model is None:
+            model = _models[(model_name, backend)] = load_model(model_name, backend)
+
+    return model
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def quantise(embeddings, dtype):
+    '''
+    Converts float embeddings to the store dtype. Returns (vectors, scales), where scales is None unless dtype is int8.
+    int8 vectors are scaled per vector so their largest component maps to 127
+    '''
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype != 'int8':
+        return embeddings.astype(dtype), None
+
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1
+    vectors = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+
+    return vectors, scales.astype(np.float32)
+
+
+def dequantise(vectors, scales=None):
+    '''
+    Converts stored vectors back to float32 embeddings
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if scales is None:
+        return vectors
+
+    return vectors * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+class EmbeddingStore:
+
+    '''
+    Persistent store of per-minute transcript embeddings, so each minute of text is only ever encoded once
+
+    Embeddings are kept in a float32 matrix on disk (one file per model, read as a numpy memmap), with a SQLite index
+    mapping (video_id, minute_boundaries_lb, model_name) to the text hash and the matrix row holding its embedding.
+    When a minute's text changes (e.g. the transcript was redone), its hash no longer matches and it's encoded again
+    into a new row
+
+    Every minute that's missing or changed is encoded in a single model.encode() call, however many videos they come from.
+    The model is only loaded if something needs encoding
+
+    A minute whose text changed leaves its old row in the matrix with nothing pointing at it. summary() reports the share of
+    rows orphaned this way and compact() rewrites the matrix without them
+
+    Embeddings from different backends or store dtypes aren't mixed - each combination other than torch and float32
+    is kept under its own key (model_name:backend:store_dtype) with its own matrix file. float16 halves the size of the
+    matrix and int8 quarters it (plus a float32 scale per vector, in a .scale file next to it).
+    benchmark_embedding_backends.py measures what each one does to speed and to the semantic shift scores
+
+    Args:
+        store_dir (str): Directory for the index and embedding matrices. Created if it doesn't exist
+        model_name (str): Sentence transformer model
+        batch_size (int): Batch size passed to model.encode()
+        backend (str): One of BACKENDS
+        store_dtype (str): float32, float16 or int8
+
+    '''
+
+    def __init__(self, store_dir=STORE_DIR, model_name=MODEL_NAME, batch_size=64, backend='torch', store_dtype='float32'):
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        if store_dtype not in STORE_DTYPES:
+            raise ValueError(f"store_dtype must be one of {', '.join(STORE_DTYPES)}")
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.backend = backend
+        self.store_dtype = store_dtype
+        self.store_key = model_name if (backend, store_dtype) == ('torch', 'float32') else f'{model_name}:{backend}:{store_dtype}'
+        self.matrix_path = os.path.join(store_dir, f"{self.store_key.replace('/', '--').replace(':', '--')}.{STORE_DTYPES[store_dtype]}")
+        self.scale_path = f'{self.matrix_path}.scale'
+        self.conn = sqlite3.connect(os.path.join(store_dir, 'index.sqlite3'))
+        self.hits = 0
+        self.encoded = 0
+
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                video_id TEXT NOT NULL,
+                minute_boundaries_lb INTEGER NOT NULL,
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                PRIMARY KEY (video_id, minute_boundaries_lb, model_name)
+            )
+            """
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS models (model_name TEXT PRIMARY KEY, dimensions INTEGER NOT NULL)')
+        # A row here means the index was remapped by compact() but the compacted files may not have been moved into place yet
+        self.conn.execute('CREATE TABLE IF NOT EXISTS compactions (model_name TEXT PRIMARY KEY)')
+        self.conn.commit()
+
+        if self.conn.execute('SELECT 1 FROM compactions WHERE model_name = ?', (self.store_key,)).fetchone():
+            self.finish_compaction()
+
+    def dimensions(self):
+        row = self.conn.execute('SELECT dimensions FROM models WHERE model_name = ?', (self.store_key,)).fetchone()
+        return row[0] if row else None
+
+    def stored_rows(self):
+        '''
+        Number of complete rows in the matrix file (and, for int8, the scale file)
+        '''
+        dimensions = self.dimensions()
+        if dimensions is None or not os.path.exists(self.matrix_path):
+            return 0
+
+        rows = os.path.getsize(self.matrix_path) // (np.dtype(self.store_dtype).itemsize * dimensions)
+        if self.store_dtype == 'int8':
+            rows = min(rows, os.path.getsize(self.scale_path) // 4 if os.path.exists(self.scale_path) else 0)
+
+        return rows
+
+    def matrix(self):
+        '''
+        The stored vectors as a read-only memmap in the store dtype, one row per stored minute
+        '''
+        dimensions = self.dimensions()
+        rows = self.stored_rows()
+        if rows == 0:
+            return np.empty((0, dimensions or 0), dtype=self.store_dtype)
+
+        return np.memmap(self.matrix_path, dtype=self.store_dtype, mode='r', shape=(rows, dimensions))
+
+    def scales(self):
+        '''
+        The per-vector scales of an int8 store as a read-only memmap, or None for float stores
+        '''
+        if self.store_dtype != 'int8':
+            return None
+
+        rows = self.stored_rows()
+        if rows == 0:
+            return np.empty(0, dtype=np.float32)
+
+        return np.memmap(self.scale_path, dtype=np.float32, mode='r', shape=(rows,))
+
+    def vectors(self, rows):
+        '''
+        float32 embeddings of the given matrix rows
+        '''
+        scales = self.scales()
+        return dequantise(self.matrix()[rows], None if scales is None else scales[rows])
+
+    def append(self, embeddings):
+        '''
+        Adds embeddings to the end of the matrix file and returns the row number of the first one
+        '''
+        if self.dimensions() is None:
+            self.conn.execute('INSERT INTO models (model_name, dimensions) VALUES (?, ?)', (self.store_key, embeddings.shape[1]))
+
+        vectors, scales = quantise(embeddings, self.store_dtype)
+
+        # Drop any partly written rows left by a run that stopped mid-append, so the matrix and scales line up
+        first_row = self.stored_rows()
+        for path, row_bytes in [(self.matrix_path, vectors.itemsize * vectors.shape[1]), (self.scale_path, 4)]:
+            if os.path.exists(path) and os.path.getsize(path) > first_row * row_bytes:
+                os.truncate(path, first_row * row_bytes)
+
+        with open(self.matrix_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+        if scales is not None:
+            with open(self.scale_path, 'ab') as f:
+                f.write(scales.tobytes())
+
+        return first_row
+
+    def embed(self, video_ids, minute_boundaries_lbs, texts):
+
+        '''
+        Returns the embedding of every minute, encoding only the ones not already stored with the same text
+
+        Args:
+            video_ids: Youtube video ID of each minute
+            minute_boundaries_lbs: Lower boundary (in seconds) of each minute's bucket
+            texts: Transcript text of each minute. Empty text isn't encoded and gets a row of NaN
+
+        Returns:
+            float32 numpy array with one row per minute
+
+        '''
+
+        keys = [(str(video_id), int(lb)) for video_id, lb in zip(video_ids, minute_boundaries_lbs)]
+        hashes = [text_hash(text) for text in texts]
+
+        # Only the requested videos' minutes are read from the index, not every minute ever stored
+        stored = {}
+        requested_videos = list(dict.fromkeys(video_id for video_id, _ in keys))
+        for start in range(0, len(requested_videos), 500): # keep under SQLite's limit on query parameters
+            batch = requested_videos[start:start+500]
+            for video_id, lb, stored_hash, row in self.conn.execute(
+                f"SELECT video_id, minute_boundaries_lb, text_hash, row FROM embeddings WHERE model_name = ? AND video_id IN ({', '.join('?' * len(batch))})",
+                [self.store_key, *batch]
+            ):
+                stored[(video_id, lb)] = (stored_hash, row)
+
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        to_encode = {} # text -> positions that need it
+        for i, (key, hash_, text) in enumerate(zip(keys, hashes, texts)):
+            if not text:
+                continue
+            if key in stored and stored[key][0] == hash_:
+                rows[i] = stored[key][1]
+                self.hits += 1
+            else:
+                to_encode.setdefault(text, []).append(i)
+
+        if to_encode:
+            new_texts = list(to_encode)
+            new_embeddings = get_model(self.model_name, self.backend).encode(
+                new_texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True
+            )
+            first_row = self.append(new_embeddings)
+
+            index_rows = []
+            for offset, text in enumerate(new_texts):
+                for i in to_encode[text]:
+                    rows[i] = first_row + offset
+                    index_rows.append((*keys[i], self.store_key, hashes[i], first_row + offset))
+
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (video_id, minute_boundaries_lb, model_name, text_hash, row) VALUES (?, ?, ?, ?, ?)',
+                index_rows
+            )
+            self.conn.commit()
+            self.encoded += len(new_texts)
+
+        embeddings = np.full((len(keys), self.dimensions() or 0), np.nan, dtype=np.float32)
+        found = rows >= 0
+        embeddings[found] = self.vectors(rows[found])
+
+        return embeddings
+
+    def referenced_rows(self):
+        '''
+        Matrix rows the index points at, in ascending order
+        '''
+        return np.array(
+            [row for row, in self.conn.execute('SELECT DISTINCT row FROM embeddings WHERE model_name = ? ORDER BY row', (self.store_key,))],
+            dtype=np.int64
+        )
+
+    def orphaned_rows(self):
+        '''
+        Number of matrix rows nothing in the index points at any more
+        '''
+        return self.stored_rows() - len(self.referenced_rows())
+
+    def compact(self, min_orphaned_share=0):
+
+        '''
+        Rewrites the matrix (and scale) file without the orphaned rows, and points the index at the new row numbers
+
+        The compacted files are written next to the live ones first. The index is remapped and a compaction marker
+        stored in the same SQLite transaction, and only then are the files moved into place (see finish_compaction()).
+        If the run stops in between, the next EmbeddingStore opened on the directory finishes the move, so the index
+        and the matrix never disagree
+
+        Args:
+            min_orphaned_share (float): Only compact if at least this share of the stored rows is orphaned
+
+        Returns:
+            Number of rows removed
+
+        '''
+
+        stored = self.stored_rows()
+        referenced = self.referenced_rows()
+        orphaned = stored - len(referenced)
+        if orphaned == 0 or orphaned / stored < min_orphaned_share:
+            return 0
+
+        matrix, scales = self.matrix(), self.scales()
+        outputs = [(f'{self.matrix_path}.compact', matrix)]
+        if scales is not None:
+            outputs.append((f'{self.scale_path}.compact', scales))
+
+        for path, values in outputs:
+            with open(path, 'wb') as f:
+                for start in range(0, len(referenced), COMPACT_CHUNK_ROWS):
+                    f.write(np.ascontiguousarray(values[referenced[start:start+COMPACT_CHUNK_ROWS]]).tobytes())
+        del matrix, scales
+
+        # Rows only ever move down, and in ascending order, so an update never lands on a row that's still to be updated
+        self.conn.executemany(
+            'UPDATE embeddings SET row = ? WHERE model_name = ? AND row = ?',
+            [(new_row, self.store_key, int(old_row)) for new_row, old_row in enumerate(referenced) if new_row != old_row]
+        )
+        self.conn.execute('INSERT OR REPLACE INTO compactions (model_name) VALUES (?)', (self.store_key,))
+        self.conn.commit()
+
+        self.finish_compaction()
+        print(f'Compacted embedding store ({self.store_key}): removed {orphaned} of {stored} rows')
+
+        return orphaned
+
+    def finish_compaction(self):
+        '''
+        Moves the compacted files written by compact() into place, once the index has been remapped to them
+        '''
+        for path in [self.matrix_path, self.scale_path]:
+            if os.path.exists(f'{path}.compact'):
+                os.replace(f'{path}.compact', path)
+
+        self.conn.execute('DELETE FROM compactions WHERE model_name = ?', (self.store_key,))
+        self.conn.commit()
+
+    def summary(self):
+        stored = self.stored_rows()
+        orphaned = self.orphaned_rows()
+        return (
+            f'Embedding store ({self.store_key}): {self.hits} minutes reused | {self.encoded} texts encoded | '
+            f'{orphaned} of {stored} stored rows orphaned ({orphaned / stored if stored else 0:.0%})'
+        )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,95 @@
+import math
+import numpy as np
+
+# Minimum share of the previous N minutes that must have text before minute N+1 is scored, per context window.
+# These reproduce the thresholds the per-row loop used (3 of 5, 2 of 4, 1 of 3, 1 of 2 and 1 of 1)
+DEFAULT_MIN_VALID_RATIOS = {5: 0.6, 4: 0.5, 3: 1/3, 2: 0.5, 1: 1.0}
+DEFAULT_MIN_VALID_RATIO = 0.5
+
+
+def min_valid_counts(context_windows, min_valid_ratios=None):
+    '''
+    Turns minimum-valid ratios into the number of previous minutes that must have text for each context window
+
+    Args:
+        context_windows (list): Context window sizes in minutes
+        min_valid_ratios: None for the defaults, one ratio for every window, or a list with one ratio per window
+
+    Returns:
+        List of ints, one per window
+    '''
+    if min_valid_ratios is None:
+        min_valid_ratios = [DEFAULT_MIN_VALID_RATIOS.get(k, DEFAULT_MIN_VALID_RATIO) for k in context_windows]
+    elif np.isscalar(min_valid_ratios):
+        min_valid_ratios = [min_valid_ratios] * len(context_windows)
+
+    if len(min_valid_ratios) != len(context_windows):
+        raise ValueError(f'Got {len(min_valid_ratios)} min_valid_ratios for {len(context_windows)} context windows')
+
+    # The small tolerance stops float error pushing e.g. 0.6 * 5 = 3.0000000000000004 up to 4
+    return [max(1, math.ceil(ratio * k - 1e-9)) for k, ratio in zip(context_windows, min_valid_ratios)]
+
+
+def rolling_semantic_shift(embeddings, video_ids, context_windows, min_valid_ratios=None):
+
+    '''
+    Semantic shift of every minute against the average of its previous N minutes, for several N in one pass
+
+    Empty minutes are NaN rows in the embedding matrix. They're zeroed, and a running (cumulative) sum is taken of the
+    embeddings and of a valid-minute flag, so the sum and number of valid embeddings over any previous N minutes is the
+    difference of two rows of the running sums, for every minute and window at once. The cosine against the current minute
+    is then a row-wise dot product over the norms
+
+    Rows must be grouped by video and in minute order within each video. Windows don't reach back into the previous video
+
+    Args:
+        embeddings (np.ndarray): One embedding per minute, NaN for minutes without text
+        video_ids: Video ID of each minute
+        context_windows (list): Context window sizes in minutes
+        min_valid_ratios: Share of the previous N minutes that must have text for a minute to be scored.
+            None for the defaults, one ratio for every window, or a list with one ratio per window
+
+    Returns:
+        Dict of window size -> float64 array of 1 - cosine similarity. The first N minutes of each video are 0 as there's
+        nothing before them to compare with, and minutes that are empty or without enough valid previous minutes are NaN
+
+    '''
+
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    video_ids = np.asarray(video_ids)
+    rows = len(embeddings)
+
+    valid = ~np.isnan(embeddings).all(axis=1)
+    values = np.where(valid[:, None], embeddings, 0)
+
+    # Running sums with a leading row of zeros, so the sum over rows [i-k, i) is cumulative[i] - cumulative[i-k]
+    cumulative = np.zeros((rows + 1, embeddings.shape[1]))
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    cumulative_valid = np.concatenate([[0], np.cumsum(valid)])
+
+    # Position of each minute within its own video
+    new_video = np.ones(rows, dtype=bool)
+    new_video[1:] = video_ids[1:] != video_ids[:-1]
+    video_start = np.maximum.accumulate(np.where(new_video, np.arange(rows), 0))
+    position = np.arange(rows) - video_start
+
+    norms = np.sqrt(np.einsum('ij,ij->i', values, values))
+
+    shifts = {}
+    for k, min_valid in zip(context_windows, min_valid_counts(context_windows, min_valid_ratios)):
+        shift = np.zeros(rows)
+        if rows > k:
+            # Previous k minutes of rows k onwards. Cosine similarity doesn't depend on length, so the window sum
+            # scores the same as the mean of its valid embeddings and there's no need to divide by the count
+            window_sum = cumulative[k:rows] - cumulative[:rows-k]
+            window_count = cumulative_valid[k:rows] - cumulative_valid[:rows-k]
+            window_norms = np.sqrt(np.einsum('ij,ij->i', window_sum, window_sum))
+
+            scored = valid[k:] & (window_count >= min_valid) & (window_norms > 0) & (norms[k:] > 0)
+            similarity = np.einsum('ij,ij->i', values[k:], window_sum) / np.where(scored, norms[k:] * window_norms, 1)
+            shift[k:] = np.where(scored, 1 - similarity, np.nan)
+
+        shift[position < k] = 0
+        shifts[k] = shift
+
+    return shifts
@@ -0,0 +1,304 @@
+import os
+import sys
+import argparse
+import time
+from dotenv import load_dotenv
+import pandas as pd
+from psycopg2 import sql
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_preprocessing'))
+import db_pool
+import helper_functions
+import embedding_store
+import content_mapping
+
+SCHEMA = 'bdv'
+TABLE = 'fct_video_semantic_shift'
+
+# Model backends the job can run with. The others in embedding_store.BACKENDS stay in benchmark_embedding_backends.py
+# until their speed and effect on the scores have been measured on the channel's transcripts
+JOB_BACKENDS = ('torch',)
+
+# The embedding store is compacted once this share of its rows is orphaned (left behind by minutes whose text changed)
+COMPACT_ORPHANED_SHARE = 0.25
+
+# Context windows scored for every minute, and the one the change bands are based on
+CONTEXT_WINDOWS = [5, 1]
+BAND_WINDOW = 5
+
+COLUMNS = [
+    'video_id',
+    'livestream_position',
+    'peak_concurrent_viewers',
+    'average_concurrent_viewers',
+    'duration_secs_valid',
+    'duration_text_coverage_pct',
+    *[f'semantic_shift_{k}m' for k in CONTEXT_WINDOWS],
+    'viewer_shift',
+    'viewer_shift_segment',
+]
+
+
+def create_table(cur):
+    '''
+    Creates bdv.fct_video_semantic_shift if it doesn't exist. dbt reads it as a source (see the bdv source in
+    data_pipeline/data_pipeline/models/bdv/_bdv_sources/_bdv_sources.yml), so column changes need making there too
+    '''
+    shift_columns = ''.join(f'semantic_shift_{k}m DOUBLE PRECISION, ' for k in CONTEXT_WINDOWS)
+    cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA};')
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE} (
+            video_id TEXT NOT NULL,
+            livestream_position INTEGER NOT NULL,
+            peak_concurrent_viewers DOUBLE PRECISION,
+            average_concurrent_viewers DOUBLE PRECISION,
+            duration_secs_valid DOUBLE PRECISION,
+            duration_text_coverage_pct DOUBLE PRECISION,
+            {shift_columns}
+            semantic_shift_{BAND_WINDOW}m_seg TEXT,
+            viewer_shift DOUBLE PRECISION,
+            viewer_shift_segment TEXT,
+            load_ts TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (video_id, livestream_position)
+        );
+        """
+    )
+
+
+def fetch_unscored_minutes(dbl_url, rescore_all=False):
+
+    '''
+    Returns the transcript minutes of every video not yet in bdv.fct_video_semantic_shift (or of every video, if rescoring),
+    outer joined to the latest min-level viewer numbers of the same videos
+
+    Args:
+        dbl_url (str): PostgreSQL connection URL
+        rescore_all (bool): Return every video's minutes, not just the unscored ones
+
+    Returns:
+        Dataframe with one row per video and minute, in minute order within each video
+
+    '''
+
+    unscored_filter = '' if rescore_all else f"""
+        and not exists (
+            select 1
+            from {SCHEMA}.{TABLE} as scored
+            where scored.video_id = segment.video_id
+        )
+    """
+
+    transcript_query = f"""
+        select
+            video_id
+            , minute_boundaries_lb::int as livestream_position
+            , duration_secs_valid::float as duration_secs_valid
+            , text
+
+        from bdv.fct_video_transcript_segment as segment
+        where video_id is not null
+            {unscored_filter}
+    """
+
+    viewers_query = """
+        select
+            video_id
+            , livestream_position
+            , peak_concurrent_viewers
+            , average_concurrent_viewers
+
+        from (
+            select
+                video_id
+                , livestream_position
+                , peak_concurrent_viewers
+                , average_concurrent_viewers
+                , row_number() over(partition by video_id, livestream_position order by load_ts desc) as rn
+
+            from rdv.social_content_sat_min_viewers
+            where video_id = any(%s)
+        ) t
+        where rn = 1
+    """
+
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            create_table(cur)
+            conn.commit()
+
+            cur.execute(transcript_query)
+            df_transcript = pd.DataFrame(cur.fetchall(), columns=['video_id', 'livestream_position', 'duration_secs_valid', 'text'])
+
+            cur.execute(viewers_query, (df_transcript['video_id'].unique().tolist(),))
+            df_viewers = pd.DataFrame(cur.fetchall(), columns=['video_id', 'livestream_position', 'peak_concurrent_viewers', 'average_concurrent_viewers'])
+
+    df = (
+        df_viewers
+        .merge(df_transcript, on=['video_id', 'livestream_position'], how='outer')
+        .sort_values(['video_id', 'livestream_position'])
+        .reset_index(drop=True)
+    )
+
+    df['text'] = df['text'].fillna('')
+    df['duration_secs_valid'] = df['duration_secs_valid'].fillna(0)
+    df['duration_text_coverage_pct'] = df['duration_secs_valid'] / 60
+    df['start_time_lb_60'] = df['livestream_position']
+
+    return df
+
+
+def write_scores(dbl_url, df, rescore_all=False):
+
+    '''
+    Writes the scored minutes to bdv.fct_video_semantic_shift and re-bands the whole table, in one transaction
+
+    The change bands are set by how far semantic_shift_5m is from the channel-wide mean, in standard deviations
+    (as in content_mapping.py), so every video's bands are worked out again from the mean and standard deviation
+    of all scored minutes, not just the new ones. The first minutes of each video (scored 0) are left out of both and aren't banded
+
+    Args:
+        dbl_url (str): PostgreSQL connection URL
+        df: Dataframe of scored minutes with the COLUMNS columns
+        rescore_all (bool): Replace the whole table. Otherwise only the videos in df are replaced
+
+    '''
+
+    table = sql.Identifier(SCHEMA, TABLE)
+    shift = sql.Identifier(f'semantic_shift_{BAND_WINDOW}m')
+    band = sql.Identifier(f'semantic_shift_{BAND_WINDOW}m_seg')
+
+    band_query = sql.SQL("""
+        UPDATE {table} AS t
+        SET {band} = CASE
+            WHEN t.{shift} = 0 THEN 'NULL'
+            WHEN t.{shift} < s.avg_shift - 2 * s.std_shift THEN 'Very Low Change'
+            WHEN t.{shift} < s.avg_shift - s.std_shift THEN 'Low Change'
+            WHEN t.{shift} <= s.avg_shift + s.std_shift THEN 'Moderate Change'
+            WHEN t.{shift} <= s.avg_shift + 2 * s.std_shift THEN 'High Change'
+            WHEN t.{shift} > s.avg_shift + 2 * s.std_shift THEN 'Very High Change'
+            ELSE 'NULL'
+        END
+        FROM (
+            SELECT avg({shift}) AS avg_shift, stddev_samp({shift}) AS std_shift
+            FROM {table}
+            WHERE {shift} != 0
+        ) AS s
+    """).format(table=table, band=band, shift=shift)
+
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                if rescore_all:
+                    cur.execute(sql.SQL('TRUNCATE TABLE {}').format(table))
+                else:
+                    cur.execute(sql.SQL('DELETE FROM {} WHERE video_id = any(%s)').format(table), (df['video_id'].unique().tolist(),))
+
+                helper_functions.copy_dataframe(cur, TABLE, df[COLUMNS], target=f'{SCHEMA}.{TABLE}')
+
+                cur.execute(band_query)
+                conn.commit()
+
+            except Exception as e:
+                conn.rollback()
+                raise e
+
+
+def main(mode, store_dir=embedding_store.STORE_DIR, backend='torch', store_dtype='float32', batch_size=64):
+
+    '''
+    Scores the semantic shift of every transcript minute on the channel into bdv.fct_video_semantic_shift, for dashboards to query
+
+    This function:
+    1. Reads bdv.fct_video_transcript_segment for videos not yet scored (every video if mode is truncate),
+    joined to their min-level viewer numbers
+    2. Embeds every minute of every video in a single call through the embedding store, so minutes embedded in an
+    earlier run or by content_mapping.py aren't encoded again. The store is compacted once COMPACT_ORPHANED_SHARE of it is orphaned
+    3. Scores semantic shift over the CONTEXT_WINDOWS for all videos in one pass (see content_mapping.video_transcript_semantic_shift())
+    and the viewer shift segments (see content_mapping.viewer_shift_segments())
+    4. Writes the new videos' rows and re-bands the whole table (see write_scores())
+
+    A video is only scored once in append mode, so a video whose transcript or viewer numbers change afterwards
+    needs a truncate run to be rescored
+
+    Args:
+        mode (str): append (score new videos only) or truncate (rescore every video)
+        store_dir (str): Embedding store directory
+        backend (str): Model backend, one of JOB_BACKENDS
+        store_dtype (str): float32, float16 or int8 - how embeddings are kept in the store
+        batch_size (int): Batch size for encoding
+
+    '''
+
+    load_dotenv()
+    dbl_url = os.getenv('DBL_URL')
+    start_time = time.time()
+
+    rescore_all = mode == 'truncate'
+    df = fetch_unscored_minutes(dbl_url, rescore_all)
+    if df.empty:
+        print('No new videos to score')
+        return
+
+    print(f"Scoring {df['video_id'].nunique()} videos ({len(df)} minutes)")
+
+    store = embedding_store.EmbeddingStore(store_dir, batch_size=batch_size, backend=backend, store_dtype=store_dtype)
+    try:
+        embeddings = content_mapping.minute_embeddings(df, store)
+        print(store.summary())
+        store.compact(min_orphaned_share=COMPACT_ORPHANED_SHARE)
+    finally:
+        store.close()
+
+    df = content_mapping.video_transcript_semantic_shift(df, CONTEXT_WINDOWS, embeddings=embeddings)
+    df = content_mapping.viewer_shift_segments(df)
+
+    write_scores(dbl_url, df, rescore_all)
+
+    print(f"Wrote {len(df)} minutes to {SCHEMA}.{TABLE} in {time.time() - start_time:.1f} seconds")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--mode',
+        choices=['append', 'truncate'],
+        default='append',
+        help='append scores videos not yet in the table. truncate rescores every video'
+    )
+
+    parser.add_argument(
+        '--embedding-store',
+        default=embedding_store.STORE_DIR,
+        help='Directory of the embedding store'
+    )
+
+    parser.add_argument(
+        '--backend',
+        choices=JOB_BACKENDS,
+        default='torch',
+        help='How the model is run. Other backends are added once benchmark_embedding_backends.py has measured them'
+    )
+
+    parser.add_argument(
+        '--store-dtype',
+        choices=list(embedding_store.STORE_DTYPES),
+        default='float32',
+        help='How embeddings are kept in the store. float16 halves its size and int8 quarters it'
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=64,
+        help='Batch size for encoding'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        main(args.mode, args.embedding_store, args.backend, args.store_dtype, args.batch_size)
+    finally:
+        db_pool.close_pools() # print pool stats and close every pooled connection, even if the run failed
@@ -0,0 +1,175 @@
+import sqlite3
+import json
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import httplib2
+
+
+class ResponseCache:
+    '''
+    On-disk store of Youtube Data API responses, backed by a local SQLite file
+
+    One row per request URL holding the response's ETag, headers and body. Counts how many requests were served
+    from disk (the API answered 304 Not Modified) and how many had to be downloaded in full
+
+    Also holds the latest metadata fetched for each video (see fetch_video_data.fetch_video_metadata()), so the daily
+    and weekly runs can share one pass over videos().list for fields that don't change
+
+    Args:
+        path (str): Path to the SQLite file. Created if it doesn't exist
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    etag TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS video_metadata (
+                    video_id TEXT PRIMARY KEY,
+                    item TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.commit()
+
+    def get(self, cache_key):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT etag, headers, content FROM responses WHERE cache_key = ?',
+                (cache_key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        etag, headers, content = row
+        return etag, json.loads(headers), content
+
+    def set(self, cache_key, etag, headers, content):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (cache_key, etag, headers, content, stored_at) VALUES (?, ?, ?, ?, ?)',
+                (cache_key, etag, json.dumps(headers), content, time.time())
+            )
+            self.conn.commit()
+
+    def get_video_metadata(self, video_ids):
+        '''
+        Returns a dict of video ID -> stored metadata JSON string, for the requested videos that are stored
+        '''
+        video_ids = list(video_ids)
+        metadata = {}
+        with self.lock:
+            for i in range(0, len(video_ids), 500): # keep under SQLite's limit on query parameters
+                batch = video_ids[i:i+500]
+                metadata.update(self.conn.execute(
+                    f"SELECT video_id, item FROM video_metadata WHERE video_id IN ({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall())
+
+        return metadata
+
+    def set_video_metadata(self, records):
+        '''
+        Stores a dict of video ID -> metadata JSON string, replacing anything stored for the same videos
+        '''
+        stored_at = time.time()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO video_metadata (video_id, item, stored_at) VALUES (?, ?, ?)',
+                [(video_id, item, stored_at) for video_id, item in records.items()]
+            )
+            self.conn.commit()
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return f'API cache: {self.hits} hits | {self.misses} misses | {hit_rate:.0%} hit rate'
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def cache_key_for(uri):
+    '''
+    Cache key for a request URL. The API key is dropped from the query string so it's never written to disk
+    '''
+    parts = urlsplit(uri)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != 'key'))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+
+
+class ETagCachingHttp:
+    '''
+    httplib2.Http replacement that revalidates GET requests against a ResponseCache using ETags
+
+    The Youtube Data API returns an ETag with every list response. If we've seen the URL before,
+    the stored ETag is sent as If-None-Match. When nothing has changed the API answers 304 Not Modified with an empty body,
+    and the stored response is returned instead, so the Youtube API client can't tell the difference
+
+    Anything other than a GET, or a response without an ETag, is passed straight through
+
+    Args:
+        cache (ResponseCache): Where responses are stored
+        http: The http object to send requests with. Defaults to a new httplib2.Http()
+
+    '''
+
+    def __init__(self, cache, http=None):
+        self.cache = cache
+        self.http = http or httplib2.Http()
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        if method != 'GET':
+            return self.http.request(uri, method, body=body, headers=headers, redirections=redirections, connection_type=connection_type)
+
+        cache_key = cache_key_for(uri)
+        cached = self.cache.get(cache_key)
+
+        headers = dict(headers or {})
+        if cached is not None:
+            headers['if-none-match'] = cached[0]
+
+        response, content = self.http.request(uri, method, body=body, headers=headers, redirections=redirections, connection_type=connection_type)
+
+        if response.status == 304 and cached is not None:
+            self.cache.record(hit=True)
+            cached_response = httplib2.Response(cached[1])
+            cached_response.fromcache = True
+            return cached_response, cached[2]
+
+        self.cache.record(hit=False)
+        if response.status == 200 and 'etag' in response:
+            self.cache.set(cache_key, response['etag'], dict(response), content)
+
+        return response, content
+
+    def __getattr__(self, name): # anything else the API client needs (timeout, close etc) comes from the wrapped http object
+        return getattr(self.http, name)
@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+
+AUDIO_DIR = 'data_preprocessing/video_audio'
+
+# Whisper resamples everything to 16kHz mono, so downloads are converted to that once, up front
+SAMPLE_RATE = 16000
+AUDIO_FORMAT = 'flac'
+
+# Files yt-dlp and ffmpeg leave in the audio directory: '{video_id}.{ext}' downloads and converted audio, and the
+# '.part', '.ytdl', '.part-Frag{n}' and '.temp.{ext}' files of a download or conversion that's still going or was interrupted.
+# Nothing else (e.g. .gitkeep) is ever evicted
+AUDIO_FILE = re.compile(r'^[A-Za-z0-9_-]+\.(?:[A-Za-z0-9_-]+\.)*(?:flac|webm|m4a|mp4|opus|ogg|mp3|wav|part|ytdl|part-Frag\d+)$')
+
+_store_lock = threading.Lock()
+
+
+def audio_path(video_id):
+    '''
+    Path of a video's 16kHz mono audio file
+    '''
+    return f'{AUDIO_DIR}/{video_id}.{AUDIO_FORMAT}'
+
+
+def touch(video_id):
+    '''
+    Marks a video's audio as just used, so it's the last to be evicted
+    '''
+    try:
+        os.utime(audio_path(video_id))
+    except FileNotFoundError: # never downloaded, or evicted already
+        pass
+
+
+def enforce_budget(max_bytes, keep=()):
+
+    '''
+    Deletes the least recently used audio files until data_preprocessing/video_audio/ fits within 'max_bytes'
+
+    Files are ordered by modification time, which touch() moves forward whenever a file is used.
+    Anything left over from an interrupted download or conversion counts towards the budget and is evicted the same way.
+    Only files named like yt-dlp's output are counted or deleted (see AUDIO_FILE)
+
+    Args:
+        max_bytes (int): Disk budget for the audio directory
+        keep (iterable): Video IDs whose audio is still needed (e.g. downloaded but not yet transcribed). Their files,
+            including partial downloads, are never evicted
+
+    Returns:
+        List of deleted file paths
+
+    '''
+
+    keep = set(keep)
+
+    with _store_lock:
+        if not os.path.isdir(AUDIO_DIR):
+            return []
+
+        files = []
+        for entry in os.scandir(AUDIO_DIR):
+            if entry.is_file() and AUDIO_FILE.match(entry.name):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in files)
+
+        deleted = []
+        for _, size, path in sorted(files):
+            if total_bytes <= max_bytes:
+                break
+            if os.path.basename(path).split('.')[0] in keep: # yt-dlp names every file after the video ID
+                continue
+            os.remove(path)
+            total_bytes -= size
+            deleted.append(path)
+
+    if deleted:
+        print(f'Evicted {len(deleted)} audio files to keep {AUDIO_DIR} under {max_bytes / 1e9:.1f} GB')
+
+    return deleted
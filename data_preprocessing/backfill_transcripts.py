@@ -0,0 +1,183 @@
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+import pandas as pd
+from psycopg2 import sql
+import helper_functions
+import db_pool
+import transcript_processing
+import transcript_cache
+
+TRANSCRIPT_DIR = 'data_preprocessing/video_transcripts'
+
+
+def clean_video_transcript(video_id, duration=None):
+    '''
+    Parses and gap fills one transcript file. Runs in a worker process.
+    'duration' is the audio's length for VAD transcripts, so they get the same edge gap rows the pipeline loaded
+    '''
+    return transcript_processing.clean_transcript_file(f'{TRANSCRIPT_DIR}/{video_id}.txt', video_id, duration=duration)
+
+
+def loaded_video_ids(dbl_url):
+    '''
+    Returns the video IDs that already have rows in stage.sc_yt_video_transcript
+    '''
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('SELECT DISTINCT video_id FROM stage.{}').format(sql.Identifier('sc_yt_video_transcript')))
+            return {row[0] for row in cur.fetchall()}
+
+
+def clean_transcripts(video_ids, workers, durations=None):
+    '''
+    Cleans transcript files across a process pool and yields (video_id, dataframe) as each one finishes.
+    At most 'workers' * 2 files are in flight, so finished dataframes don't pile up while a batch is being loaded.
+    'durations' is a dict of video ID -> audio duration for the VAD transcripts
+    '''
+    durations = durations or {}
+    video_ids = iter(video_ids)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        while True:
+            while len(in_flight) < workers * 2:
+                video_id = next(video_ids, None)
+                if video_id is None:
+                    break
+                in_flight[executor.submit(clean_video_transcript, video_id, durations.get(video_id))] = video_id
+
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future.result()
+
+
+def main(mode, resume=False, workers=None, batch_rows=200000, transcript_cache_path=None):
+
+    '''
+    Rebuilds stage.sc_yt_video_transcript from the transcript files in data_preprocessing/video_transcripts
+
+    This function:
+    1. Lists the transcript files, skipping videos already in the stage table if resuming
+    2. Parses and gap fills the files across a pool of processes
+    3. Loads the cleaned transcripts with COPY every 'batch_rows' rows. A batch only ever holds whole videos,
+    so if the run stops part way, re-running with --resume carries on from the first video not yet loaded
+    4. Prints progress and throughput after every batch
+
+    Args:
+        mode (str): Load action for the first batch (truncate, append or merge). Later batches are appended,
+            or merged if mode is merge
+        resume (bool): Skip videos that already have rows in the stage table. Can't be combined with truncate
+        workers (int): Number of worker processes. Defaults to the number of cores
+        batch_rows (int): Number of rows loaded per COPY
+        transcript_cache_path (str): Transcript cache manifest (see transcript_cache.TranscriptCache). VAD transcripts
+            need the audio durations stored there for their leading and trailing gap rows, as the files don't hold them
+
+    '''
+
+    if resume and mode == 'truncate':
+        raise ValueError('resume cannot be used with truncate, as truncate would remove the videos already loaded')
+
+    load_dotenv()
+    dbl_url = os.getenv('DBL_URL')
+
+    video_ids = sorted(file_name[:-len('.txt')] for file_name in os.listdir(TRANSCRIPT_DIR) if file_name.endswith('.txt'))
+    if resume:
+        already_loaded = loaded_video_ids(dbl_url)
+        video_ids = [video_id for video_id in video_ids if video_id not in already_loaded]
+        print(f'Resuming: {len(already_loaded)} videos already loaded')
+
+    durations = {}
+    if transcript_cache_path:
+        cache = transcript_cache.TranscriptCache(transcript_cache_path, transcript_cache.transcript_settings())
+        durations = cache.durations()
+        cache.close()
+        print(f'Read audio durations of {len(durations)} VAD transcripts from {transcript_cache_path}')
+
+    print(f'Backfilling {len(video_ids)} transcripts')
+
+    action = mode
+    batch = []
+    batch_row_count = 0
+    videos_done = 0
+    rows_done = 0
+    start_time = time.time()
+
+    def load_batch():
+        nonlocal action, batch, batch_row_count, videos_done, rows_done
+
+        helper_functions.insert_records_to_postgres(dbl_url, 'sc_yt_video_transcript', pd.concat(batch, ignore_index=True), action)
+        if action == 'truncate':
+            action = 'append'
+
+        videos_done += len(batch)
+        rows_done += batch_row_count
+        batch, batch_row_count = [], 0
+
+        elapsed = time.time() - start_time
+        print(
+            f'{videos_done}/{len(video_ids)} videos | {rows_done} rows | '
+            f'{rows_done / elapsed:,.0f} rows/s | {videos_done / elapsed:.1f} videos/s | {elapsed:.1f} seconds'
+        )
+
+    for video_id, df_transcript in clean_transcripts(video_ids, workers or os.cpu_count(), durations):
+        batch.append(df_transcript)
+        batch_row_count += len(df_transcript)
+
+        if batch_row_count >= batch_rows:
+            load_batch()
+
+    if batch:
+        load_batch()
+
+    print(f'Backfill finished: {videos_done} videos and {rows_done} rows in {time.time() - start_time:.1f} seconds')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--mode',
+        choices=['append', 'merge', 'truncate'],
+        required=True
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip videos that already have rows in stage.sc_yt_video_transcript'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of processes parsing transcript files. Defaults to the number of cores'
+    )
+
+    parser.add_argument(
+        '--batch-rows',
+        type=int,
+        default=200000,
+        help='Number of rows loaded per COPY'
+    )
+
+    parser.add_argument(
+        '--transcript-cache',
+        nargs='?',
+        const='data_preprocessing/transcript_cache.sqlite3',
+        default=None,
+        help='Transcript cache manifest to read the audio durations of VAD transcripts from. Optionally takes the manifest file path'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        main(args.mode, args.resume, args.workers, args.batch_rows, args.transcript_cache)
+    finally:
+        db_pool.close_pools() # print pool stats and close every pooled connection, even if the run failed
@@ -0,0 +1,124 @@
+'''
+Micro-benchmark of splitting transcript rows into time buckets: the original three filtered copies in
+content_mapping.video_transcript_convert() against transcript_processing.explode_to_buckets()
+
+Synthetic gap filled transcripts are used, where some gap rows span several buckets. As well as timings, it reports
+how many seconds end up in a bucket they don't belong to (a piece longer than the bucket, or outside its boundaries),
+which the original split does for any row spanning more than 2 buckets.
+
+Usage:
+    python data_preprocessing/benchmark_bucket_split.py --segments 100000 --bucket-secs 30 60 300
+'''
+
+import argparse
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from transcript_processing import explode_to_buckets, insert_gap_rows
+
+
+def filtered_copies_split(df_transcript, bucket_secs=60):
+    '''
+    The bucket split as it was written in video_transcript_convert() before it was vectorised, kept as the baseline
+    '''
+    df_transcript = df_transcript.copy()
+    df_transcript['start_time_lb'] = (df_transcript['start_time'] // bucket_secs * bucket_secs).astype(int)
+    df_transcript['end_time_lb'] = (df_transcript['end_time'] // bucket_secs * bucket_secs).astype(int)
+    df_transcript['multiple_bucket_span'] = df_transcript['start_time_lb'] != df_transcript['end_time_lb']
+
+    df_transcript_multi_span_one = df_transcript[df_transcript['multiple_bucket_span'] == True]
+    df_transcript_multi_span_one['end_time'] = df_transcript_multi_span_one['end_time_lb']
+
+    df_transcript_multi_span_two = df_transcript[df_transcript['multiple_bucket_span'] == True]
+    df_transcript_multi_span_two['start_time'] = df_transcript_multi_span_two['end_time_lb']
+
+    df_transcript_single_span = df_transcript[df_transcript['multiple_bucket_span'] == False]
+
+    df_buckets = (
+        pd.concat([df_transcript_multi_span_one, df_transcript_multi_span_two, df_transcript_single_span])
+        .sort_values('start_time', ascending=True)
+    )[['text', 'video_id', 'start_time', 'end_time']]
+
+    df_buckets['duration_secs'] = df_buckets['end_time'] - df_buckets['start_time']
+    df_buckets['duration_secs_valid'] = np.where(df_buckets['text'] != '', df_buckets['duration_secs'], 0)
+    df_buckets[f'start_time_lb_{bucket_secs}'] = (df_buckets['start_time'] // bucket_secs * bucket_secs).astype(int)
+
+    return df_buckets
+
+
+def synthetic_transcript(segments, rng):
+    durations = rng.uniform(1, 8, segments).round(2)
+    gaps = np.where(rng.random(segments) < 0.05, rng.uniform(1, 400, segments), 0).round(2)
+    start_time = np.concatenate([[0], np.cumsum(durations + gaps)[:-1]]).round(2)
+    df_transcript = pd.DataFrame({
+        'text': [f' segment {i}' for i in range(segments)],
+        'video_id': 'video_0001',
+        'start_time': start_time,
+        'end_time': (start_time + durations).round(2),
+    })
+    return insert_gap_rows(df_transcript, 'video_0001')
+
+
+def misbucketed_secs(df_buckets, bucket_secs):
+    lower_boundary = df_buckets[f'start_time_lb_{bucket_secs}']
+    outside = (
+        (df_buckets['start_time'] - lower_boundary).clip(upper=0).abs()
+        + (df_buckets['end_time'] - (lower_boundary + bucket_secs)).clip(lower=0)
+    )
+    return round(float(outside.sum()), 2)
+
+
+def main(segments_list, bucket_secs_list):
+    rng = np.random.default_rng(0)
+    warnings.simplefilter('ignore') # the baseline's SettingWithCopy warnings
+
+    results = []
+    for segments in segments_list:
+        df_transcript = synthetic_transcript(segments, rng)
+
+        for bucket_secs in bucket_secs_list:
+            start_time = time.perf_counter()
+            df_baseline = filtered_copies_split(df_transcript, bucket_secs)
+            baseline_secs = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            df_vectorised = explode_to_buckets(df_transcript, bucket_secs)
+            vectorised_secs = time.perf_counter() - start_time
+
+            results.append({
+                'rows': len(df_transcript),
+                'bucket_secs': bucket_secs,
+                'filtered_copies_secs': round(baseline_secs, 3),
+                'vectorised_secs': round(vectorised_secs, 3),
+                'speedup': round(baseline_secs / vectorised_secs, 1),
+                'filtered_copies_misbucketed_secs': misbucketed_secs(df_baseline, bucket_secs),
+                'vectorised_misbucketed_secs': misbucketed_secs(df_vectorised, bucket_secs),
+                'total_secs_kept': round(float(df_vectorised['duration_secs'].sum()), 2),
+            })
+            print(results[-1])
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--segments',
+        type=int,
+        nargs='+',
+        default=[100000]
+    )
+
+    parser.add_argument(
+        '--bucket-secs',
+        type=int,
+        nargs='+',
+        default=[30, 60, 300]
+    )
+
+    args = parser.parse_args()
+
+    main(args.segments, args.bucket_secs)
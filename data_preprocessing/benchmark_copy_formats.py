@@ -0,0 +1,130 @@
+'''
+Micro-benchmark of the CSV and binary COPY loaders on synthetic stage-shaped dataframes
+
+Without --dbl-url, only the Python side (encoding each frame into its COPY stream) is timed.
+With --dbl-url, each stream is also loaded into a temporary table, so the server-side parsing cost is included.
+
+Usage:
+    python data_preprocessing/benchmark_copy_formats.py --rows 10000 100000 1000000 [--dbl-url postgresql://...]
+'''
+
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+from pg_copy import DataFrameCsvStream, DataFrameBinaryStream
+
+# Column types of the temporary tables, matching the stage tables the frames mimic
+TABLES = {
+    'sc_yt_video_transcript': {'video_id': 'text', 'start_time': 'float8', 'end_time': 'float8', 'text': 'text'},
+    'sc_yt_video_data': {'video_id': 'text', 'video_data': 'jsonb', 'minute_metrics': 'jsonb', 'estimatedminuteswatched': 'float8'},
+}
+
+
+def synthetic_transcript(rows, rng):
+    start_time = np.cumsum(rng.uniform(1, 8, rows)).round(2)
+    return pd.DataFrame({
+        'video_id': rng.choice([f'video_{i:04d}' for i in range(100)], rows),
+        'start_time': start_time,
+        'end_time': (start_time + rng.uniform(1, 8, rows)).round(2),
+        'text': [f' segment {i} with some "quoted", comma separated text' for i in range(rows)],
+    })
+
+
+def synthetic_video_data(rows, rng):
+    minute_metrics = json.dumps({str(m): {'livestreamPosition': m, 'averageConcurrentViewers': 12, 'peakConcurrentViewers': 15} for m in range(30)})
+    return pd.DataFrame({
+        'video_id': [f'video_{i}' for i in range(rows)],
+        'video_data': [json.dumps({'id': f'video_{i}', 'snippet': {'title': f'Session {i} | "Title"', 'description': 'line one\nline two, with commas'}}) for i in range(rows)],
+        'minute_metrics': minute_metrics,
+        'estimatedMinutesWatched': rng.uniform(0, 10000, rows).round(1),
+    })
+
+
+def drain(stream):
+    total_bytes = 0
+    while True:
+        data = stream.read(65536)
+        if not data:
+            return total_bytes
+        total_bytes += len(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+def make_stream(df, column_types, copy_format):
+    if copy_format == 'binary':
+        return DataFrameBinaryStream(df, column_types)
+    return DataFrameCsvStream(df)
+
+
+def copy_message(table, df, copy_format):
+    columns = ', '.join(df.columns)
+    if copy_format == 'binary':
+        return f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)'
+    return f'COPY {table} ({columns}) FROM STDIN WITH CSV HEADER'
+
+
+def main(rows_list, dbl_url=None):
+    rng = np.random.default_rng(0)
+    conn = psycopg2.connect(dbl_url) if dbl_url else None
+
+    results = []
+    for table, column_types in TABLES.items():
+        for rows in rows_list:
+            df = synthetic_transcript(rows, rng) if table == 'sc_yt_video_transcript' else synthetic_video_data(rows, rng)
+
+            for copy_format in ('csv', 'binary'):
+                start_time = time.perf_counter()
+                stream_bytes = drain(make_stream(df, column_types, copy_format))
+                encode_secs = time.perf_counter() - start_time
+
+                load_secs = None
+                if conn is not None:
+                    cur = conn.cursor()
+                    columns = ', '.join(f'{column} {pg_type}' for column, pg_type in column_types.items())
+                    cur.execute(f'CREATE TEMP TABLE bench_{table} ({columns})')
+                    start_time = time.perf_counter()
+                    cur.copy_expert(copy_message(f'bench_{table}', df, copy_format), make_stream(df, column_types, copy_format))
+                    load_secs = time.perf_counter() - start_time
+                    conn.rollback()
+                    cur.close()
+
+                results.append({
+                    'table': table,
+                    'rows': rows,
+                    'format': copy_format,
+                    'stream_mb': round(stream_bytes / 1e6, 1),
+                    'encode_secs': round(encode_secs, 2),
+                    'encode_rows_per_sec': int(rows / encode_secs),
+                    'load_secs': round(load_secs, 2) if load_secs is not None else None,
+                    'load_rows_per_sec': int(rows / load_secs) if load_secs else None,
+                })
+                print(results[-1])
+
+    if conn is not None:
+        conn.close()
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--rows',
+        type=int,
+        nargs='+',
+        default=[10000, 100000, 1000000]
+    )
+
+    parser.add_argument(
+        '--dbl-url',
+        default=None,
+        help='PostgreSQL connection URL. If given, streams are also loaded into temporary tables'
+    )
+
+    args = parser.parse_args()
+
+    main(args.rows, args.dbl_url)
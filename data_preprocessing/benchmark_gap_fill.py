@@ -0,0 +1,103 @@
+'''
+Micro-benchmark of the transcript gap filling: the original row-by-row loop against transcript_processing.insert_gap_rows()
+
+Both are run on synthetic transcripts where roughly a third of segments are followed by a gap, and their
+outputs are checked to contain the same rows before timings are reported.
+
+Usage:
+    python data_preprocessing/benchmark_gap_fill.py --segments 10000 100000
+'''
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from transcript_processing import insert_gap_rows
+
+
+def loop_insert_gap_rows(df_transcript, video_id):
+    '''
+    The gap filling as it was written in video_transcript_clean() before it was vectorised, kept as the baseline
+    '''
+    empty_rows = []
+
+    for i in range(len(df_transcript) - 1):
+
+        current_end = df_transcript.iloc[i]['end_time']
+        next_start = df_transcript.iloc[i+1]['start_time']
+
+        if current_end != next_start:
+            empty_rows.append({
+                'start_time': current_end,
+                'end_time': next_start,
+                'text': '',
+                'video_id': video_id
+            })
+
+    df_empty_rows = pd.DataFrame(empty_rows)
+
+    return pd.concat([df_transcript, df_empty_rows]).sort_values('start_time', ascending=True)
+
+
+def synthetic_transcript(segments, rng):
+    durations = rng.uniform(1, 8, segments).round(2)
+    gaps = np.where(rng.random(segments) < 0.3, rng.uniform(0.5, 5, segments), 0).round(2)
+    start_time = np.concatenate([[0], np.cumsum(durations + gaps)[:-1]]).round(2)
+    return pd.DataFrame({
+        'time': [''] * segments,
+        'text': [f' segment {i}' for i in range(segments)],
+        'video_id': 'video_0001',
+        'start_time': start_time,
+        'end_time': (start_time + durations).round(2),
+    })
+
+
+def same_rows(df_a, df_b):
+    columns = ['video_id', 'start_time', 'end_time', 'text']
+    df_a = df_a[columns].reset_index(drop=True)
+    df_b = df_b[columns].reset_index(drop=True)
+    return df_a.equals(df_b)
+
+
+def main(segments_list):
+    rng = np.random.default_rng(0)
+
+    results = []
+    for segments in segments_list:
+        df_transcript = synthetic_transcript(segments, rng)
+
+        start_time = time.perf_counter()
+        df_loop = loop_insert_gap_rows(df_transcript, 'video_0001')
+        loop_secs = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        df_vectorised = insert_gap_rows(df_transcript, 'video_0001')
+        vectorised_secs = time.perf_counter() - start_time
+
+        results.append({
+            'segments': segments,
+            'gap_rows': len(df_vectorised) - segments,
+            'same_rows': same_rows(df_loop, df_vectorised),
+            'loop_secs': round(loop_secs, 3),
+            'vectorised_secs': round(vectorised_secs, 4),
+            'speedup': round(loop_secs / vectorised_secs, 1),
+        })
+        print(results[-1])
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--segments',
+        type=int,
+        nargs='+',
+        default=[10000, 100000]
+    )
+
+    args = parser.parse_args()
+
+    main(args.segments)
@@ -0,0 +1,114 @@
+'''
+Micro-benchmark of transcript file parsing: the original pd.read_csv(sep=']') approach against transcript_parser
+
+Synthetic '[start -> end] text' files are written to a temporary directory and parsed with:
+1. read_csv - read_csv(sep=']'), str.replace('[') and str.split('->').astype(float), as the transcript readers used to
+2. parser - transcript_parser.parse_transcript_file()
+3. parser_mmap - the same with use_mmap=True
+
+Also shows what each one does with a line whose text contains ']'.
+
+Usage:
+    python data_preprocessing/benchmark_transcript_parser.py --lines 10000 100000 1000000
+'''
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from transcript_parser import parse_transcript_file
+
+
+def read_csv_transcript(video_transcript_path):
+    '''
+    The parsing as it was written in video_transcript_clean() before transcript_parser, kept as the baseline
+    '''
+    df_transcript = pd.read_csv(
+        video_transcript_path,
+        sep=']',
+        names=['time', 'text']
+    )
+
+    df_transcript['time'] = df_transcript['time'].str.replace('[', '', regex=False)
+
+    df_transcript[['start_time', 'end_time']] = (
+        df_transcript['time']
+        .str.split('->', expand=True)
+        .astype(float)
+    )
+
+    return df_transcript['start_time'].to_numpy(), df_transcript['end_time'].to_numpy(), df_transcript['text'].tolist()
+
+
+def write_synthetic_transcript(path, lines, rng):
+    start_time = np.cumsum(rng.uniform(1, 8, lines))
+    end_time = start_time + rng.uniform(1, 8, lines)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, (start, end) in enumerate(zip(start_time, end_time)):
+            f.write(f'[{start:.2f} -> {end:.2f}]  segment {i}, with some "quoted" text\n')
+
+
+def time_parser(parse_fn, path):
+    start_time = time.perf_counter()
+    parsed = parse_fn(path)
+    return time.perf_counter() - start_time, parsed
+
+
+def main(lines_list):
+    rng = np.random.default_rng(0)
+    parsers = {
+        'read_csv': read_csv_transcript,
+        'parser': parse_transcript_file,
+        'parser_mmap': lambda path: parse_transcript_file(path, use_mmap=True),
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for lines in lines_list:
+            path = os.path.join(temp_dir, f'transcript_{lines}.txt')
+            write_synthetic_transcript(path, lines, rng)
+
+            baseline_secs, baseline = time_parser(read_csv_transcript, path)
+            for name, parse_fn in parsers.items():
+                secs, parsed = time_parser(parse_fn, path) if name != 'read_csv' else (baseline_secs, baseline)
+                results.append({
+                    'lines': lines,
+                    'parser': name,
+                    'file_mb': round(os.path.getsize(path) / 1e6, 1),
+                    'secs': round(secs, 3),
+                    'lines_per_sec': int(lines / secs),
+                    'speedup': round(baseline_secs / secs, 1),
+                    'same_times': np.array_equal(parsed[0], baseline[0]) and np.array_equal(parsed[1], baseline[1]),
+                })
+                print(results[-1])
+
+        # A ']' in the text splits the line into an extra column for read_csv
+        path = os.path.join(temp_dir, 'bracket.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('[0.00 -> 2.50]  [music] intro\n[2.50 -> 4.00]  welcome\n')
+
+        for name, parse_fn in parsers.items():
+            try:
+                print(f'{name} with ] in text: {parse_fn(path)[2]}')
+            except Exception as e:
+                print(f'{name} with ] in text: failed with {type(e).__name__}: {e}')
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--lines',
+        type=int,
+        nargs='+',
+        default=[10000, 100000, 1000000]
+    )
+
+    args = parser.parse_args()
+
+    main(args.lines)
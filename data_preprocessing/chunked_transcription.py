@@ -0,0 +1,184 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from faster_whisper.audio import decode_audio
+import video_timestamps
+import audio_store
+
+SAMPLE_RATE = audio_store.SAMPLE_RATE # Whisper works on 16kHz mono audio
+
+# Each worker process loads (and warms up) its own model into this on start up
+worker_model = None
+
+
+def init_worker(cpu_threads):
+    global worker_model
+    worker_model = video_timestamps.load_whisper_model(cpu_threads=cpu_threads, warm_up=True)
+
+
+def transcribe_chunk(offset_secs, samples, transcribe_options):
+    '''
+    Transcribes one chunk of audio in a worker process. Timestamps are shifted by the chunk's offset,
+    so they're relative to the start of the full audio
+
+    Returns:
+        List of (start, end, text) tuples
+    '''
+    segments, info = worker_model.transcribe(samples, **transcribe_options)
+
+    return [(segment.start + offset_secs, segment.end + offset_secs, segment.text) for segment in segments]
+
+
+def split_audio(audio, chunk_secs, overlap_secs):
+
+    '''
+    Splits audio into fixed length chunks, each overlapping the next by 'overlap_secs'
+
+    Args:
+        audio: 16kHz mono audio samples (numpy array)
+        chunk_secs (float): Length of each chunk in seconds
+        overlap_secs (float): Seconds shared between neighbouring chunks
+
+    Returns:
+        List of (offset_secs, samples) tuples, where offset_secs is where the chunk starts in the full audio
+
+    '''
+
+    if overlap_secs >= chunk_secs:
+        raise ValueError('overlap_secs must be less than chunk_secs')
+
+    chunk_samples = int(chunk_secs * SAMPLE_RATE)
+    step_samples = int((chunk_secs - overlap_secs) * SAMPLE_RATE)
+
+    chunks = []
+    for start in range(0, max(len(audio), 1), step_samples):
+        chunks.append((start / SAMPLE_RATE, audio[start:start+chunk_samples]))
+        if start + chunk_samples >= len(audio):
+            break
+
+    return chunks
+
+
+def stitch_chunks(chunks, chunk_results):
+
+    '''
+    Combines the segments from every chunk into one list, dropping the duplicates from the overlaps
+
+    Each overlap is cut at its midpoint. A segment is kept by the chunk whose side of the cut its midpoint
+    falls on, so speech in an overlap is only kept once, from whichever chunk heard more of it.
+    A sentence that crosses the cut can still come out of both chunks as two partial copies whose midpoints land
+    either side of it, so once sorted, any segment that starts before the previous kept one ends is dropped too.
+    The rows then never overlap and the text isn't doubled
+
+    Args:
+        chunks (list): (offset_secs, samples) tuples from split_audio()
+        chunk_results (list): (start, end, text) segments for each chunk, already offset to the full audio
+
+    Returns:
+        List of (start, end, text) tuples sorted by start time
+
+    '''
+
+    cuts = []
+    for (offset, samples), (next_offset, _) in zip(chunks, chunks[1:]):
+        chunk_end = offset + len(samples) / SAMPLE_RATE
+        cuts.append((next_offset + chunk_end) / 2)
+
+    lower_cuts = [float('-inf')] + cuts
+    upper_cuts = cuts + [float('inf')]
+
+    stitched = []
+    for segments, lower_cut, upper_cut in zip(chunk_results, lower_cuts, upper_cuts):
+        for start, end, text in segments:
+            if lower_cut <= (start + end) / 2 < upper_cut:
+                stitched.append((start, end, text))
+
+    deduplicated = []
+    for segment in sorted(stitched, key=lambda segment: segment[0]):
+        if deduplicated and segment[0] < deduplicated[-1][1]:
+            continue
+        deduplicated.append(segment)
+
+    return deduplicated
+
+
+class ChunkedTranscriber:
+
+    '''
+    Transcribes long audio (e.g. 90 minute livestreams) across a pool of processes
+
+    A single model.transcribe() call works through the audio from start to finish, and only scales as far as
+    its cpu_threads. Here the audio is split into overlapping chunks that are transcribed in parallel,
+    one chunk per worker process. Each worker holds its own copy of the model, loaded once when the pool starts,
+    so the pool should be reused for every video in the run
+
+    Timestamps are shifted back onto the full audio and the overlaps de-duplicated (see stitch_chunks()).
+    The transcript file is written in the same '[start -> end] text' format as video_timestamps.download_video_transcript()
+
+    Args:
+        workers (int): Number of worker processes. Defaults to the number of cores divided by cpu_threads
+        cpu_threads (int): CPU threads per worker's model
+        chunk_secs (float): Length of each chunk in seconds
+        overlap_secs (float): Seconds shared between neighbouring chunks, so words cut at a boundary are heard whole by one chunk
+        vad (bool): Only transcribe the speech regions of each chunk (see video_timestamps.transcribe_options())
+
+    '''
+
+    def __init__(self, workers=None, cpu_threads=2, chunk_secs=300, overlap_secs=10, vad=False):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // cpu_threads)
+        self.chunk_secs = chunk_secs
+        self.overlap_secs = overlap_secs
+        self.vad = vad
+
+        # spawn rather than fork, as the weekly pipeline starts this from a process that's already running threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(cpu_threads,)
+        )
+
+    def transcribe(self, audio_path):
+        '''
+        Transcribes an audio file. Returns its segments as a list of (start, end, text) tuples, and the audio's duration in seconds
+        '''
+        audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+        chunks = split_audio(audio, self.chunk_secs, self.overlap_secs)
+        options = video_timestamps.transcribe_options(self.vad)
+
+        futures = [self.executor.submit(transcribe_chunk, offset, samples, options) for offset, samples in chunks]
+        chunk_results = [future.result() for future in futures]
+
+        return stitch_chunks(chunks, chunk_results), len(audio) / SAMPLE_RATE
+
+    def stream_video_transcript(self, video_id, transcript_path=None):
+
+        '''
+        Chunked equivalent of video_timestamps.stream_video_transcript(). Transcribes a downloaded video's audio
+        and yields its cleaned, gap filled (video_id, start_time, end_time, text) rows
+        '''
+
+        audio_path = audio_store.audio_path(video_id)
+
+        start_time = time.time()
+        segments, duration = self.transcribe(audio_path)
+        print(f'Audio transcribed in {time.time() - start_time:.2f} seconds across {self.workers} processes')
+
+        if transcript_path:
+            segments = video_timestamps.write_transcript_segments(segments, transcript_path)
+
+        yield from video_timestamps.fill_transcript_gaps(video_id, segments, duration if self.vad else None)
+
+    def download_video_transcript(self, video_id):
+        '''
+        Chunked equivalent of video_timestamps.download_video_transcript(). Writes the transcript to
+        data_preprocessing/video_transcripts/{video_id}.txt
+        '''
+        transcript_path = f'data_preprocessing/video_transcripts/{video_id}.txt'
+
+        for _ in self.stream_video_transcript(video_id, transcript_path):
+            pass
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,201 @@
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+
+class ConnectionPool:
+    '''
+    Thread-safe pool of PostgreSQL connections with checkout statistics
+
+    Opening a connection to our serverless Postgres costs a TLS handshake (hundreds of milliseconds), so connections
+    are opened once and handed out again to every stage load and query in the run.
+
+    Connections are opened lazily, up to 'maxconn'. Once that many are checked out, callers wait on a semaphore
+    for one to be returned rather than erroring. The time spent waiting is recorded.
+
+    Connections that sat idle for longer than 'ping_after_secs' are checked with SELECT 1 before being handed out,
+    as the server drops idle connections when it scales down. Broken connections are discarded and replaced.
+
+    close() closes the idle connections straight away. Connections still checked out at that point are closed as soon
+    as they're returned, and no more are handed out.
+
+    Args:
+        dbl_url (str): PostgreSQL connection URL
+        maxconn (int): Maximum number of open connections
+        ping_after_secs (float): Idle time after which a connection is checked before use
+
+    '''
+
+    def __init__(self, dbl_url, maxconn=4, ping_after_secs=60):
+        self.dbl_url = dbl_url
+        self.idle = []
+        self.maxconn = maxconn
+        self.ping_after_secs = ping_after_secs
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.lock = threading.Lock()
+        self.last_used = {}
+        self.checkouts = 0
+        self.wait_secs = 0
+        self.max_wait_secs = 0
+        self.discarded = 0
+        self.opened = 0
+        self.in_use = 0
+        self.closed = False
+
+    def is_alive(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self.last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.ping_after_secs: # new or recently used
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkout(self):
+        start_time = time.monotonic()
+        self.slots.acquire()
+        wait_secs = time.monotonic() - start_time
+
+        try:
+            if self.closed:
+                raise ValueError('connection pool is closed')
+
+            while True:
+                with self.lock:
+                    conn = self.idle.pop() if self.idle else None
+
+                if conn is None:
+                    conn = psycopg2.connect(self.dbl_url)
+                    with self.lock:
+                        self.opened += 1
+                    break
+
+                if self.is_alive(conn):
+                    break
+
+                self.discard(conn)
+        except Exception:
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_secs += wait_secs
+            self.max_wait_secs = max(self.max_wait_secs, wait_secs)
+
+        return conn
+
+    def checkin(self, conn):
+        # Never hand out a connection mid-transaction - roll back anything the caller didn't commit
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        if not broken:
+            self.last_used[id(conn)] = time.monotonic()
+            with self.lock:
+                if not self.closed:
+                    self.idle.append(conn)
+                    conn = None
+
+        if conn is not None: # broken, or returned after close() so it won't be handed out again
+            self.discard(conn)
+
+        with self.lock:
+            self.in_use -= 1
+
+        self.slots.release()
+
+    def discard(self, conn):
+        self.last_used.pop(id(conn), None)
+        if not conn.closed:
+            conn.close()
+
+        with self.lock:
+            self.opened -= 1
+            self.discarded += 1
+
+    @contextmanager
+    def connection(self):
+        '''
+        Context manager that checks a connection out of the pool and returns it afterwards.
+        Uncommitted work is rolled back when the connection is returned
+        '''
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_size': self.maxconn,
+                'open': self.opened,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'total_wait_secs': round(self.wait_secs, 3),
+                'max_wait_secs': round(self.max_wait_secs, 3),
+                'discarded': self.discarded,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"DB pool: {stats['checkouts']} checkouts | {stats['open']}/{stats['max_size']} connections open | "
+            f"{stats['total_wait_secs']:.2f}s total wait (max {stats['max_wait_secs']:.2f}s) | {stats['discarded']} discarded"
+        )
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+
+        for conn in idle:
+            self.discard(conn)
+
+
+# One pool per connection URL, shared by everything in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dbl_url, maxconn=4):
+    '''
+    Returns the process-wide connection pool for a connection URL, creating it on first use
+
+    Args:
+        dbl_url (str): PostgreSQL connection URL
+        maxconn (int): Maximum number of open connections. Only used when the pool is first created
+
+    '''
+    with _pools_lock:
+        pool = _pools.get(dbl_url)
+        if pool is None:
+            pool = _pools[dbl_url] = ConnectionPool(dbl_url, maxconn)
+
+    return pool
+
+
+def close_pools():
+    '''
+    Prints each pool's statistics and closes all of its connections. Called at the end of each run_* entry point
+    '''
+    with _pools_lock:
+        for pool in _pools.values():
+            print(pool.summary())
+            pool.close()
+        _pools.clear()
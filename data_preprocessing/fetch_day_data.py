@@ -6,21 +6,20 @@ import pandas as pd
 from datetime import date, timedelta
 import json
 from helper_functions import connect_yt_analytics_api, insert_records_to_postgres
-import psycopg2
+import db_pool
 from psycopg2 import sql
 
 
 def table_max_date(pg_table_name):
 
     dbl_url = os.environ['DBL_URL']
-    
-    conn = psycopg2.connect(dbl_url)
-    cur = conn.cursor()
 
-    max_date_query = sql.SQL(f'SELECT MAX(date) FROM stage.{pg_table_name}')
-    
-    cur.execute(max_date_query)
-    max_date = cur.fetchone()[0]        
+    max_date_query = sql.SQL('SELECT MAX(date) FROM stage.{}').format(sql.Identifier(pg_table_name))
+
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(max_date_query)
+            max_date = cur.fetchone()[0]        
 
     return max_date
 
@@ -37,6 +36,7 @@ def fetch_day_full_data(analytics_api, action):
 
     Args: 
         analytics_api: Authenticated Youtube Analytics API
+        action: truncate fetches the full history. append and merge fetch from 7 days before the latest date already loaded
 
     Returns:
         A pandas DF with columns:
@@ -44,8 +44,8 @@ def fetch_day_full_data(analytics_api, action):
             date_metrics: JSON string containing all daily metrics
     '''
 
-    if action not in ('truncate', 'append'):
-        raise ValueError('action must be truncate or append')
+    if action not in ('truncate', 'append', 'merge'):
+        raise ValueError('action must be truncate, append or merge')
     
     if action == 'truncate':
         start_date = '2022-09-16'  # YouTube's earliest possible date
@@ -6,40 +6,49 @@ import pandas as pd
 from datetime import datetime, date, timedelta
 import json
 import time
-from helper_functions import safe_execute, get_channel_videos_ids, connect_yt_data_api, connect_yt_analytics_api, insert_records_to_postgres
+from helper_functions import safe_execute, get_channel_videos_ids, connect_yt_data_api, connect_yt_analytics_api, insert_records_to_postgres, run_concurrent, thread_local_http
 
 
-def fetch_video_full_data(video_ids, youtube_api):
+def fetch_video_metadata(video_ids, youtube_api, response_cache=None, reuse_stored=False):
 
     '''
-    Fetches video data for a list of Youtube Videos and returns as a Pandas Dataframe. I.e. Video metadata, video statistics etc 
+    Fetches full video metadata for a list of Youtube videos
+
+    Every part any consumer needs is requested up front - the quota cost of videos().list is the same regardless of the parts asked for.
+    With a response cache, every fetched item is also stored in it (see api_cache.ResponseCache.set_video_metadata()), so a later run
+    that only needs fields that never change (e.g. the publish date) can read them from disk instead of making another pass over the API
 
     This function: 
-    1. Splits the video list into batches of 50 (maximum allowed as input for the Youtube API)
-    2. Fetches metadata for each batch using the Youtube Data API
-    3. Stores each videos data as a JSON string in a Dataframe 
-    4. Extracts the video ID into a separate column for each row 
+    1. If reuse_stored, reads the videos already stored in the response cache
+    2. Splits the remaining video IDs into batches of 50 (maximum allowed as input for the Youtube API)
+    3. Fetches metadata for each batch using the Youtube Data API, and stores it in the response cache if there is one. 
+    Each record is serialised once and never re-parsed
 
     Args: 
         video_ids (list): List of Youtube video IDs 
         youtube_api: Authenticated Youtube API client for connection 
+        response_cache: Optional api_cache.ResponseCache to store the metadata in
+        reuse_stored (bool): Serve videos already in the response cache from disk. Only safe for fields that don't change, 
+            as stored statistics are as old as the run that stored them
 
     Returns: 
-        Dataframe with columns:
-            video_data: JSON string containing full video metadata
-            video_id: Youtube video ID
+        Dict of video ID -> (parsed item, JSON string) for every requested video the API returned, in the order of video_ids
 
     '''
 
-    # Batch video requests (50 IDs per call) and call fields
-    def batch_video(lst, n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i+n]
+    video_ids = list(dict.fromkeys(video_ids))
+
+    metadata = {}
+    if response_cache is not None and reuse_stored:
+        for video_id, record in response_cache.get_video_metadata(video_ids).items():
+            metadata[video_id] = (json.loads(record), record)
+
+    fetch_ids = [video_id for video_id in video_ids if video_id not in metadata]
 
     # Add try and except logic. If batch fails then add to a list. 3 retry attempts
-    records = []
     failed_batches = []
-    for batch in batch_video(video_ids, 50):
+    for i in range(0, len(fetch_ids), 50):
+        batch = fetch_ids[i:i+50]
         try:
             video_response = safe_execute(
                 youtube_api.videos().list(
@@ -48,42 +57,105 @@ def fetch_video_full_data(video_ids, youtube_api):
                 )
             )
 
-            for item in video_response.get('items', []):
-                records.append(json.dumps(item))
+            fetched = {item.get('id'): (item, json.dumps(item)) for item in video_response.get('items', [])}
+            metadata.update(fetched)
+
+            if response_cache is not None:
+                response_cache.set_video_metadata({video_id: record for video_id, (_, record) in fetched.items()})
 
         except Exception as e:
             print(f'Batch failed: {batch} | Error: {e}')
             failed_batches.append(batch)
 
+    # If there are any failed batches, output the number of this
+    if failed_batches:
+        print(f'Failed batches: {len(failed_batches)}')
+
+    if fetch_ids != video_ids:
+        print(f'Video metadata: {len(video_ids) - len(fetch_ids)} read from the response cache | {len(fetch_ids)} fetched')
+
+    return {video_id: metadata[video_id] for video_id in video_ids if video_id in metadata}
+
+
+def fetch_video_full_data(video_ids, youtube_api, response_cache=None):
+
+    '''
+    Fetches video data for a list of Youtube Videos and returns as a Pandas Dataframe. I.e. Video metadata, video statistics etc 
+
+    This function: 
+    1. Fetches fresh metadata for every video (see fetch_video_metadata()), storing it in the response cache if given 
+    so the weekly run can read publish dates from it
+    2. Stores each videos data as a JSON string in a Dataframe 
+    3. Adds the video ID into a separate column for each row 
+
+    Args: 
+        video_ids (list): List of Youtube video IDs 
+        youtube_api: Authenticated Youtube API client for connection 
+        response_cache: Optional api_cache.ResponseCache to store the metadata in
+
+    Returns: 
+        Dataframe with columns:
+            video_data: JSON string containing full video metadata
+            video_id: Youtube video ID
+
+    '''
+
+    metadata = fetch_video_metadata(video_ids, youtube_api, response_cache)
+
     # Convert list of json records to DataFrame. Single column of data. If it doesn't exist then return empty DF. Otherwise carry on with rest of code. 
-    if not records:
+    if not metadata:
         print('No video data to insert - skipping')
         return pd.DataFrame(columns=['video_id', 'video_data'])
     
-    video_metrics = pd.DataFrame(records, columns=['video_data'])
+    video_metrics = pd.DataFrame([record for _, record in metadata.values()], columns=['video_data'])
+    video_metrics['video_id'] = list(metadata.keys())
 
-    # Create a video id column for each video data row. Pull from video data column
-    video_metrics['video_id'] = [json.loads(record).get('id') for record in records]
+    print(f'Success: {len(video_metrics)} videos fetched - Full data')
 
-    print(f'Success: {len(records)} videos fetched - Full data')
+    return video_metrics
 
-    # If there are any failed batches, output the number of this
-    if failed_batches:
-        print(f'Failed batches: {len(failed_batches)}')
 
-    return video_metrics
+def fetch_video_publish_dates(video_ids, youtube_api, response_cache=None):
+
+    '''
+    Returns the publish date of each video. Publish dates never change, so videos whose metadata is already in the 
+    response cache (e.g. stored by the daily run) are read from disk and only the rest are requested (see fetch_video_metadata())
+
+    Args: 
+        video_ids (list): List of Youtube video IDs 
+        youtube_api: Authenticated Youtube API client for connection 
+        response_cache: Optional api_cache.ResponseCache holding stored metadata
+
+    Returns: 
+        Dataframe with columns:
+            - video_id: YouTube video ID
+            - video_publish_dt: Video publish date
+
+    '''
+
+    metadata = fetch_video_metadata(video_ids, youtube_api, response_cache, reuse_stored=True)
+
+    video_publish_dates = pd.DataFrame(
+        [(video_id, item.get('snippet', {}).get('publishedAt')) for video_id, (item, _) in metadata.items()],
+        columns=['video_id', 'video_publish_dt']
+    )
+    video_publish_dates['video_publish_dt'] = pd.to_datetime(video_publish_dates['video_publish_dt']).dt.date
+
+    return video_publish_dates
 
 
-def fetch_video_min_data(video_ids, analytics_api):
+def fetch_video_min_data(video_ids, analytics_api, max_workers=8, requests_per_second=10):
 
     '''
     Fetches video minute data for a list of Youtube videos and returns as a Pandas Dataframe. 
     I.e. for every 60 seconds, what are the average viewers and peak viewers
 
     This is separated from fetch_video_data() as you need to retrieve this data from the analytics api as opposed to data api
+    Unlike fetch_video_est_watched(), this can't be batched across videos - livestreamPosition reports only accept a single video filter
       
     This function: 
-    1. For every video id, retrieve the average viewers and peak viewers per 60 seconds
+    1. For every video id, retrieve the average viewers and peak viewers per 60 seconds. 
+    Requests are spread across a pool of worker threads (see run_concurrent())
     2. Stores each videos data as a JSON string in a Dataframe 
     3. Extracts the video ID into a separate column for each row 
     4. Concat them into a single dataframe
@@ -91,6 +163,8 @@ def fetch_video_min_data(video_ids, analytics_api):
     Args: 
         video_ids (list): List of Youtube video IDs 
         analytics_api: Authenticated Youtube API client for connection 
+        max_workers (int): Number of requests to run at the same time
+        requests_per_second (float): Maximum number of requests started per second
 
     Returns: 
         Dataframe with columns:
@@ -101,44 +175,46 @@ def fetch_video_min_data(video_ids, analytics_api):
     start_date = '2022-09-16'
     end_date = date.today().isoformat()
 
+    def fetch_one(video_id):
+        return safe_execute(
+            analytics_api.reports().query(
+                ids='channel==MINE',
+                startDate=start_date,
+                endDate=end_date,
+                metrics='averageConcurrentViewers,peakConcurrentViewers',
+                dimensions='livestreamPosition',
+                filters=f"video=={video_id}"
+            ),
+            http=thread_local_http(analytics_api)
+        )
+
     all_videos_min_list = []
     failed_videos = []
-    for video_id in video_ids:
-        try: 
-            response = safe_execute(
-                analytics_api.reports().query(
-                    ids='channel==MINE',
-                    startDate=start_date,
-                    endDate=end_date,
-                    metrics='averageConcurrentViewers,peakConcurrentViewers',
-                    dimensions='livestreamPosition',
-                    filters=f"video=={video_id}"
-                )
-            )
+    for video_id, response, error in run_concurrent(fetch_one, video_ids, max_workers, requests_per_second):
+        if error is not None:
+            print(f'Video failed: {video_id} | Error: {error}')
+            failed_videos.append(video_id)
+            continue
 
-            rows = response.get('rows', [])
-            if not rows: # if data is empty, skip this video id and go to the next one in the try. Else carry on. Else is not required here when using continue
-                continue
+        rows = response.get('rows', [])
+        if not rows: # if data is empty, skip this video id and go to the next one. 
+            continue
 
-            col_headers = [col.get('name', []) for col in response['columnHeaders']]
+        col_headers = [col.get('name', []) for col in response['columnHeaders']]
 
-            records = {}
-            for row in rows:
-                record = dict(zip(col_headers, row))
-                key = record['livestreamPosition']
-                records[key] = record
+        records = {}
+        for row in rows:
+            record = dict(zip(col_headers, row))
+            key = record['livestreamPosition']
+            records[key] = record
 
-            data = {
-                'video_id': video_id, 
-                'minute_metrics': json.dumps(records),
-            }
+        data = {
+            'video_id': video_id, 
+            'minute_metrics': json.dumps(records),
+        }
 
-            videos_min = pd.DataFrame([data])
-            all_videos_min_list.append(videos_min)
-    
-        except Exception as e: 
-            print(f'Video failed: {video_id} | Error: {e}')
-            failed_videos.append(video_id)
+        videos_min = pd.DataFrame([data])
+        all_videos_min_list.append(videos_min)
 
     if not all_videos_min_list: # If no minute data, return an empty DF. Otherwise carry on
         print('No minute data to insert - skipping')
@@ -154,7 +230,7 @@ def fetch_video_min_data(video_ids, analytics_api):
     return videos_minute_metrics
 
 
-def fetch_video_est_watched(video_ids, analytics_api):
+def fetch_video_est_watched(video_ids, analytics_api, max_workers=8, requests_per_second=10, batch_size=200):
 
     '''
     Fetches video estimated watch time for a list of Youtube videos and returns as a Pandas Dataframe. 
@@ -163,11 +239,18 @@ def fetch_video_est_watched(video_ids, analytics_api):
     This is separated from fetch_video_min_data() as the dimensions field needs to be different and can't be joined together
       
     This function: 
-    1. For every video id, retrieve the estimated watch time (mins)
+    1. Splits the video list into batches of 'batch_size'. The video filter accepts a comma separated list of IDs 
+    (video==a,b,c) and returns one row per video, so one request covers a whole batch rather than a single video. 
+    200 is the maximum number of rows the API returns for a video dimension report
+    2. Retrieves the estimated watch time (mins) for each batch. Batches are spread across a pool of worker threads (see run_concurrent())
+    3. Splits the rows back out into one row per video 
 
     Args: 
         video_ids (list): List of Youtube video IDs 
         analytics_api: Authenticated Youtube API client for connection 
+        max_workers (int): Number of requests to run at the same time
+        requests_per_second (float): Maximum number of requests started per second
+        batch_size (int): Number of videos per request (max 200)
 
     Returns: 
         Dataframe with columns:
@@ -182,43 +265,54 @@ def fetch_video_est_watched(video_ids, analytics_api):
         "estimatedMinutesWatched"
     )
 
-    video_est_watched_list = []
+    batches = [video_ids[i:i+batch_size] for i in range(0, len(video_ids), batch_size)]
+
+    def fetch_batch(batch):
+        return safe_execute(
+            analytics_api.reports().query(
+                ids='channel==MINE',
+                startDate=start_date,
+                endDate=end_date,
+                metrics=metrics,
+                dimensions="video",
+                filters=f"video=={','.join(batch)}",
+                sort=f"-{metrics}",
+                maxResults=len(batch)
+            ),
+            http=thread_local_http(analytics_api)
+        )
+
+    records = []
     failed_videos = []
-    for video_id in video_ids:
-        try: 
-            response = safe_execute(
-                analytics_api.reports().query(
-                    ids='channel==MINE',
-                    startDate=start_date,
-                    endDate=end_date,
-                    metrics=metrics,
-                    dimensions="video",
-                    filters=f"video=={video_id}"
-                )
-            )
+    for batch, response, error in run_concurrent(fetch_batch, batches, max_workers, requests_per_second):
+        if error is not None:
+            print(f'Batch failed: {batch} | Error: {error}')
+            failed_videos.extend(batch)
+            continue
 
-            rows = response.get('rows', [])
-            if not rows: 
-                continue
+        rows = response.get('rows', [])
+        if not rows: 
+            continue
 
-            data = {
-                'video_id': rows[0][0], 
-                'estimatedMinutesWatched': rows[0][1],
-            }
+        col_headers = [col.get('name', []) for col in response['columnHeaders']]
 
-            videos_est_watched = pd.DataFrame([data])
-            video_est_watched_list.append(videos_est_watched)
-
-        except Exception as e: 
-            print(f'Video failed: {video_id} | Error: {e}')
-            failed_videos.append(video_id)
+        for row in rows:
+            record = dict(zip(col_headers, row))
+            records.append({
+                'video_id': record['video'], 
+                'estimatedMinutesWatched': record[metrics],
+            })
 
     
-    if not video_est_watched_list: # If no data, return an empty DF. Otherwise carry on
+    if not records: # If no data, return an empty DF. Otherwise carry on
         print('No estimated min watched data to insert - skipping')
         return pd.DataFrame(columns=['video_id', 'estimatedMinutesWatched'])
 
-    video_est_watched_all = pd.concat(video_est_watched_list, ignore_index=True)
+    # Rows within a batch come back sorted by watch time, so put them back into the order of video_ids
+    video_order = {video_id: i for i, video_id in enumerate(video_ids)}
+    records.sort(key=lambda record: video_order.get(record['video_id'], len(video_order)))
+
+    video_est_watched_all = pd.DataFrame(records, columns=['video_id', 'estimatedMinutesWatched'])
 
     print(f"Success: {video_est_watched_all['video_id'].nunique()} videos fetched - estimated watched data")
 
@@ -228,22 +322,22 @@ def fetch_video_est_watched(video_ids, analytics_api):
     return video_est_watched_all
 
 
-def fetch_recent_videos(video_ids, youtube_api, lookback_days):
+def fetch_recent_videos(video_ids, youtube_api, lookback_days, response_cache=None):
 
     '''
     Fetches recently published YouTube videos for a channel 
 
     This function: 
-    1. Split the list of videos IDs into batches of 50 (max supported by the YouTube Data API)
-    2. Retrieves each video's snippet metadata using the API
-    3. Extracts the video ID and published date 
-    4. Filters videos published within the last 'lookback_days' days
-    5. Returns the filtered videos as a DF
+    1. Reads each video's published date (see fetch_video_publish_dates()). Videos whose metadata the daily run 
+    already stored in the response cache aren't requested again
+    2. Filters videos published within the last 'lookback_days' days
+    3. Returns the filtered videos as a DF
 
     Args: 
         video_ids (list): List of Youtube video IDs 
         youtube_api: Authenticated Youtube API client for connection 
         lookback_days: Number of days to look back from today's date when filtering recently published videos
+        response_cache: Optional api_cache.ResponseCache holding stored metadata
 
     Returns: 
         Dataframe with columns:
@@ -252,43 +346,11 @@ def fetch_recent_videos(video_ids, youtube_api, lookback_days):
 
     '''
 
-    # Batch video requests (50 IDs per call) and call fields
-    def batch_video(lst, n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i+n]
-
-    # Add try and except logic. If batch fails then add to a list. 3 retry attempts
-    records = []
-    failed_batches = []
-    for batch in batch_video(video_ids, 50):
-        try:
-            video_response = safe_execute(
-                youtube_api.videos().list(
-                    part="snippet",
-                    id=",".join(batch), 
-                )
-            )
-
-            for item in video_response.get('items', []):
-                records.append(json.dumps(item))
-
-        except Exception as e:
-            print(f'Batch failed: {batch} | Error: {e}')
-            failed_batches.append(batch)
+    video_metrics = fetch_video_publish_dates(video_ids, youtube_api, response_cache)
 
-    # Convert list of json records to DataFrame. Single column of data. If it doesn't exist then return empty DF. Otherwise carry on with rest of code. 
-    if not records:
+    if video_metrics.empty:
         print('No video data to insert - skipping')
-        return pd.DataFrame(columns=['video_id', 'video_data'])
-    
-    video_metrics = pd.DataFrame(records, columns=['video_data'])
-
-    # Create a video id column for each video data row. Pull from video data column
-    video_metrics['video_id'] = [json.loads(record).get('id') for record in records]
-    video_metrics['video_publish_dt'] = [json.loads(record).get('snippet', {}).get('publishedAt') for record in records]
-
-    video_metrics = video_metrics[['video_id', 'video_publish_dt']].drop_duplicates()
-    video_metrics['video_publish_dt'] = pd.to_datetime(video_metrics['video_publish_dt']).dt.date
+        return video_metrics
 
     video_metrics = video_metrics[video_metrics['video_publish_dt'].between(date.today() - timedelta(days=lookback_days), date.today())]
 
@@ -5,23 +5,30 @@ import os
 from isodate import parse_duration
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-import psycopg2
-import io
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+from api_cache import ETagCachingHttp
+import db_pool
+from pg_copy import DataFrameCsvStream, DataFrameBinaryStream, fetch_column_types
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-def safe_execute(request, retries=3):
+def safe_execute(request, retries=3, http=None):
     '''
     Retry logic to be used when executing APIs
     3 attemps before we finally raise the error and stop executing the APIs
 
     Args:
         request: The youtube API client
+        http: Optional http object to execute the request with. Required when executing from worker threads, 
+            as the http object the client was built with is not thread safe (see thread_local_http())
 
     '''
     for attempt in range(retries):
         try:
-            return request.execute()
+            return request.execute(http=http)
         except HttpError as e:
             if attempt == retries - 1:
                 raise 
@@ -29,18 +36,114 @@ def safe_execute(request, retries=3):
             time.sleep(2**attempt)
 
 
-def connect_yt_data_api(api_key):
+class RateLimiter:
+    '''
+    Caps the number of requests started per second across all worker threads
+
+    Each call to wait() reserves the next free slot (1 / requests_per_second apart) and sleeps until it is reached, 
+    so requests are spread evenly rather than fired in bursts
+
+    Args:
+        requests_per_second (float): Maximum number of requests to start per second. None or 0 means no limit
+
+    '''
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_thread_local = threading.local()
+
+
+def thread_local_http(api_client):
+    '''
+    Returns an http object for the current thread, built from the credentials of the given API client
+
+    httplib2 connections are not thread safe, so the http object a client was built with can't be shared between 
+    worker threads. Each thread gets its own (authorised) http object, created once and reused for every request 
+    that thread makes with the same client
+
+    Args:
+        api_client: A youtube API client object from connect_yt_data_api() or connect_yt_analytics_api()
+
+    '''
+    thread_https = getattr(_thread_local, 'https', None)
+    if thread_https is None:
+        thread_https = _thread_local.https = {}
+
+    http = thread_https.get(id(api_client))
+    if http is None:
+        if isinstance(api_client._http, AuthorizedHttp):
+            http = AuthorizedHttp(api_client._http.credentials, http=httplib2.Http())
+        else:
+            http = httplib2.Http()
+        thread_https[id(api_client)] = http
+
+    return http
+
+
+def run_concurrent(fetch_fn, items, max_workers=8, requests_per_second=10):
+    '''
+    Runs fetch_fn over a list of items using a bounded pool of worker threads
+
+    API calls spend nearly all of their time waiting on the network, so running them across threads 
+    rather than one after the other cuts the wall-clock time roughly by the number of workers. 
+    A shared rate limiter keeps the number of requests started per second within the API's budget
+
+    Exceptions are caught per item, so one failed item doesn't stop the rest
+
+    Args:
+        fetch_fn: Function called once per item. Should make a single API request 
+        items (list): Items to pass to fetch_fn e.g. video IDs
+        max_workers (int): Number of worker threads
+        requests_per_second (float): Maximum number of fetch_fn calls started per second across all workers
+
+    Returns:
+        List of (item, result, error) tuples in the same order as items. error is None if the call succeeded
+
+    '''
+    rate_limiter = RateLimiter(requests_per_second)
+
+    def run_one(item):
+        rate_limiter.wait()
+        try:
+            return item, fetch_fn(item), None
+        except Exception as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_one, items))
+
+
+def connect_yt_data_api(api_key, cache=None):
     '''
     Creates a connection to the Youtube Data API
     
     Args: 
         api_key (str): Your Youtube Data API key
+        cache: Optional api_cache.ResponseCache. If given, requests are revalidated with ETags and 
+            unchanged responses are served from disk (see api_cache.ETagCachingHttp)
     
     Returns: 
         A youtube API client object
 
     '''
-    youtube = build('youtube', 'v3', developerKey=api_key)
+    http = ETagCachingHttp(cache) if cache is not None else None
+    youtube = build('youtube', 'v3', developerKey=api_key, http=http)
 
     return youtube
 
@@ -79,7 +182,7 @@ def connect_yt_analytics_api(refresh_token, client_id, client_secret):
     return analytics
 
 
-def get_channel_videos_ids(api_key, channel_id):
+def get_channel_videos_ids(api_key, channel_id, youtube_api=None):
 
     '''
     Returns a list of all video IDs for a given youtube channel
@@ -92,11 +195,12 @@ def get_channel_videos_ids(api_key, channel_id):
     Args: 
         api_key (str): Your Youtube Data API key
         channel_id (str): Your Youtube channel ID
+        youtube_api: Optional youtube API client to reuse (e.g. one with a response cache). Built from api_key if not given
 
     
     '''
 
-    youtube = connect_yt_data_api(api_key)
+    youtube = youtube_api or connect_yt_data_api(api_key)
 
     # Get uploads playlist ID ===
     channel_response = youtube.channels().list(
@@ -130,55 +234,256 @@ def get_channel_videos_ids(api_key, channel_id):
     return video_ids
 
 
-def insert_records_to_postgres(dbl_url, pg_table_name, df, action):
+# Columns that identify a row in each staging table. Used by the merge action (see merge_dataframe())
+MERGE_KEYS = {
+    'sc_yt_video_data': ['video_id'],
+    'sc_yt_day_data': ['date'],
+    'sc_yt_video_transcript': ['video_id'],
+}
+
+# Tables whose merge key identifies a group of rows rather than one row. Each incoming group replaces every existing
+# row with the same key, so a re-transcribed video doesn't keep segments that were dropped or re-timed
+MERGE_GROUPED = {'sc_yt_video_transcript'}
+
+
+def insert_records_to_postgres(dbl_url, pg_table_name, df, action, chunk_size=1000, copy_format='csv', merge_keys=None):
 
     '''
     Inserts records from a Pandas Dataframe into a PostgreSQL staging table. 
 
-    This function performs a full refresh / append of the specified table, depending on the argument called: 
-    1. Connects to the database using the provided URL
-    2. Truncates/appends the staging table
-    3. Copies the dataframe into the table using an in memory CSV buffer. More efficient as it saves on your RAM instead of disk. 
+    This function performs a full refresh / append / merge of the specified table, depending on the argument called: 
+    1. Checks out a connection from the process-wide pool for the provided URL (see db_pool.get_pool())
+    2. Truncates/appends/merges into the staging table. Merge only writes rows that are new or have changed (see merge_dataframe())
+    3. Streams the dataframe into the table, 'chunk_size' rows at a time (see pg_copy.DataFrameCsvStream). 
+    Only one chunk is held in memory at once, rather than a copy of the whole dataframe. 
+    With copy_format='binary', rows are sent in PostgreSQL's binary COPY format instead of CSV (see pg_copy.DataFrameBinaryStream), 
+    which skips quoting/escaping large JSON strings in Python and re-parsing them on the server
 
     Args: 
         dbl_url (str): PostgreSQL connection URL
         pg_table_name (str): Name of the staging table to refresh 
         df: Pandas dataframe containing data to insert into the staging table 
-        action: truncate (full refresh) or append
+        action: truncate (full refresh), append or merge
+        chunk_size (int): Number of rows encoded at a time
+        copy_format (str): csv or binary
+        merge_keys (list): Columns identifying a row, for the merge action. Defaults to MERGE_KEYS[pg_table_name]
     '''
 
-    if action not in ('truncate', 'append'):
-        raise ValueError('action must be truncate or append')
+    if action not in ('truncate', 'append', 'merge'):
+        raise ValueError('action must be truncate, append or merge')
 
-    conn = psycopg2.connect(dbl_url)
-    cur = conn.cursor()
+    if copy_format not in ('csv', 'binary'):
+        raise ValueError('copy_format must be csv or binary')
 
-    try:
-        # === Copy video data into memory buffer ===
-        if action == 'truncate':
-            truncate_message = f"TRUNCATE TABLE stage.{pg_table_name};"
-            cur.execute(truncate_message) ## since full refresh, truncate table first
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                if action == 'truncate':
+                    truncate_message = f"TRUNCATE TABLE stage.{pg_table_name};"
+                    cur.execute(truncate_message) ## since full refresh, truncate table first
 
-        buffer = io.StringIO()
-        df.to_csv(buffer, index=False, header=True)
-        buffer.seek(0)
+                if action == 'merge':
+                    merge_dataframe(cur, pg_table_name, df, merge_keys, chunk_size, copy_format)
+                else:
+                    copy_dataframe(cur, pg_table_name, df, chunk_size, copy_format)
 
-        column_headers = df.columns
-        column_headers = ", ".join(c for c in column_headers)
+                conn.commit()
 
-        copy_message = f"COPY stage.{pg_table_name} ({column_headers}) FROM STDIN WITH CSV HEADER"
+            except Exception as e:
+                conn.rollback()
+                raise e
 
-        cur.copy_expert(
-            copy_message, ## specify json_rows so it knows which column to fill and rest will take default value
-            buffer
-        ) 
 
-        conn.commit()
-    
-    except Exception as e:
-        conn.rollback()
-        raise e
+def copy_dataframe(cur, pg_table_name, df, chunk_size=1000, copy_format='csv', target=None):
+    '''
+    Streams a dataframe into a staging table with COPY on the given cursor, 'chunk_size' rows at a time. 
+    'target' overrides the table copied into (e.g. a temp table with the same columns as stage.<pg_table_name>). 
+    Doesn't commit - that's left to the caller (see insert_records_to_postgres() and insert_records_batch())
+    '''
+
+    target = target or f'stage.{pg_table_name}'
+
+    column_headers = df.columns
+    column_headers = ", ".join(c for c in column_headers)
+
+    # === Stream video data in chunks ===
+    if copy_format == 'binary':
+        copy_stream = DataFrameBinaryStream(df, fetch_column_types(cur, pg_table_name), chunk_size)
+        copy_message = f"COPY {target} ({column_headers}) FROM STDIN WITH (FORMAT binary)"
+    else:
+        copy_stream = DataFrameCsvStream(df, chunk_size)
+        copy_message = f"COPY {target} ({column_headers}) FROM STDIN WITH CSV HEADER"
+
+    cur.copy_expert(
+        copy_message, ## specify json_rows so it knows which column to fill and rest will take default value
+        copy_stream
+    ) 
+
+
+def merge_dataframe(cur, pg_table_name, df, merge_keys=None, chunk_size=1000, copy_format='csv'):
+
+    '''
+    Merges a dataframe into a staging table, only writing rows that are new or whose content has changed. 
+    Doesn't commit - that's left to the caller
+
+    Appending the same video's JSON every day grows the stage tables without limit, and the dbt models then have to 
+    window over the whole history to dedupe it. Merging keeps one row per key instead 
+    (or one group of rows per key, for the MERGE_GROUPED tables).
+
+    This function: 
+    1. Streams the dataframe into a temp table with the same columns as the staging table. 
+    Raises a ValueError if a key appears more than once, unless the table is in MERGE_GROUPED
+    2. Compares an md5 content hash of the incoming rows for each key with the existing rows for the same key 
+    (the hashes of all rows with the key, in hash order, so row order doesn't matter). Keys whose hashes differ, 
+    or that have no existing rows, are changed
+    3. Deletes every existing row of the changed keys, and inserts every incoming row of the changed keys. 
+    Column defaults (e.g. load_ts) apply as normal. Unchanged keys are skipped, so their rows keep their original load_ts
+
+    Delete + insert is used rather than INSERT ... ON CONFLICT, as the staging tables have no unique constraint on the keys 
+    (and tables loaded in append mode hold several rows per key - the first merge collapses them into one)
+
+    Args: 
+        cur: Cursor of an open connection
+        pg_table_name (str): Name of the staging table to merge into 
+        df: Pandas dataframe containing data to merge into the staging table 
+        merge_keys (list): Columns identifying a row (or group of rows). Defaults to MERGE_KEYS[pg_table_name]
+        chunk_size (int): Number of rows encoded at a time
+        copy_format (str): csv or binary
+    '''
+
+    merge_keys = merge_keys or MERGE_KEYS[pg_table_name]
+    merge_table = f'{pg_table_name}__merge'
+    changed_table = f'{pg_table_name}__changed'
+
+    columns = ", ".join(df.columns)
+    keys = ", ".join(merge_keys)
+
+    def group_hash(alias):
+        row_hash = f"md5(ROW({', '.join(f'{alias}.{c}' for c in df.columns)})::text)"
+        return f"md5(string_agg({row_hash}, ',' ORDER BY {row_hash}))"
+
+    def keys_match(left, right):
+        return " AND ".join(f"{left}.{key} = {right}.{key}" for key in merge_keys)
+
+    cur.execute(f"CREATE TEMP TABLE {merge_table} (LIKE stage.{pg_table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    copy_dataframe(cur, pg_table_name, df, chunk_size, copy_format, target=merge_table)
+
+    if pg_table_name not in MERGE_GROUPED:
+        cur.execute(f"SELECT {keys}, count(*) FROM {merge_table} GROUP BY {keys} HAVING count(*) > 1 ORDER BY {keys};")
+        duplicates = cur.fetchall()
+        if duplicates:
+            raise ValueError(
+                f'{len(duplicates)} {keys} values appear more than once in the rows merged into {pg_table_name}, '
+                f'e.g. {duplicates[:5]}. Each {keys} should have one row'
+            )
+
+    cur.execute(f"""
+        CREATE TEMP TABLE {changed_table} ON COMMIT DROP AS
+        SELECT {', '.join(f'incoming.{key}' for key in merge_keys)}
+        FROM (
+            SELECT {keys}, {group_hash('m')} AS content_hash
+            FROM {merge_table} AS m
+            GROUP BY {keys}
+        ) AS incoming
+        LEFT JOIN (
+            SELECT {keys}, {group_hash('s')} AS content_hash
+            FROM stage.{pg_table_name} AS s
+            WHERE EXISTS (SELECT 1 FROM {merge_table} AS m WHERE {keys_match('m', 's')})
+            GROUP BY {keys}
+        ) AS existing
+        ON {keys_match('existing', 'incoming')}
+        WHERE existing.content_hash IS DISTINCT FROM incoming.content_hash;
+    """)
+    changed_keys = cur.rowcount
+
+    cur.execute(f"SELECT count(*) FROM (SELECT DISTINCT {keys} FROM {merge_table}) AS incoming_keys;")
+    unchanged_keys = cur.fetchone()[0] - changed_keys
+
+    cur.execute(f"""
+        DELETE FROM stage.{pg_table_name} AS stage_table 
+        USING {changed_table} AS changed
+        WHERE {keys_match('stage_table', 'changed')};
+    """)
+    replaced_rows = cur.rowcount
+
+    cur.execute(f"""
+        INSERT INTO stage.{pg_table_name} ({columns})
+        SELECT {', '.join(f'm.{c}' for c in df.columns)}
+        FROM {merge_table} AS m
+        JOIN {changed_table} AS changed ON {keys_match('m', 'changed')};
+    """)
+    written_rows = cur.rowcount
+
+    # Dropped now rather than on commit, so the same table can be merged again in one transaction
+    cur.execute(f"DROP TABLE {merge_table}, {changed_table};")
+
+    print(
+        f'Merged into {pg_table_name}: {written_rows} rows written for {changed_keys} new or changed keys '
+        f'({replaced_rows} existing rows replaced), {unchanged_keys} unchanged keys skipped'
+    )
+
+
+def insert_records_batch(dbl_url, loads, chunk_size=1000, copy_format='csv', merge_keys=None):
+
+    '''
+    Inserts several Pandas Dataframes into their PostgreSQL staging tables in a single transaction. 
+
+    Either every table is refreshed or none are - a failure part way through rolls the whole batch back, 
+    so the stage is never left half-refreshed.
+
+    This function: 
+    1. Checks out one connection from the process-wide pool for the provided URL (see db_pool.get_pool())
+    2. For each (table, dataframe, action): 
+    - append: streams the dataframe straight into the table 
+    - merge: only writes rows that are new or have changed (see merge_dataframe())
+    - truncate: streams the dataframe into a temp table with the same columns (dropped on commit), leaving the live table untouched
+    3. For each truncate load, truncates the live table and copies the loaded rows across with INSERT ... SELECT. 
+    These happen together at the end, so the exclusive lock TRUNCATE takes is held for a server-side copy rather than 
+    for the whole upload from Python. Readers wait on that lock and then see the new rows - never an empty table, 
+    as the truncate and insert commit together
+    4. Commits once. Rolls back everything on any error
+
+    The live table itself is never replaced (unlike swapping in a renamed copy), so views and dbt sources built on it, 
+    its grants and owner, and any sequences it owns are all left as they are
+
+    Args: 
+        dbl_url (str): PostgreSQL connection URL
+        loads (list): List of (pg_table_name, df, action) tuples. action is truncate (full refresh), append or merge
+        chunk_size (int): Number of rows encoded at a time
+        copy_format (str): csv or binary
+        merge_keys (dict): Merge key columns per table, for the merge action. Defaults to MERGE_KEYS
+    '''
 
-    finally:
-        cur.close()
-        conn.close()
+    merge_keys = merge_keys or {}
+
+    for pg_table_name, df, action in loads:
+        if action not in ('truncate', 'append', 'merge'):
+            raise ValueError(f'action for {pg_table_name} must be truncate, append or merge')
+
+    if copy_format not in ('csv', 'binary'):
+        raise ValueError('copy_format must be csv or binary')
+
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                refresh_tables = []
+                for pg_table_name, df, action in loads:
+                    if action == 'truncate':
+                        load_table = f'{pg_table_name}__load'
+                        cur.execute(f"CREATE TEMP TABLE {load_table} (LIKE stage.{pg_table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+                        copy_dataframe(cur, pg_table_name, df, chunk_size, copy_format, target=load_table)
+                        refresh_tables.append((pg_table_name, load_table, ", ".join(df.columns)))
+                    elif action == 'merge':
+                        merge_dataframe(cur, pg_table_name, df, merge_keys.get(pg_table_name), chunk_size, copy_format)
+                    else:
+                        copy_dataframe(cur, pg_table_name, df, chunk_size, copy_format)
+
+                for pg_table_name, load_table, columns in refresh_tables:
+                    cur.execute(f"TRUNCATE TABLE stage.{pg_table_name};")
+                    cur.execute(f"INSERT INTO stage.{pg_table_name} ({columns}) SELECT {columns} FROM {load_table};")
+
+                conn.commit()
+
+            except Exception as e:
+                conn.rollback()
+                raise e
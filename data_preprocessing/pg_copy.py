@@ -0,0 +1,210 @@
+import json
+import struct
+from decimal import Decimal
+import pandas as pd
+
+
+class DataFrameCsvStream:
+    '''
+    Read-only file-like object that serves a dataframe as CSV, a chunk of rows at a time
+
+    copy_expert() reads the file it's given in small pieces, so instead of writing the whole dataframe into one
+    in-memory CSV buffer, only 'chunk_size' rows are converted to CSV at any one time. Peak memory stays at roughly
+    one chunk of CSV text, no matter how many rows (or how large the JSON columns) are being loaded
+
+    The first chunk includes the header row, to match COPY ... WITH CSV HEADER
+
+    Args:
+        df: Pandas dataframe to stream
+        chunk_size (int): Number of rows converted to CSV at a time
+
+    '''
+
+    def __init__(self, df, chunk_size=1000):
+        self.chunks = self.generate_chunks(df, chunk_size)
+        self.buffer = self.empty = ''
+        self.position = 0
+
+    @staticmethod
+    def generate_chunks(df, chunk_size):
+        yield df.iloc[:chunk_size].to_csv(index=False, header=True)
+
+        for start in range(chunk_size, len(df), chunk_size):
+            yield df.iloc[start:start+chunk_size].to_csv(index=False, header=False)
+
+    def read(self, size=-1):
+        # Move onto the next chunk once the current one has been fully read. An empty result tells copy_expert we're done
+        while self.position >= len(self.buffer):
+            self.buffer = next(self.chunks, None)
+            self.position = 0
+            if self.buffer is None:
+                self.buffer = self.empty
+                return self.empty
+
+        end = len(self.buffer) if size is None or size < 0 else self.position + size
+        data = self.buffer[self.position:end]
+        self.position += len(data)
+
+        return data
+
+
+# === PostgreSQL binary COPY format ===
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+# Header: signature, flags (int32) and header extension length (int32). Each row: field count (int16),
+# then per field its length in bytes (int32, -1 for NULL) followed by the value in the type's binary send format.
+# Trailer: int16 -1
+
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+NULL_FIELD = struct.pack('!i', -1)
+PG_EPOCH = pd.Timestamp('2000-01-01')
+
+FIXED_WIDTH_TYPES = {
+    'float8': (struct.Struct('!id'), float),
+    'float4': (struct.Struct('!if'), float),
+    'int8': (struct.Struct('!iq'), int),
+    'int4': (struct.Struct('!ii'), int),
+    'int2': (struct.Struct('!ih'), int),
+    'bool': (struct.Struct('!i?'), bool),
+}
+
+TEXT_TYPES = ('text', 'varchar', 'bpchar', 'json')
+
+
+def fetch_column_types(cur, pg_table_name, schema='stage'):
+    '''
+    Returns the PostgreSQL type (udt_name e.g. text, jsonb, float8, timestamp) of every column in a table, keyed by column name
+    '''
+    cur.execute(
+        'SELECT column_name, udt_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s',
+        (schema, pg_table_name)
+    )
+    return dict(cur.fetchall())
+
+
+def encode_numeric(value):
+    '''
+    Encodes a number in PostgreSQL's binary numeric format: digit count, weight, sign and display scale (int16 each),
+    followed by the digits in base 10000 (int16 each)
+    '''
+    value = value if isinstance(value, Decimal) else Decimal(str(value))
+    if value.is_nan():
+        return struct.pack('!ihhHh', 8, 0, 0, 0xC000, 0)
+    if value.is_infinite():
+        raise ValueError('Infinite values cannot be loaded into a numeric column')
+
+    sign, digits, exponent = value.as_tuple()
+    display_scale = max(0, -exponent)
+
+    # Line the decimal digits up into groups of 4 either side of the decimal point
+    digit_str = ''.join(map(str, digits))
+    if exponent > 0:
+        digit_str += '0' * exponent
+        exponent = 0
+    padding = exponent % 4
+    digit_str += '0' * padding
+    exponent -= padding
+    fractional_groups = -exponent // 4
+    digit_str = '0' * (-len(digit_str) % 4) + digit_str
+
+    groups = [int(digit_str[i:i+4]) for i in range(0, len(digit_str), 4)]
+    weight = len(groups) - fractional_groups - 1
+
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    body = struct.pack(f'!hhHh{len(groups)}h', len(groups), weight, 0x4000 if sign else 0, display_scale, *groups)
+    return struct.pack('!i', len(body)) + body
+
+
+def encode_column(series, pg_type):
+    '''
+    Encodes a dataframe column into a list of binary COPY fields (length prefix + value), one per row
+
+    Args:
+        series: Pandas series holding the column's values
+        pg_type (str): PostgreSQL udt_name of the target column
+
+    Returns:
+        List of bytes, one per row
+
+    '''
+    nulls = series.isna().to_numpy()
+
+    if pg_type in FIXED_WIDTH_TYPES:
+        packer, convert = FIXED_WIDTH_TYPES[pg_type]
+        return [NULL_FIELD if null else packer.pack(packer.size - 4, convert(value)) for value, null in zip(series.to_numpy(), nulls)]
+
+    if pg_type in TEXT_TYPES or pg_type == 'jsonb':
+        version = b'\x01' if pg_type == 'jsonb' else b'' # jsonb values start with a format version byte
+        fields = []
+        for value, null in zip(series.to_numpy(), nulls):
+            if null or (isinstance(value, str) and not value): # CSV COPY loads empty strings as NULL, so do the same here
+                fields.append(NULL_FIELD)
+                continue
+            if not isinstance(value, str):
+                value = json.dumps(value) if pg_type in ('json', 'jsonb') else str(value)
+            encoded = version + value.encode('utf-8')
+            fields.append(struct.pack('!i', len(encoded)) + encoded)
+        return fields
+
+    if pg_type in ('timestamp', 'timestamptz'):
+        timestamps = pd.to_datetime(series, utc=(pg_type == 'timestamptz'))
+        if pg_type == 'timestamptz':
+            timestamps = timestamps.dt.tz_localize(None)
+        micros = ((timestamps - PG_EPOCH) // pd.Timedelta(microseconds=1)).to_numpy()
+        return [NULL_FIELD if null else struct.pack('!iq', 8, int(value)) for value, null in zip(micros, nulls)]
+
+    if pg_type == 'date':
+        days = (pd.to_datetime(series).dt.normalize() - PG_EPOCH).dt.days.to_numpy()
+        return [NULL_FIELD if null else struct.pack('!ii', 4, int(value)) for value, null in zip(days, nulls)]
+
+    if pg_type == 'numeric':
+        return [NULL_FIELD if null else encode_numeric(value) for value, null in zip(series.to_numpy(), nulls)]
+
+    raise ValueError(f"Column type '{pg_type}' isn't supported by the binary loader - use copy_format='csv'")
+
+
+class DataFrameBinaryStream(DataFrameCsvStream):
+    '''
+    Read-only file-like object that serves a dataframe in PostgreSQL's binary COPY format, a chunk of rows at a time
+
+    Values are sent in the server's own binary representation, so large JSON strings don't need CSV quoting/escaping
+    on the Python side or re-parsing on the server. Use with COPY ... FROM STDIN WITH (FORMAT binary)
+
+    Args:
+        df: Pandas dataframe to stream
+        column_types (dict): PostgreSQL type of each dataframe column (see fetch_column_types()).
+            Unquoted column names are folded to lower case by COPY, so types are looked up by the lower cased name too
+        chunk_size (int): Number of rows encoded at a time
+
+    '''
+
+    def __init__(self, df, column_types, chunk_size=1000):
+        self.column_types = column_types
+        super().__init__(df, chunk_size)
+        self.buffer = self.empty = b''
+
+    def generate_chunks(self, df, chunk_size):
+        pg_types = []
+        for column in df.columns:
+            pg_type = self.column_types.get(column, self.column_types.get(column.lower()))
+            if pg_type is None:
+                raise ValueError(f"Column '{column}' not found in the target table")
+            pg_types.append(pg_type)
+
+        field_count = struct.pack('!h', len(df.columns))
+
+        yield BINARY_HEADER
+
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start:start+chunk_size]
+            columns = [encode_column(chunk[column], pg_type) for column, pg_type in zip(chunk.columns, pg_types)]
+            yield b''.join(field_count + b''.join(row) for row in zip(*columns))
+
+        yield BINARY_TRAILER
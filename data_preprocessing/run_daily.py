@@ -2,10 +2,13 @@ import os
 import argparse
 from dotenv import load_dotenv
 import helper_functions
+import db_pool
+import api_cache
 import fetch_video_data
 import fetch_day_data
+import video_selection
 
-def main(mode):
+def main(mode, max_workers=8, requests_per_second=10, full_catalogue=False, api_cache_path=None):
 
     # === Load environment variables from .env file ===
     load_dotenv()
@@ -17,21 +20,31 @@ def main(mode):
     dbl_url = os.getenv('DBL_URL')
     print('Loaded environment variables')
 
-    # === Fetch youtube video IDs ===
-    video_ids = helper_functions.get_channel_videos_ids(api_key, channel_id)
-    print('Fetched video IDs')
-
     # === Connect to the youtube data and youtube analytics API's ===
-    youtube_api = helper_functions.connect_yt_data_api(api_key)
+    response_cache = api_cache.ResponseCache(api_cache_path) if api_cache_path else None
+    youtube_api = helper_functions.connect_yt_data_api(api_key, response_cache)
     analytics_api = helper_functions.connect_yt_analytics_api(refresh_token, client_id, client_secret)
     print('Connected to Youtube Data & Analytics APIs')
 
+    # === Fetch youtube video IDs ===
+    video_ids = helper_functions.get_channel_videos_ids(api_key, channel_id, youtube_api)
+    print('Fetched video IDs')
+
+    # === Only re-fetch videos whose stats can still change. A truncate reload needs every video ===
+    if mode != 'truncate' and not full_catalogue:
+        video_ids = video_selection.select_videos_to_refresh(video_ids, dbl_url)
+        print(f'Selected {len(video_ids)} videos to refresh')
+
     # === Fetch youtube video metrics ===
-    video_data = fetch_video_data.fetch_video_full_data(video_ids, youtube_api)
-    video_min_data = fetch_video_data.fetch_video_min_data(video_ids, analytics_api)
-    video_est_watched = fetch_video_data.fetch_video_est_watched(video_ids, analytics_api)
+    video_data = fetch_video_data.fetch_video_full_data(video_ids, youtube_api, response_cache)
+    video_min_data = fetch_video_data.fetch_video_min_data(video_ids, analytics_api, max_workers, requests_per_second)
+    video_est_watched = fetch_video_data.fetch_video_est_watched(video_ids, analytics_api, max_workers, requests_per_second)
     print('Fetched all Youtube video data')
 
+    if response_cache:
+        print(response_cache.summary())
+        response_cache.close()
+
     # === Join video data into a single table ===
     video_metrics_comb = video_data.merge(video_min_data, left_on='video_id', right_on='video_id', how='left').merge(video_est_watched, left_on='video_id', right_on='video_id', how='left')
     video_metrics_comb = video_metrics_comb[['video_id', 'video_data', 'minute_metrics', 'estimatedMinutesWatched']]
@@ -41,13 +54,12 @@ def main(mode):
     day_metrics = fetch_day_data.fetch_day_full_data(analytics_api, mode)
     print('Fetched day metrics')
 
-    # === Insert video data into postgreSQL ===
-    helper_functions.insert_records_to_postgres(dbl_url, 'sc_yt_video_data', video_metrics_comb, mode)
-    print('Inserted video data records into Postgres')
-
-    # === Insert day data into postgreSQL ===
-    helper_functions.insert_records_to_postgres(dbl_url, 'sc_yt_day_data', day_metrics, mode)
-    print('Inserted day data records into Postgres')
+    # === Insert video and day data into postgreSQL in one transaction ===
+    helper_functions.insert_records_batch(dbl_url, [
+        ('sc_yt_video_data', video_metrics_comb, mode),
+        ('sc_yt_day_data', day_metrics, mode),
+    ])
+    print('Inserted video and day data records into Postgres')
 
 
 if __name__ == "__main__":
@@ -56,10 +68,41 @@ if __name__ == "__main__":
 
     parser.add_argument(
         '--mode',
-        choices=['append', 'truncate'],
+        choices=['append', 'merge', 'truncate'],
         required=True
     )
 
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=8, 
+        help='Number of Analytics API requests to run at the same time'
+    )
+
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=10,
+        help='Maximum number of Analytics API requests started per second'
+    )
+
+    parser.add_argument(
+        '--full-catalogue',
+        action='store_true',
+        help='Fetch every video on the channel instead of only the ones whose stats can still change'
+    )
+
+    parser.add_argument(
+        '--api-cache',
+        nargs='?',
+        const='data_preprocessing/api_cache.sqlite3',
+        default=None,
+        help='Cache Youtube Data API responses on disk and revalidate them with ETags. Optionally takes the cache file path'
+    )
+
     args = parser.parse_args()
 
-    main(args.mode)
+    try:
+        main(args.mode, args.max_workers, args.requests_per_second, args.full_catalogue, args.api_cache)
+    finally:
+        db_pool.close_pools() # print pool stats and close every pooled connection, even if the run failed
@@ -3,13 +3,19 @@ import argparse
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 import helper_functions
+import db_pool
+import api_cache
 import fetch_video_data
 import fetch_day_data
 import pandas as pd
 import json
 import video_timestamps
+import transcript_pipeline
+import chunked_transcription
+import transcript_cache
 
-def main(mode):
+def main(mode, api_cache_path=None, download_workers=4, transcribe_workers=1, chunked_workers=None, transcript_cache_path=None, force_transcribe=False,
+         write_transcripts=False, stream_batch_rows=None, vad=False, audio_budget_gb=5):
 
     # === Load environment variables from .env file ===
     load_dotenv()
@@ -18,30 +24,58 @@ def main(mode):
     dbl_url = os.getenv('DBL_URL')
     print('Loaded environment variables')
 
+    # === Connect to the youtube data API ===
+    response_cache = api_cache.ResponseCache(api_cache_path) if api_cache_path else None
+    youtube_api = helper_functions.connect_yt_data_api(api_key, response_cache)
+    print('Connected to Youtube Data API')
+
     # === Fetch youtube video IDs ===
-    video_ids = helper_functions.get_channel_videos_ids(api_key, channel_id)
+    video_ids = helper_functions.get_channel_videos_ids(api_key, channel_id, youtube_api)
     print('Fetched video IDs')
 
-    # === Connect to the youtube data and youtube analytics API's ===
-    youtube_api = helper_functions.connect_yt_data_api(api_key)
-    print('Connected to Youtube Data API')
+    video_metrics = fetch_video_data.fetch_recent_videos(video_ids, youtube_api, lookback_days=7, response_cache=response_cache)
 
-    df_transcript_all = []
-    video_metrics = fetch_video_data.fetch_recent_videos(video_ids, youtube_api, lookback_days=7)
-    model = video_timestamps.load_whisper_model()
+    if response_cache:
+        print(response_cache.summary())
+        response_cache.close()
 
-    for id in video_metrics['video_id'].unique():
-        url = f'https://www.youtube.com/watch?v={id}'
-        video_timestamps.download_video_audio(url)
-        video_timestamps.download_video_transcript(id, model)
-        df_transcript = video_timestamps.video_transcript_clean(id)
-        df_transcript_all.append(df_transcript)
+    # === Download, transcribe and load each video's transcript into postgreSQL ===
+    # With chunked transcription each worker process loads its own model, so the shared one isn't needed
+    if chunked_workers is not None:
+        model = None
+        chunked_transcriber = chunked_transcription.ChunkedTranscriber(workers=chunked_workers or None, vad=vad)
+    else:
+        model = video_timestamps.load_whisper_model(num_workers=transcribe_workers, warm_up=True)
+        chunked_transcriber = None
 
-    df_transcript_all = pd.concat(df_transcript_all, ignore_index=True)
+    cache = None
+    if transcript_cache_path:
+        settings = transcript_cache.transcript_settings(chunked_transcriber, vad)
+        cache = transcript_cache.TranscriptCache(transcript_cache_path, settings, force=force_transcribe)
 
-    # === Insert transcript data into postgreSQL ===
-    helper_functions.insert_records_to_postgres(dbl_url, 'sc_yt_video_transcript', df_transcript_all, mode)
-    print('Inserted transcript data records into Postgres')
+    try:
+        failed_videos = transcript_pipeline.run_transcript_pipeline(
+            list(video_metrics['video_id'].unique()),
+            model,
+            dbl_url,
+            mode,
+            download_workers=download_workers,
+            transcribe_workers=transcribe_workers,
+            chunked_transcriber=chunked_transcriber,
+            transcript_cache=cache,
+            write_transcripts=write_transcripts,
+            stream_batch_rows=stream_batch_rows,
+            vad=vad,
+            audio_budget_bytes=int(audio_budget_gb * 1e9)
+        )
+    finally:
+        if chunked_transcriber is not None:
+            chunked_transcriber.close()
+        if cache is not None:
+            print(cache.summary())
+            cache.close()
+
+    print(f'Inserted transcript data records into Postgres. Failed videos: {[video_id for video_id, _ in failed_videos]}')
 
 
 if __name__ == "__main__":
@@ -50,10 +84,86 @@ if __name__ == "__main__":
 
     parser.add_argument(
         '--mode',
-        choices=['append', 'truncate'],
+        choices=['append', 'merge', 'truncate'],
         required=True
     )
 
+    parser.add_argument(
+        '--api-cache',
+        nargs='?',
+        const='data_preprocessing/api_cache.sqlite3',
+        default=None,
+        help='Cache Youtube Data API responses on disk and revalidate them with ETags. Optionally takes the cache file path'
+    )
+
+    parser.add_argument(
+        '--download-workers',
+        type=int,
+        default=4,
+        help='Number of videos downloaded at the same time'
+    )
+
+    parser.add_argument(
+        '--transcribe-workers',
+        type=int,
+        default=1,
+        help='Number of videos transcribed at the same time, sharing one Whisper model'
+    )
+
+    parser.add_argument(
+        '--chunked',
+        nargs='?',
+        type=int,
+        const=0,
+        default=None,
+        help='Split each video into overlapping chunks and transcribe them across a process pool. '
+        'Optionally takes the number of processes, defaults to one per 2 cores'
+    )
+
+    parser.add_argument(
+        '--transcript-cache',
+        nargs='?',
+        const='data_preprocessing/transcript_cache.sqlite3',
+        default=None,
+        help='Skip videos that already have a transcript from the same audio and Whisper settings. Optionally takes the manifest file path'
+    )
+
+    parser.add_argument(
+        '--force-transcribe',
+        action='store_true',
+        help='Ignore the transcript cache and transcribe every video again'
+    )
+
+    parser.add_argument(
+        '--write-transcripts',
+        action='store_true',
+        help='Also write each transcript to data_preprocessing/video_transcripts/{video_id}.txt'
+    )
+
+    parser.add_argument(
+        '--stream-batch-rows',
+        type=int,
+        default=None,
+        help='Load transcripts into Postgres every N rows while they are still being transcribed. Ignored with --mode merge'
+    )
+
+    parser.add_argument(
+        '--vad',
+        action='store_true',
+        help='Skip silence with voice activity detection and only transcribe speech. Silence is still loaded as empty gap rows'
+    )
+
+    parser.add_argument(
+        '--audio-budget-gb',
+        type=float,
+        default=5,
+        help='Disk budget for downloaded audio. The least recently used files are deleted past it'
+    )
+
     args = parser.parse_args()
 
-    main(args.mode)
+    try:
+        main(args.mode, args.api_cache, args.download_workers, args.transcribe_workers, args.chunked, args.transcript_cache, args.force_transcribe,
+             args.write_transcripts, args.stream_batch_rows, args.vad, args.audio_budget_gb)
+    finally:
+        db_pool.close_pools() # print pool stats and close every pooled connection, even if the run failed
@@ -0,0 +1,164 @@
+import sqlite3
+import json
+import hashlib
+import os
+import threading
+import time
+import video_timestamps
+
+
+def file_hash(path, block_size=1024*1024):
+    '''
+    SHA-256 of a file's contents, read a block at a time so large audio files aren't loaded into memory
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def transcript_settings(chunked_transcriber=None, vad=False):
+    '''
+    Everything that changes the transcript Whisper produces for the same audio: model, compute type,
+    transcribe() options (including VAD) and, if used, the chunking
+    '''
+    return {
+        'model': video_timestamps.MODEL_NAME,
+        'compute_type': video_timestamps.COMPUTE_TYPE,
+        'transcribe_options': video_timestamps.transcribe_options(vad),
+        'chunking': [chunked_transcriber.chunk_secs, chunked_transcriber.overlap_secs] if chunked_transcriber else None,
+    }
+
+
+class TranscriptCache:
+    '''
+    Manifest of the transcripts already produced, so re-runs don't download and transcribe the same video again
+
+    One row per video, backed by a local SQLite file, holding the hash of the audio it was transcribed from,
+    a hash of the Whisper settings used (see transcript_settings()), the transcript file written and, for VAD transcripts,
+    the audio's duration. The file only holds the segments, so the duration is what lets the gap rows for the silence
+    at the start and end of the audio be added back when the file is cleaned on a later run
+    A video counts as already transcribed when:
+    1. its row was written with the current settings
+    2. its transcript file still exists
+    3. if the audio file is on disk, its hash matches the one it was transcribed from
+    4. with VAD, its duration was stored
+
+    Counts hits and misses for a summary at the end of the run
+
+    Args:
+        path (str): Path to the SQLite file. Created if it doesn't exist
+        settings (dict): Whisper settings for this run, from transcript_settings()
+        force (bool): If True, every lookup misses so every video is transcribed again. New transcripts are still stored
+
+    '''
+
+    def __init__(self, path, settings, force=False):
+        self.path = path
+        self.settings_key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+        self.force = force
+        self.vad = bool(settings['transcribe_options'].get('vad_filter'))
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    video_id TEXT PRIMARY KEY,
+                    audio_hash TEXT NOT NULL,
+                    settings_key TEXT NOT NULL,
+                    transcript_path TEXT NOT NULL,
+                    duration REAL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            # Manifests written before the duration was stored get the column added, with no duration for every video
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(transcripts)')]
+            if 'duration' not in columns:
+                self.conn.execute('ALTER TABLE transcripts ADD COLUMN duration REAL')
+            self.conn.commit()
+
+    def lookup(self, video_id, audio_path=None):
+
+        '''
+        Checks whether a video already has a valid transcript, and records a hit or a miss
+
+        Args:
+            video_id (str): Youtube video ID
+            audio_path (str): Path the video's audio is downloaded to. If the file exists, its hash must match
+
+        Returns:
+            A (transcript path, duration) tuple on a hit, otherwise None. The duration is None for transcripts made without VAD
+
+        '''
+
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT audio_hash, settings_key, transcript_path, duration FROM transcripts WHERE video_id = ?',
+                (video_id,)
+            ).fetchone()
+
+        valid = (
+            not self.force
+            and row is not None
+            and row[1] == self.settings_key
+            and os.path.exists(row[2])
+            and (audio_path is None or not os.path.exists(audio_path) or file_hash(audio_path) == row[0])
+            and (not self.vad or row[3] is not None)
+        )
+
+        self.record(hit=valid)
+
+        return (row[2], row[3]) if valid else None
+
+    def store(self, video_id, audio_path, transcript_path, duration=None):
+        '''
+        Records a video's transcript. 'duration' is the audio's length in seconds, needed for VAD transcripts
+        '''
+        audio_hash = file_hash(audio_path)
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO transcripts (video_id, audio_hash, settings_key, transcript_path, duration, stored_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (video_id, audio_hash, self.settings_key, transcript_path, duration, time.time())
+            )
+            self.conn.commit()
+
+    def durations(self):
+        '''
+        Returns a dict of video ID -> stored audio duration, for every video whose transcript was made with VAD.
+        Lets transcript files be cleaned with the same edge gap rows outside the pipeline (see backfill_transcripts.py)
+        '''
+        with self.lock:
+            return dict(self.conn.execute('SELECT video_id, duration FROM transcripts WHERE duration IS NOT NULL').fetchall())
+
+    def invalidate(self, video_ids=None):
+        '''
+        Removes the given videos from the manifest, or every video if video_ids is None
+        '''
+        with self.lock:
+            if video_ids is None:
+                self.conn.execute('DELETE FROM transcripts')
+            else:
+                self.conn.executemany('DELETE FROM transcripts WHERE video_id = ?', [(video_id,) for video_id in video_ids])
+            self.conn.commit()
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return f'Transcript cache: {self.hits} hits | {self.misses} misses | {hit_rate:.0%} hit rate'
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,86 @@
+import mmap
+import numpy as np
+
+# Bytes that open and close a line's timestamps, and separate the start from the end
+OPEN = b'['
+CLOSE = b']'
+ARROW = b' -> '
+
+
+def parse_transcript_line(line, line_number):
+    '''
+    Splits one '[start -> end] text' line (bytes, without its newline) into start, end and text.
+    Only the first ']' ends the timestamps, so any ']' in the text is kept as part of it
+    '''
+    close = line.find(CLOSE)
+    arrow = line.find(ARROW, 0, close)
+    if not line.startswith(OPEN) or close == -1 or arrow == -1:
+        raise ValueError(f"Line {line_number} isn't in the '[start -> end] text' format: {line[:80]!r}")
+
+    return float(line[1:arrow]), float(line[arrow+len(ARROW):close]), line[close+1:].decode('utf-8')
+
+
+def count_lines(data):
+    '''
+    Counts the newlines in a bytes or mmap object without copying it. mmap objects have no count() method
+    '''
+    return int(np.count_nonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')))
+
+
+def parse_transcript_file(video_transcript_path, use_mmap=False):
+
+    '''
+    Reads a '[start -> end] text' transcript file in a single pass
+
+    The number of lines is counted up front so start and end times go straight into preallocated float arrays,
+    with the text collected in a list. Blank lines are skipped
+
+    Args:
+        video_transcript_path (str): Path to the transcript text file
+        use_mmap (bool): Memory-map the file instead of reading it into memory. Worth it for very large files,
+            as only the pages being parsed need to be in memory
+
+    Returns:
+        Tuple of (start_time, end_time, text): two float64 numpy arrays and a list of strings
+
+    '''
+
+    with open(video_transcript_path, 'rb') as f:
+        if use_mmap:
+            if f.seek(0, 2) == 0: # an empty file can't be memory-mapped
+                return np.empty(0), np.empty(0), []
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = f.read()
+
+    try:
+        max_lines = count_lines(data) + 1
+        start_time = np.empty(max_lines)
+        end_time = np.empty(max_lines)
+        text = []
+
+        row = 0
+        line_number = 0
+        position = 0
+        length = len(data)
+        while position < length:
+            line_end = data.find(b'\n', position)
+            if line_end == -1:
+                line_end = length
+
+            line = data[position:line_end].rstrip(b'\r')
+            position = line_end + 1
+            line_number += 1
+
+            if not line.strip():
+                continue
+
+            start_time[row], end_time[row], line_text = parse_transcript_line(line, line_number)
+            text.append(line_text)
+            row += 1
+
+    finally:
+        if use_mmap:
+            data.close()
+
+    return start_time[:row], end_time[:row], text
@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import helper_functions
+import video_timestamps
+import audio_store
+
+
+# Put on the queue once per transcription worker after the last download, so each worker knows to stop.
+# Everything else on the queue is a (video_id, cached, duration) tuple, duration being the one the transcript cache stored
+DONE = None
+
+
+def run_transcript_pipeline(video_ids, model, dbl_url, mode, download_workers=4, transcribe_workers=1, queue_size=4, chunked_transcriber=None, transcript_cache=None,
+                            write_transcripts=False, stream_batch_rows=None, vad=False, audio_budget_bytes=None):
+
+    '''
+    Downloads, transcribes, cleans and loads the transcripts for a list of videos as a staged pipeline
+
+    Downloading is network bound and transcribing is CPU bound, so instead of doing one video at a time
+    the two stages run side by side:
+    1. 'download_workers' threads download audio with yt-dlp and put each finished video ID on a queue
+    2. 'transcribe_workers' threads take video IDs off the queue and transcribe them with the shared Whisper model.
+    Segments are gap filled as they're decoded and loaded into stage.sc_yt_video_transcript straight away
+
+    The queue holds at most 'queue_size' downloaded videos, so downloads pause when transcription falls behind
+    rather than filling the disk with audio. The run then takes roughly as long as the slower of the two stages,
+    rather than the sum of both
+
+    A video that fails to download or transcribe is reported and skipped, the rest carry on
+
+    Args:
+        video_ids (list): Youtube video IDs to transcribe
+        model: Whisper model from video_timestamps.load_whisper_model(). Load it with num_workers=transcribe_workers
+            so the workers can transcribe at the same time
+        dbl_url (str): PostgreSQL connection URL
+        mode (str): Load action for the first transcript loaded (truncate, append or merge).
+            With truncate, every later transcript is appended so earlier videos in the run aren't wiped
+        download_workers (int): Number of download threads
+        transcribe_workers (int): Number of transcription threads
+        queue_size (int): Maximum number of downloaded videos waiting to be transcribed
+        chunked_transcriber: Optional chunked_transcription.ChunkedTranscriber. If given, each video is split into chunks
+            and transcribed across its process pool instead of with 'model'
+        transcript_cache: Optional transcript_cache.TranscriptCache. Videos it already holds a valid transcript for
+            skip the download and transcription and go straight to cleaning and loading.
+            Transcript text files are always written when a cache is used, as the cache serves them on later runs
+        write_transcripts (bool): Also write each transcript to data_preprocessing/video_transcripts/{video_id}.txt
+        stream_batch_rows (int): If given, transcripts are loaded every 'stream_batch_rows' rows while Whisper is still
+            decoding, rather than once the whole video is done. A video that fails part way will have been partly loaded.
+            Ignored in merge mode: a merge compares a video's rows as a whole, so each video is loaded in one go
+        vad (bool): Only send speech regions to Whisper (see video_timestamps.stream_video_transcript()).
+            The chunked transcriber has its own vad setting
+        audio_budget_bytes (int): If given, the least recently used audio files are deleted whenever
+            data_preprocessing/video_audio/ grows past this size. Audio still waiting to be transcribed is kept
+
+    Returns:
+        List of (video_id, error) tuples for the videos that failed
+
+    '''
+
+    downloaded = queue.Queue(maxsize=queue_size)
+    # A merge only skips a video whose rows all match the stored ones, so it needs the whole video at once
+    batch_rows = None if mode == 'merge' else stream_batch_rows
+    vad_edges = chunked_transcriber.vad if chunked_transcriber is not None else vad # transcripts get gap rows up to the audio's edges
+    failed_videos = []
+    failed_lock = threading.Lock()
+    load_lock = threading.Lock()
+    load_state = {'action': mode, 'rows': 0, 'videos': 0}
+    pending_audio = set() # videos being downloaded or waiting to be transcribed, so their audio isn't evicted
+    audio_lock = threading.Lock()
+
+    def record_failure(video_id, stage, error):
+        print(f'Failed to {stage} {video_id}: {error}')
+        with failed_lock:
+            failed_videos.append((video_id, error))
+
+    def release_audio(video_id):
+        with audio_lock:
+            pending_audio.discard(video_id)
+            keep = set(pending_audio)
+
+        if audio_budget_bytes is not None:
+            try:
+                audio_store.enforce_budget(audio_budget_bytes, keep)
+            except Exception as e: # a failed eviction shouldn't stop the pipeline, the next one tries again
+                print(f'Failed to evict audio: {e}')
+
+    def download(video_id):
+        # Pending before the cache lookup, as it hashes any audio already on disk and that mustn't be evicted part way
+        with audio_lock:
+            pending_audio.add(video_id)
+
+        try:
+            cached = transcript_cache.lookup(video_id, audio_store.audio_path(video_id)) if transcript_cache is not None else None
+            if cached is None:
+                video_timestamps.download_video_audio(f'https://www.youtube.com/watch?v={video_id}')
+        except Exception as e:
+            record_failure(video_id, 'download', e)
+            release_audio(video_id)
+            return
+
+        if cached is not None:
+            # The cached transcript is used instead, so the audio isn't needed any more
+            with audio_lock:
+                pending_audio.discard(video_id)
+            downloaded.put((video_id, True, cached[1]))
+            return
+
+        downloaded.put((video_id, False, None)) # blocks while the queue is full
+
+    def load(df_transcript):
+        # Loads go one at a time. The first uses 'mode', and a truncate is only ever done once
+        with load_lock:
+            helper_functions.insert_records_to_postgres(dbl_url, 'sc_yt_video_transcript', df_transcript, load_state['action'])
+            if load_state['action'] == 'truncate':
+                load_state['action'] = 'append'
+            load_state['rows'] += len(df_transcript)
+
+    def transcribe():
+        while True:
+            item = downloaded.get()
+            if item is DONE:
+                return
+
+            video_id, cached, duration = item
+            transcript_path = f'data_preprocessing/video_transcripts/{video_id}.txt'
+            try:
+                if cached:
+                    batches = [video_timestamps.video_transcript_clean(video_id, duration)]
+                else:
+                    side_output = transcript_path if write_transcripts or transcript_cache is not None else None
+                    if chunked_transcriber is not None:
+                        rows = chunked_transcriber.stream_video_transcript(video_id, side_output)
+                    else:
+                        rows = video_timestamps.stream_video_transcript(video_id, model, side_output, vad)
+                    batches = video_timestamps.transcript_batches(rows, batch_rows)
+
+                row_count = 0
+                last_end = 0.0
+                for df_transcript in batches:
+                    load(df_transcript)
+                    row_count += len(df_transcript)
+                    if len(df_transcript):
+                        last_end = float(df_transcript['end_time'].iloc[-1])
+
+                if not cached and transcript_cache is not None:
+                    # With VAD the last row is the gap up to the end of the audio, so it ends at the audio's duration.
+                    # The cache keeps it so the same edge gap rows are added when the file is cleaned on a later run
+                    transcript_cache.store(video_id, audio_store.audio_path(video_id), transcript_path, last_end if vad_edges else None)
+
+                with load_lock:
+                    load_state['videos'] += 1
+                print(f'Loaded transcript for {video_id} ({row_count} rows)')
+            except Exception as e:
+                record_failure(video_id, 'transcribe', e)
+            finally:
+                # Whatever happens, the worker goes back to the queue - downloads block on put() until it's emptied
+                if not cached:
+                    try:
+                        audio_store.touch(video_id)
+                    except Exception as e:
+                        print(f'Failed to mark audio of {video_id} as used: {e}')
+                    release_audio(video_id)
+
+    start_time = time.time()
+
+    transcribers = [threading.Thread(target=transcribe, daemon=True) for _ in range(transcribe_workers)]
+    for transcriber in transcribers:
+        transcriber.start()
+
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        list(executor.map(download, video_ids))
+
+    for _ in transcribers:
+        downloaded.put(DONE)
+    for transcriber in transcribers:
+        transcriber.join()
+
+    print(
+        f"Transcript pipeline: {load_state['videos']}/{len(video_ids)} videos loaded | {load_state['rows']} rows | "
+        f"{len(failed_videos)} failed | {time.time() - start_time:.2f} seconds"
+    )
+
+    return failed_videos
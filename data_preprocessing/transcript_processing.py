@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+import transcript_parser
+
+
+def read_transcript_file(video_transcript_path, video_id, use_mmap=False):
+
+    '''
+    Loads a '[start -> end] text' transcript file into a dataframe (see transcript_parser.parse_transcript_file())
+
+    Args:
+        video_transcript_path (str): Path to the transcript text file
+        video_id (str): Youtube video ID, added to every row
+        use_mmap (bool): Memory-map the file while parsing it
+
+    Returns:
+        Dataframe with columns text, video_id, start_time and end_time
+
+    '''
+
+    start_time, end_time, text = transcript_parser.parse_transcript_file(video_transcript_path, use_mmap)
+
+    return pd.DataFrame({
+        'text': text,
+        'video_id': video_id,
+        'start_time': start_time,
+        'end_time': end_time
+    })
+
+
+def insert_gap_rows(df_transcript, video_id, duration=None):
+
+    '''
+    Adds an empty transcript row for every gap between consecutive segments
+
+    Whenever the next segment's start_time is after a segment's end_time, an empty row running from one to the other
+    is added, so the transcript covers the video without holes (overlapping segments get no gap row). Gap rows have empty text, and any other columns are left empty
+
+    Rather than looping over the rows, every segment's end_time is compared with the next start_time in one go
+    (the end_time array against the start_time array shifted by one). The gap rows are then interleaved straight after
+    the segment they follow, and the result sorted by start_time, giving the same rows as sorting the segments and gaps together
+
+    If the audio's duration is given, empty rows are also added before the first segment (from 0) and after the last
+    one (up to the duration), as video_timestamps.fill_transcript_gaps() does for VAD transcripts
+
+    Args:
+        df_transcript: Dataframe of transcript segments in time order, with start_time, end_time and text columns
+        video_id (str): Youtube video ID for the gap rows
+        duration (float): Optional length of the audio in seconds
+
+    Returns:
+        Dataframe of the segments and gap rows sorted by start_time
+
+    '''
+
+    start_time = df_transcript['start_time'].to_numpy()
+    end_time = df_transcript['end_time'].to_numpy()
+
+    gap_after = np.flatnonzero(start_time[1:] > end_time[:-1]) # index of each segment that's followed by a gap
+    gap_start = end_time[gap_after]
+    gap_end = start_time[gap_after + 1]
+
+    # Segment i goes in position 2i and the gap after it in 2i + 1
+    positions = np.concatenate([np.arange(len(df_transcript)) * 2, gap_after * 2 + 1])
+
+    if duration is not None:
+        # The edges are treated as gaps after a segment before the first (position -1) and after the last one
+        duration = round(duration, 2)
+        edge_start = np.array([0.0, end_time[-1] if len(end_time) else 0.0])
+        edge_end = np.array([start_time[0] if len(start_time) else duration, duration])
+        edge_positions = np.array([-1, len(df_transcript) * 2 + 1])
+
+        # With no segments both edges are the same 0 -> duration gap, so only the trailing one is kept
+        has_edge = np.array([len(df_transcript) > 0 and edge_start[0] < edge_end[0], edge_start[1] < edge_end[1]])
+        gap_start = np.concatenate([gap_start, edge_start[has_edge]])
+        gap_end = np.concatenate([gap_end, edge_end[has_edge]])
+        positions = np.concatenate([positions, edge_positions[has_edge]])
+
+    df_gaps = pd.DataFrame({
+        'start_time': gap_start,
+        'end_time': gap_end,
+        'text': '',
+        'video_id': video_id
+    })
+
+    df_filled = pd.concat([df_transcript, df_gaps], ignore_index=True)
+    df_filled = df_filled.iloc[np.argsort(positions, kind='stable')]
+
+    return df_filled.sort_values('start_time', ascending=True, kind='stable').reset_index(drop=True)
+
+
+def clean_transcript_file(video_transcript_path, video_id, use_mmap=False, duration=None):
+    '''
+    Reads a transcript file and fills its gaps, returning the rows loaded into stage.sc_yt_video_transcript:
+    video_id, start_time, end_time and text. 
+    Pass the audio's duration for VAD transcripts, so the silence at the start and end gets its gap rows too (see insert_gap_rows())
+    '''
+    df_transcript = read_transcript_file(video_transcript_path, video_id, use_mmap)
+
+    return insert_gap_rows(df_transcript, video_id, duration)[['video_id', 'start_time', 'end_time', 'text']]
+
+
+def explode_to_buckets(df_transcript, bucket_secs=60):
+
+    '''
+    Splits transcript rows at every bucket boundary, so each row sits entirely within one time bucket
+
+    A row from 354.12 -> 368.08 becomes 354.12 -> 360.00 and 360.00 -> 368.08 with 60 second buckets.
+    Rows can span any number of buckets (long gap rows often span several), and get one row per bucket they overlap.
+    Each piece keeps the original row's text and other columns. A row ending exactly on a boundary doesn't spill
+    a zero length piece into the next bucket
+
+    All of it is done with NumPy: the number of buckets each row spans is worked out, rows are repeated that many times,
+    and each copy is clipped to its bucket
+
+    Args:
+        df_transcript: Dataframe of transcript rows with start_time, end_time and text columns
+        bucket_secs (int): Width of each bucket in seconds e.g. 30, 60 or 300
+
+    Returns:
+        Dataframe with one row per (row, bucket) overlap, with start_time and end_time clipped to the bucket, and columns:
+            start_time_lb_{bucket_secs}: Lower boundary of the bucket
+            start_time_ub_{bucket_secs}: Upper boundary of the bucket
+            duration_secs: Seconds of the bucket the piece covers
+            duration_secs_valid: duration_secs for pieces with text, 0 for empty gap rows
+
+    '''
+
+    start_time = df_transcript['start_time'].to_numpy(dtype=float)
+    end_time = df_transcript['end_time'].to_numpy(dtype=float)
+
+    first_bucket = np.floor(start_time / bucket_secs).astype(np.int64)
+    last_bucket = np.maximum(np.ceil(end_time / bucket_secs).astype(np.int64) - 1, first_bucket)
+    bucket_counts = last_bucket - first_bucket + 1
+
+    # Repeat each row once per bucket it spans, then number the copies 0, 1, 2... within each row
+    row_index = np.repeat(np.arange(len(df_transcript)), bucket_counts)
+    copy_number = np.arange(len(row_index)) - np.repeat(np.cumsum(bucket_counts) - bucket_counts, bucket_counts)
+    bucket_start = (first_bucket[row_index] + copy_number) * bucket_secs
+
+    df_buckets = df_transcript.iloc[row_index].reset_index(drop=True)
+    df_buckets['start_time'] = np.maximum(start_time[row_index], bucket_start)
+    df_buckets['end_time'] = np.minimum(end_time[row_index], bucket_start + bucket_secs)
+    df_buckets[f'start_time_lb_{bucket_secs}'] = bucket_start
+    df_buckets[f'start_time_ub_{bucket_secs}'] = bucket_start + bucket_secs
+    df_buckets['duration_secs'] = df_buckets['end_time'] - df_buckets['start_time']
+    df_buckets['duration_secs_valid'] = np.where(df_buckets['text'] != '', df_buckets['duration_secs'], 0)
+
+    return df_buckets
+
+
+def transcript_buckets(df_transcript, bucket_secs=60):
+
+    '''
+    Aggregates transcript rows into fixed width time buckets (see explode_to_buckets())
+
+    Args:
+        df_transcript: Dataframe of gap filled transcript rows with video_id, start_time, end_time and text columns
+        bucket_secs (int): Width of each bucket in seconds e.g. 30, 60 or 300
+
+    Returns:
+        Dataframe with one row per video and bucket, with columns:
+            video_id
+            start_time_lb_{bucket_secs}, start_time_ub_{bucket_secs}: Bucket boundaries
+            minute_boundaries: Bucket boundaries as a 'lower-upper' string
+            text: All transcript text in the bucket, in time order
+            duration_secs_valid: Seconds of the bucket covered by transcript text
+            duration_text_coverage_pct: Fraction of the bucket covered by transcript text
+
+    '''
+
+    lower_boundary = f'start_time_lb_{bucket_secs}'
+    upper_boundary = f'start_time_ub_{bucket_secs}'
+
+    df_buckets = explode_to_buckets(df_transcript, bucket_secs)
+    df_buckets['minute_boundaries'] = df_buckets[lower_boundary].astype(str) + '-' + df_buckets[upper_boundary].astype(str)
+
+    df_grouped = (
+        df_buckets
+        .groupby(['video_id', lower_boundary, upper_boundary, 'minute_boundaries'], as_index=False, sort=False)
+        .agg(
+            text=('text', ''.join),
+            duration_secs_valid=('duration_secs_valid', 'sum')
+        )
+        .sort_values(['video_id', lower_boundary], kind='stable', ignore_index=True)
+    )
+
+    df_grouped['duration_text_coverage_pct'] = df_grouped['duration_secs_valid'] / bucket_secs
+
+    return df_grouped
@@ -0,0 +1,103 @@
+import zlib
+from datetime import date
+import pandas as pd
+import db_pool
+
+
+def fetch_video_refresh_state(dbl_url):
+
+    '''
+    Returns the latest load state of every video already in the raw data vault
+
+    rdv.social_content_sat_details only gets a new row when a video's hashdiff changes,
+    so the latest load_ts per video is the last time any of its stats (views, likes, comments, watch time etc) moved
+
+    Args:
+        dbl_url (str): PostgreSQL connection URL
+
+    Returns:
+        Dataframe with columns:
+            video_id: Youtube video ID
+            days_since_published: Days between the video's publish date and now
+            days_since_change: Days between the latest load_ts and now
+
+    '''
+
+    refresh_state_query = """
+        select
+            video_id
+            , extract(epoch from now() - max(video_published_at)) / 86400 as days_since_published
+            , extract(epoch from now() - max(load_ts)) / 86400 as days_since_change
+
+        from rdv.social_content_sat_details
+        group by video_id
+    """
+
+    with db_pool.get_pool(dbl_url).connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(refresh_state_query)
+            rows = cur.fetchall()
+
+    return pd.DataFrame(rows, columns=['video_id', 'days_since_published', 'days_since_change'])
+
+
+def video_shard(video_id, shard_count):
+    '''
+    Stable shard number for a video. zlib.crc32 is used rather than hash() as hash() changes between runs
+    '''
+    return zlib.crc32(video_id.encode('utf-8')) % shard_count
+
+
+def select_videos_to_refresh(video_ids, dbl_url, recent_days=30, active_days=7, shard_count=7, run_date=None):
+
+    '''
+    Picks the videos whose stats can still change, so the daily run only re-fetches those
+
+    Each video is put into a tier:
+    1. new - not in the raw data vault yet. Always fetched
+    2. recent - published within the last 'recent_days' days. Always fetched
+    3. active - stats changed within the last 'active_days' days. Always fetched
+    4. rotating - everything else. Split into 'shard_count' shards by video ID, and only the shard matching
+    today's date is fetched. With shard_count=7, every older video is still refreshed once a week
+
+    If an older video picks up views again, it gets caught on its shard day and then counts as active,
+    so it's fetched every run until it goes quiet again
+
+    Args:
+        video_ids (list): List of all Youtube video IDs for the channel
+        dbl_url (str): PostgreSQL connection URL
+        recent_days (int): Videos published within this many days are fetched every run
+        active_days (int): Videos whose stats changed within this many days are fetched every run
+        shard_count (int): Number of shards the remaining videos are split into
+        run_date (date): Date used to pick today's shard. Defaults to today
+
+    Returns:
+        List of video IDs to fetch, in the same order as video_ids
+
+    '''
+
+    run_date = run_date or date.today()
+    todays_shard = run_date.toordinal() % shard_count
+
+    refresh_state = fetch_video_refresh_state(dbl_url).set_index('video_id')
+
+    tiers = {'new': [], 'recent': [], 'active': [], 'rotating': [], 'skipped': []}
+    for video_id in video_ids:
+        if video_id not in refresh_state.index:
+            tier = 'new'
+        elif refresh_state.at[video_id, 'days_since_published'] <= recent_days:
+            tier = 'recent'
+        elif refresh_state.at[video_id, 'days_since_change'] <= active_days:
+            tier = 'active'
+        elif video_shard(video_id, shard_count) == todays_shard:
+            tier = 'rotating'
+        else:
+            tier = 'skipped'
+
+        tiers[tier].append(video_id)
+
+    print(' | '.join(f'{tier}: {len(ids)}' for tier, ids in tiers.items()))
+
+    selected = set(tiers['new'] + tiers['recent'] + tiers['active'] + tiers['rotating'])
+
+    return [video_id for video_id in video_ids if video_id in selected]
@@ -1,16 +1,35 @@
 import time
 from yt_dlp import YoutubeDL
-from faster_whisper import WhisperModel
+import whisper_registry
+import audio_store
+import transcript_processing
 import pandas as pd
 import numpy as np
 import os
 
 
 def download_video_audio(url):
+
+    '''
+    Downloads a video's audio to data_preprocessing/video_audio/{video_id}.flac (see audio_store.audio_path())
+
+    The download is converted by ffmpeg to 16kHz mono FLAC, the format Whisper works in, and the original download
+    is deleted. Whisper then doesn't decode and resample the full quality stream on every transcription,
+    and each file is a fraction of the size
+
+    '''
+
     ydl_opts = {
         "format": "bestaudio/best",
-        "outtmpl": "data_preprocessing/video_audio/%(id)s.%(ext)s",
-        "postprocessors": [{"key": "FFmpegMetadata"}],
+        "outtmpl": f"{audio_store.AUDIO_DIR}/%(id)s.%(ext)s",
+        "postprocessors": [
+            {"key": "FFmpegExtractAudio", "preferredcodec": audio_store.AUDIO_FORMAT},
+            {"key": "FFmpegMetadata"}
+        ],
+        "postprocessor_args": {
+            "extractaudio": ["-ar", str(audio_store.SAMPLE_RATE), "-ac", "1"] # resample to 16kHz and downmix to mono
+        },
+        "keepvideo": False, # delete the original download once it's converted
         "noplaylist": True,
         "extractor_args": {
             "youtube": {"player_client": ["android"]}
@@ -23,48 +42,167 @@ def download_video_audio(url):
         ydl.download([url])
 
 
-def load_whisper_model():
+# Whisper model settings. Also part of the transcript cache key, so changing them re-transcribes every video
+MODEL_NAME = 'medium'
+COMPUTE_TYPE = 'int8'
 
-    return WhisperModel(
-        'medium', 
-        device='cpu',
-        compute_type='int8',
-        cpu_threads=8
-    ) 
+# Settings for every model.transcribe() call, shared with chunked_transcription
+TRANSCRIBE_OPTIONS = {
+    'language': 'en',
+    'beam_size': 5,
+    'vad_filter': False, # this filter if true, will remove parts that it doesn't think are speech
+    'condition_on_previous_text': False, # stops Whisper from getting stuck on 'English' words, as we have arabic too
+    'task': 'transcribe',
+}
 
+# Voice activity detection settings for the opt-in VAD mode. Silences shorter than this are transcribed as usual
+VAD_PARAMETERS = {'min_silence_duration_ms': 2000}
 
-def download_video_transcript(video_id, model):
 
-    audio_path = f'data_preprocessing/video_audio/{video_id}.mp4'
-    transcript_path = f'data_preprocessing/video_transcripts/{video_id}.txt'
+def transcribe_options(vad=False):
+    '''
+    Returns the model.transcribe() settings. With vad=True, Silero VAD runs over the audio first and
+    only the speech regions are sent to Whisper, so pre-roll, breaks and dead air aren't decoded
+    '''
+    if not vad:
+        return TRANSCRIBE_OPTIONS
+    return {**TRANSCRIBE_OPTIONS, 'vad_filter': True, 'vad_parameters': VAD_PARAMETERS}
 
-    start_time = time.time()
 
-    segments, info = model.transcribe(
-        audio_path,
-        language='en',
-        beam_size=5,
-        vad_filter=False, # this filter if true, will remove parts that it doesn't think are speech
-        condition_on_previous_text=False, # stops Whisper from getting stuck on 'English' words, as we have arabic too
-        task='transcribe'
+def load_whisper_model(num_workers=1, cpu_threads=8, warm_up=False):
+
+    '''
+    Loads the Whisper model used for every transcript in the run. The model is pinned to a local directory
+    and only loaded once per process (see whisper_registry.get_model())
+
+    Args:
+        num_workers (int): Number of threads that can call model.transcribe() at the same time.
+            The model weights are loaded once and shared between them
+        cpu_threads (int): Number of CPU threads each transcribe() call uses
+        warm_up (bool): Run the model over a short silent clip after loading it
+
+    '''
+
+    return whisper_registry.get_model(
+        MODEL_NAME,
+        COMPUTE_TYPE,
+        cpu_threads=cpu_threads,
+        num_workers=num_workers,
+        warm_up_options=TRANSCRIBE_OPTIONS if warm_up else None
     )
 
-    print(f'Detected languages: {info.language} ({info.language_probability:.2f})')
-    print(f'Audio transcribed in {time.time() - start_time:.2f} seconds')
 
+def write_transcript_segments(segments, transcript_path):
+    '''
+    Passes (start, end, text) segments straight through, writing each one to the transcript text file
+    in the '[start -> end] text' format as it goes
+    '''
     os.makedirs(os.path.dirname(transcript_path), exist_ok=True) # check if folder exists, if it doesn't then create it
 
-    start_time = time.time()
     with open(transcript_path, 'w', encoding='utf-8') as f:
-        for segment in segments:
-            f.write(f'[{segment.start:.2f} -> {segment.end:.2f}] {segment.text}\n')
+        for start, end, text in segments:
+            f.write(f'[{start:.2f} -> {end:.2f}] {text}\n')
+            yield start, end, text
+
 
-    print(f'Audio transcription written in {time.time() - start_time:.2f} seconds')
+def fill_transcript_gaps(video_id, segments, duration=None):
 
+    '''
+    Streaming version of transcript_processing.insert_gap_rows(), used by video_transcript_clean()
 
+    Yields a (video_id, start_time, end_time, text) row for every segment. Whenever a segment starts after
+    the previous one ended, an empty row covering the gap is yielded between them.
+    Only the previous segment's end time is kept, so rows come out as soon as each segment is decoded
 
+    If the audio's duration is given, empty rows are also added before the first segment (from 0) and after the last
+    one (up to the duration). The VAD mode needs these, as silence at the start and end of a stream produces no
+    segments, and the minute buckets downstream would otherwise be missing that time
 
-def video_transcript_clean(video_id):
+    Args:
+        video_id (str): Youtube video ID
+        segments: Iterable of (start, end, text) tuples in time order
+        duration (float): Optional length of the audio in seconds
+
+    '''
+
+    previous_end = 0.0 if duration is not None else None
+    for start, end, text in segments:
+        # Rounded and prefixed with a space to match what video_transcript_clean() reads back from the text file
+        start, end = round(start, 2), round(end, 2)
+
+        if previous_end is not None and start > previous_end: # segments that overlap get no gap row, rather than one running backwards
+            yield video_id, previous_end, start, ''
+
+        yield video_id, start, end, f' {text}'
+        previous_end = end
+
+    if duration is not None and previous_end < round(duration, 2):
+        yield video_id, previous_end, round(duration, 2), ''
+
+
+def stream_video_transcript(video_id, model, transcript_path=None, vad=False):
+
+    '''
+    Transcribes a downloaded video and yields its cleaned, gap filled transcript rows as Whisper decodes them
+
+    Whisper's segments go straight into fill_transcript_gaps(), rather than being written to a text file and
+    read back with video_transcript_clean()
+
+    Args:
+        video_id (str): Youtube video ID
+        model: Whisper model from load_whisper_model()
+        transcript_path (str): Optional path to also write the '[start -> end] text' transcript file to
+        vad (bool): Only transcribe the speech regions found by voice activity detection (see transcribe_options()).
+            Silence still comes out as empty gap rows, including at the start and end of the audio
+
+    Returns:
+        Generator of (video_id, start_time, end_time, text) tuples
+
+    '''
+
+    audio_path = audio_store.audio_path(video_id)
+
+    start_time = time.time()
+
+    segments, info = model.transcribe(audio_path, **transcribe_options(vad))
+    print(f'Detected languages: {info.language} ({info.language_probability:.2f})')
+    if vad:
+        print(f'Voice activity detection skipped {info.duration - info.duration_after_vad:.0f} of {info.duration:.0f} seconds')
+
+    segments = ((segment.start, segment.end, segment.text) for segment in segments)
+    if transcript_path:
+        segments = write_transcript_segments(segments, transcript_path)
+
+    yield from fill_transcript_gaps(video_id, segments, info.duration if vad else None)
+
+    print(f'Audio transcribed in {time.time() - start_time:.2f} seconds')
+
+
+def transcript_batches(rows, batch_rows=None):
+    '''
+    Groups a stream of transcript rows into dataframes of 'batch_rows' rows, or a single dataframe if batch_rows is None
+    '''
+    columns = ['video_id', 'start_time', 'end_time', 'text']
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if batch_rows and len(batch) >= batch_rows:
+            yield pd.DataFrame(batch, columns=columns)
+            batch = []
+
+    if batch:
+        yield pd.DataFrame(batch, columns=columns)
+
+
+def download_video_transcript(video_id, model):
+
+    transcript_path = f'data_preprocessing/video_transcripts/{video_id}.txt'
+
+    for _ in stream_video_transcript(video_id, model, transcript_path):
+        pass
+
+
+def video_transcript_clean(video_id, duration=None):
 
     """
     Clean and standardise a YouTube transcript file.
@@ -82,6 +220,9 @@ def video_transcript_clean(video_id):
     ----------
     video_id : str
         YouTube video ID.
+    duration : float, optional
+        Length of the audio in seconds. Given for VAD transcripts, so empty rows
+        are also added for the silence before the first and after the last segment.
 
     Returns
     -------
@@ -101,42 +242,7 @@ def video_transcript_clean(video_id):
 
     video_transcript_path = f'data_preprocessing/video_transcripts/{video_id}.txt'
 
-    df_transcript = pd.read_csv(
-        video_transcript_path,
-        sep=']',
-        names=['time', 'text']
-    )
-
-    df_transcript['video_id'] = video_id
-
-    df_transcript['time'] = df_transcript['time'].str.replace('[', '', regex=False)
-
-    df_transcript[['start_time', 'end_time']] = (
-        df_transcript['time']
-        .str.split('->', expand=True)
-        .astype(float)
-    )
-
-    empty_rows = []
-
-    for i in range(len(df_transcript) - 1): # this current logic won't work for the last row, as there's no next_start for it, so we need '-1'
-
-        current_end = df_transcript.iloc[i]['end_time']
-        next_start = df_transcript.iloc[i+1]['start_time']
-
-        if current_end != next_start:
-            empty_rows.append({
-                'start_time': current_end,
-                'end_time': next_start,
-                'text': '',
-                'video_id': video_id
-            })
-
-    df_empty_rows = pd.DataFrame(empty_rows)
-
-    df_transcript = pd.concat([df_transcript, df_empty_rows]).sort_values('start_time', ascending=True)[['video_id', 'start_time', 'end_time', 'text']]
-
-    return df_transcript
+    return transcript_processing.clean_transcript_file(video_transcript_path, video_id, duration=duration)
 
 
 
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.utils import download_model
+
+# Model files are kept here, so after the first run nothing is resolved or downloaded from the Hugging Face hub
+MODEL_DIR = os.getenv('WHISPER_MODEL_DIR', 'data_preprocessing/whisper_models')
+
+# One loaded model per set of settings, shared by everything in the process
+_models = {}
+_models_lock = threading.Lock()
+
+
+def local_model_path(model_name, model_dir=MODEL_DIR):
+
+    '''
+    Returns the local directory holding a model's CTranslate2 files, downloading them there the first time
+
+    Args:
+        model_name (str): Whisper model size (e.g. medium) or Hugging Face repo ID
+        model_dir (str): Directory models are pinned to
+
+    Returns:
+        Path to the model directory
+
+    '''
+
+    model_path = os.path.join(model_dir, model_name.replace('/', '--'))
+
+    if os.path.exists(os.path.join(model_path, 'model.bin')):
+        return model_path
+
+    print(f'Downloading Whisper model {model_name} to {model_path}')
+    os.makedirs(model_path, exist_ok=True)
+    return download_model(model_name, output_dir=model_path)
+
+
+def warm_up(model, transcribe_options):
+    '''
+    Runs the model over one second of silence, so the first real transcription doesn't pay for
+    allocating buffers and initialising the decoder
+    '''
+    silence = np.zeros(16000, dtype=np.float32)
+    segments, info = model.transcribe(silence, **transcribe_options)
+    list(segments) # transcribe() is lazy, the work only happens as segments are read
+
+
+def get_model(model_name, compute_type, cpu_threads=8, num_workers=1, warm_up_options=None):
+
+    '''
+    Returns a loaded Whisper model, loading it the first time it's asked for in this process
+
+    Loading a model means reading and converting its weights, which takes several seconds.
+    Any long-lived process (the weekly pipeline, a chunked transcription worker, a backfill job) loads each model once
+    here and reuses it for every transcription. The model files are read from MODEL_DIR, so the Hugging Face hub
+    is only contacted the first time a model is used on a machine
+
+    Args:
+        model_name (str): Whisper model size (e.g. medium) or Hugging Face repo ID
+        compute_type (str): CTranslate2 compute type e.g. int8
+        cpu_threads (int): Number of CPU threads each transcribe() call uses
+        num_workers (int): Number of threads that can call transcribe() at the same time
+        warm_up_options (dict): If given, the newly loaded model is warmed up with these transcribe() options
+
+    Returns:
+        WhisperModel
+
+    '''
+
+    key = (model_name, compute_type, cpu_threads, num_workers)
+
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            return model
+
+        start_time = time.time()
+        model = WhisperModel(
+            local_model_path(model_name),
+            device='cpu',
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers
+        )
+        print(f'Whisper model {model_name} ({compute_type}) loaded in {time.time() - start_time:.2f} seconds')
+
+        if warm_up_options is not None:
+            start_time = time.time()
+            warm_up(model, warm_up_options)
+            print(f'Whisper model warmed up in {time.time() - start_time:.2f} seconds')
+
+        _models[key] = model
+
+    return model
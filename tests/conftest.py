@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The pipeline and dashboard modules import each other as top level modules, as when they're run from their own directories
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_preprocessing'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_dashboard'))
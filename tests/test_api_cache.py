@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httplib2
+import pytest
+from api_cache import ResponseCache, ETagCachingHttp, cache_key_for
+
+ETAG = '"etag-1"'
+BODY = b'{"items": [{"id": "abc"}]}'
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    '''
+    Answers GETs on /with-etag with BODY and ETAG, or 304 when If-None-Match matches. /no-etag has no ETag
+    '''
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, self.headers.get('if-none-match')))
+
+        if self.path.startswith('/with-etag') and self.headers.get('if-none-match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        if self.path.startswith('/with-etag'):
+            self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.server.requests.append(('POST', self.path, self.rfile.read(length)))
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'api_cache.sqlite3'))
+    yield cache
+    cache.close()
+
+
+def stored_rows(cache):
+    return sqlite3.connect(cache.path).execute('SELECT cache_key, etag, content FROM responses').fetchall()
+
+
+def test_200_response_is_stored_with_its_etag(server, cache):
+    httpd, base_url = server
+    http = ETagCachingHttp(cache, httplib2.Http())
+
+    response, content = http.request(f'{base_url}/with-etag?part=snippet')
+
+    assert response.status == 200
+    assert content == BODY
+    assert stored_rows(cache) == [(cache_key_for(f'{base_url}/with-etag?part=snippet'), ETAG, BODY)]
+    assert httpd.requests == [('GET', '/with-etag?part=snippet', None)]
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_304_is_served_from_disk(server, cache):
+    httpd, base_url = server
+    http = ETagCachingHttp(cache, httplib2.Http())
+
+    http.request(f'{base_url}/with-etag?part=snippet')
+    response, content = http.request(f'{base_url}/with-etag?part=snippet')
+
+    assert httpd.requests[-1] == ('GET', '/with-etag?part=snippet', ETAG) # revalidated with the stored ETag
+    assert response.status == 200
+    assert response.fromcache
+    assert content == BODY
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_response_without_etag_is_not_stored(server, cache):
+    _, base_url = server
+    http = ETagCachingHttp(cache, httplib2.Http())
+
+    response, content = http.request(f'{base_url}/no-etag')
+
+    assert response.status == 200
+    assert content == BODY
+    assert stored_rows(cache) == []
+
+
+def test_api_key_is_stripped_from_cache_key(server, cache):
+    _, base_url = server
+    http = ETagCachingHttp(cache, httplib2.Http())
+
+    assert cache_key_for('https://example.com/v3/videos?key=SECRET&part=snippet&id=a') == 'https://example.com/v3/videos?id=a&part=snippet'
+    assert cache_key_for('https://example.com/v3/videos?part=snippet&key=SECRET') == cache_key_for('https://example.com/v3/videos?key=OTHER&part=snippet')
+
+    http.request(f'{base_url}/with-etag?key=SECRET&part=snippet')
+    assert all('SECRET' not in cache_key for cache_key, _, _ in stored_rows(cache))
+
+
+def test_uncached_methods_pass_through(server, cache):
+    httpd, base_url = server
+    http = ETagCachingHttp(cache, httplib2.Http())
+
+    response, content = http.request(f'{base_url}/with-etag', method='POST', body='payload', headers={'Content-Length': '7'})
+
+    assert response.status == 200
+    assert content == b'ok'
+    assert httpd.requests == [('POST', '/with-etag', b'payload')]
+    assert stored_rows(cache) == []
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_video_metadata_round_trip(cache):
+    cache.set_video_metadata({'a': '{"id": "a"}', 'b': '{"id": "b"}'})
+    cache.set_video_metadata({'a': '{"id": "a", "v": 2}'})
+
+    assert cache.get_video_metadata(['a', 'b', 'missing']) == {'a': '{"id": "a", "v": 2}', 'b': '{"id": "b"}'}
@@ -0,0 +1,30 @@
+import os
+import audio_store
+
+
+def write(path, size, mtime):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_enforce_budget_only_evicts_audio_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_store, 'AUDIO_DIR', str(tmp_path))
+
+    # Oldest first. The dotfile and the notes are older than any audio but must never be counted or deleted
+    write(tmp_path / '.gitkeep', 0, 1)
+    write(tmp_path / 'notes.txt', 100, 2)
+    write(tmp_path / 'aaaaaaaaaaa.flac', 100, 3)
+    write(tmp_path / 'bbbbbbbbbbb.webm.part', 100, 4)
+    write(tmp_path / 'c-c_ccccccc.temp.flac', 100, 5)
+    write(tmp_path / 'ddddddddddd.flac', 100, 6)
+
+    deleted = audio_store.enforce_budget(150, keep={'c-c_ccccccc'})
+
+    assert sorted(os.path.basename(path) for path in deleted) == ['aaaaaaaaaaa.flac', 'bbbbbbbbbbb.webm.part', 'ddddddddddd.flac']
+    assert sorted(os.listdir(tmp_path)) == ['.gitkeep', 'c-c_ccccccc.temp.flac', 'notes.txt']
+
+
+def test_touch_ignores_missing_audio(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_store, 'AUDIO_DIR', str(tmp_path))
+    audio_store.touch('missing')
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import chunked_transcription
+import video_timestamps
+
+SAMPLE_RATE = chunked_transcription.SAMPLE_RATE
+
+
+def test_split_audio_overlaps_neighbouring_chunks():
+    audio = np.zeros(int(700 * SAMPLE_RATE), dtype=np.float32)
+
+    chunks = chunked_transcription.split_audio(audio, chunk_secs=300, overlap_secs=10)
+
+    assert [offset for offset, _ in chunks] == [0, 290, 580]
+    assert [len(samples) / SAMPLE_RATE for _, samples in chunks] == [300, 300, 120]
+
+
+def test_split_audio_rejects_overlap_longer_than_chunk():
+    with pytest.raises(ValueError):
+        chunked_transcription.split_audio(np.zeros(SAMPLE_RATE), chunk_secs=10, overlap_secs=10)
+
+
+def test_stitch_chunks_keeps_one_copy_of_a_segment_crossing_the_cut():
+    audio = np.zeros(int(400 * SAMPLE_RATE), dtype=np.float32)
+    chunks = chunked_transcription.split_audio(audio, chunk_secs=300, overlap_secs=10) # cut at 295
+
+    chunk_results = [
+        # Chunk A hears the sentence up to the end of its audio, chunk B from the start of its own
+        [(270.0, 288.0, 'before'), (288.0, 300.0, 'across the cut, partly')],
+        [(290.0, 303.0, 'the cut, in full'), (303.0, 320.0, 'after')],
+    ]
+
+    stitched = chunked_transcription.stitch_chunks(chunks, chunk_results)
+
+    assert stitched == [(270.0, 288.0, 'before'), (288.0, 300.0, 'across the cut, partly'), (303.0, 320.0, 'after')]
+
+    rows = list(video_timestamps.fill_transcript_gaps('abc123', stitched))
+    assert all(end >= start for _, start, end, _ in rows)
+    assert [(start, end) for _, start, end, text in rows if text == ''] == [(300.0, 303.0)]
+
+
+def test_fill_transcript_gaps_skips_overlapping_segments():
+    rows = list(video_timestamps.fill_transcript_gaps('abc123', [(0.0, 10.0, 'a'), (8.0, 12.0, 'b'), (15.0, 16.0, 'c')]))
+
+    assert [(start, end, text) for _, start, end, text in rows] == [(0.0, 10.0, ' a'), (8.0, 12.0, ' b'), (12.0, 15.0, ''), (15.0, 16.0, ' c')]
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+import pytest
+from db_pool import ConnectionPool
+
+# These run against a real PostgreSQL server, e.g. TEST_DBL_URL=postgresql://postgres@localhost/postgres
+DBL_URL = os.getenv('TEST_DBL_URL')
+pytestmark = pytest.mark.skipif(not DBL_URL, reason='TEST_DBL_URL not set')
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(DBL_URL, maxconn=2)
+    yield pool
+    pool.close()
+
+
+def backend_pid(conn):
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_backend_pid()')
+        pid = cur.fetchone()[0]
+    conn.rollback()
+    return pid
+
+
+def test_checkout_waits_at_the_connection_limit(pool):
+    first, second = pool.checkout(), pool.checkout()
+    third = []
+
+    waiter = threading.Thread(target=lambda: third.append(pool.checkout()))
+    waiter.start()
+    time.sleep(0.3)
+    assert third == [] # blocked until a connection is returned
+
+    pool.checkin(first)
+    waiter.join(timeout=5)
+
+    assert third == [first] # the returned connection is reused rather than a third one opened
+    assert pool.stats()['open'] == 2
+    assert pool.stats()['max_wait_secs'] >= 0.3
+
+    pool.checkin(second)
+    pool.checkin(third[0])
+
+
+def test_idle_connection_is_pinged_and_replaced_if_dropped(pool):
+    with pool.connection() as conn:
+        pid = backend_pid(conn)
+
+    # Recently used connections are handed out without a ping
+    with pool.connection() as conn:
+        assert backend_pid(conn) == pid
+
+    # Idle for over ping_after_secs and dropped by the server, as when it scales down
+    pool.last_used[id(conn)] -= 61
+    with psycopg2.connect(DBL_URL) as admin:
+        with admin.cursor() as cur:
+            cur.execute('SELECT pg_terminate_backend(%s)', (pid,))
+    admin.close()
+    time.sleep(0.2)
+
+    with pool.connection() as replacement:
+        assert replacement is not conn
+        assert backend_pid(replacement) != pid
+
+    assert pool.stats()['discarded'] == 1
+
+
+def test_idle_connection_that_is_still_alive_is_reused_after_ping(pool):
+    with pool.connection() as conn:
+        pid = backend_pid(conn)
+
+    pool.last_used[id(conn)] -= 61
+    with pool.connection() as same:
+        assert same is conn
+        assert backend_pid(same) == pid
+
+    assert pool.stats()['discarded'] == 0
+
+
+def test_uncommitted_work_is_rolled_back_on_checkin(pool):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('CREATE TEMP TABLE pool_rollback_check (x int)')
+            cur.execute('INSERT INTO pool_rollback_check VALUES (1)')
+        assert conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+
+    assert conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+    with pool.connection() as same:
+        assert same is conn
+        with same.cursor() as cur:
+            cur.execute("SELECT to_regclass('pg_temp.pool_rollback_check')")
+            assert cur.fetchone()[0] is None
+
+
+def test_close_closes_idle_and_returned_connections(pool):
+    idle = pool.checkout()
+    checked_out = pool.checkout()
+    pool.checkin(idle)
+
+    pool.close()
+    assert idle.closed
+    assert not checked_out.closed # still in use, so it's left alone until it's returned
+
+    pool.checkin(checked_out)
+    assert checked_out.closed
+    assert pool.stats()['open'] == 0
+
+    with pytest.raises(ValueError):
+        pool.checkout()
@@ -0,0 +1,84 @@
+import hashlib
+import numpy as np
+import pytest
+import embedding_store
+
+
+class FakeModel:
+    '''
+    Stands in for the sentence transformer: a fixed pseudo-random vector per text, and a count of texts encoded
+    '''
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True):
+        self.encoded.extend(texts)
+        return np.stack([vector(text) for text in texts])
+
+
+def vector(text):
+    seed = int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).normal(size=8).astype(np.float32)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(embedding_store, 'get_model', lambda *args: model)
+    return model
+
+
+@pytest.mark.parametrize('store_dtype', ['float32', 'int8'])
+def test_compact_drops_orphaned_rows_and_keeps_embeddings(tmp_path, model, store_dtype):
+    store = embedding_store.EmbeddingStore(str(tmp_path), store_dtype=store_dtype)
+    store.embed(['a', 'a', 'b'], [0, 60, 0], ['one', 'two', 'three'])
+    store.embed(['a'], [60], ['two, redone']) # leaves the old row of minute 60 orphaned
+
+    assert '1 of 4 stored rows orphaned (25%)' in store.summary()
+    expected = store.embed(['a', 'a', 'b'], [0, 60, 0], ['one', 'two, redone', 'three'])
+
+    assert store.compact(min_orphaned_share=0.5) == 0
+    assert store.compact() == 1
+    assert store.stored_rows() == 3 and store.orphaned_rows() == 0
+    store.close()
+
+    store = embedding_store.EmbeddingStore(str(tmp_path), store_dtype=store_dtype)
+    encoded = len(model.encoded)
+    np.testing.assert_array_equal(store.embed(['a', 'a', 'b'], [0, 60, 0], ['one', 'two, redone', 'three']), expected)
+    assert len(model.encoded) == encoded
+    store.close()
+
+
+def test_interrupted_compaction_is_finished_on_open(tmp_path, model, monkeypatch):
+    store = embedding_store.EmbeddingStore(str(tmp_path))
+    store.embed(['a', 'b'], [0, 0], ['one', 'two'])
+    store.embed(['a'], [0], ['one, redone'])
+    expected = store.embed(['a', 'b'], [0, 0], ['one, redone', 'two'])
+
+    # The index is remapped, then the run stops before the compacted matrix is moved into place
+    monkeypatch.setattr(embedding_store.EmbeddingStore, 'finish_compaction', lambda self: None)
+    store.compact()
+    store.close()
+    monkeypatch.undo()
+    monkeypatch.setattr(embedding_store, 'get_model', lambda *args: model)
+
+    store = embedding_store.EmbeddingStore(str(tmp_path))
+    np.testing.assert_array_equal(store.embed(['a', 'b'], [0, 0], ['one, redone', 'two']), expected)
+    assert store.stored_rows() == 2
+    store.close()
+
+
+def test_embed_only_reads_the_requested_videos(tmp_path, model):
+    store = embedding_store.EmbeddingStore(str(tmp_path))
+    store.embed([f'v{i}' for i in range(1200)], [0] * 1200, [f'text {i}' for i in range(1200)])
+
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+    embeddings = store.embed(['v3', 'v1100'], [0, 0], ['text 3', 'text 1100'])
+
+    np.testing.assert_array_equal(embeddings, np.stack([vector('text 3'), vector('text 1100')]))
+    assert store.hits == 2
+    lookups = [statement for statement in statements if statement.startswith('SELECT video_id')]
+    assert lookups and all('video_id IN' in statement for statement in lookups)
+    store.close()
@@ -0,0 +1,73 @@
+import os
+import pandas as pd
+import psycopg2
+import pytest
+import helper_functions
+
+# These run against a real PostgreSQL server, e.g. TEST_DBL_URL=postgresql://postgres@localhost/postgres
+DBL_URL = os.getenv('TEST_DBL_URL')
+pytestmark = pytest.mark.skipif(not DBL_URL, reason='TEST_DBL_URL not set')
+
+
+@pytest.fixture
+def cur():
+    # Each test works in one transaction that's rolled back, so the scratch tables never outlive it
+    conn = psycopg2.connect(DBL_URL)
+    with conn.cursor() as cur:
+        cur.execute('CREATE SCHEMA IF NOT EXISTS stage;')
+        cur.execute('CREATE TABLE stage.test_merge_video (video_id TEXT, title TEXT, load_ts TIMESTAMP DEFAULT clock_timestamp());')
+        cur.execute('CREATE TABLE stage.test_merge_transcript (video_id TEXT, start_time INTEGER, text TEXT);')
+        yield cur
+    conn.rollback()
+    conn.close()
+
+
+def rows(cur, table):
+    cur.execute(f'SELECT * FROM stage.{table} ORDER BY 1, 2')
+    return cur.fetchall()
+
+
+def test_merge_only_rewrites_changed_rows(cur, capsys):
+    df = pd.DataFrame({'video_id': ['a', 'b'], 'title': ['A', 'B']})
+    helper_functions.merge_dataframe(cur, 'test_merge_video', df, ['video_id'])
+    cur.execute("SELECT load_ts FROM stage.test_merge_video WHERE video_id = 'a'")
+    first_load_ts = cur.fetchone()[0]
+
+    df = pd.DataFrame({'video_id': ['a', 'b', 'c'], 'title': ['A', 'B2', 'C']})
+    helper_functions.merge_dataframe(cur, 'test_merge_video', df, ['video_id'])
+
+    cur.execute('SELECT video_id, title FROM stage.test_merge_video ORDER BY video_id')
+    assert cur.fetchall() == [('a', 'A'), ('b', 'B2'), ('c', 'C')]
+    cur.execute("SELECT load_ts FROM stage.test_merge_video WHERE video_id = 'a'")
+    assert cur.fetchone()[0] == first_load_ts
+    assert '2 rows written for 2 new or changed keys (1 existing rows replaced), 1 unchanged keys skipped' in capsys.readouterr().out
+
+
+def test_merge_raises_on_duplicate_keys(cur):
+    df = pd.DataFrame({'video_id': ['a', 'a'], 'title': ['A', 'A2']})
+    with pytest.raises(ValueError, match='more than once'):
+        helper_functions.merge_dataframe(cur, 'test_merge_video', df, ['video_id'])
+
+
+def test_grouped_merge_replaces_every_row_of_a_key(cur, monkeypatch):
+    monkeypatch.setattr(helper_functions, 'MERGE_GROUPED', {'test_merge_transcript'})
+
+    df = pd.DataFrame({'video_id': ['a', 'a', 'a', 'b'], 'start_time': [0, 10, 20, 0], 'text': ['x', 'y', 'z', 'w']})
+    helper_functions.merge_dataframe(cur, 'test_merge_transcript', df, ['video_id'])
+
+    # Video a is re-transcribed with one segment fewer and a re-timed one. Video b isn't in the load and is left alone
+    df = pd.DataFrame({'video_id': ['a', 'a'], 'start_time': [0, 15], 'text': ['x', 'yz']})
+    helper_functions.merge_dataframe(cur, 'test_merge_transcript', df, ['video_id'])
+
+    assert rows(cur, 'test_merge_transcript') == [('a', 0, 'x'), ('a', 15, 'yz'), ('b', 0, 'w')]
+
+
+def test_grouped_merge_skips_unchanged_keys_in_any_order(cur, monkeypatch, capsys):
+    monkeypatch.setattr(helper_functions, 'MERGE_GROUPED', {'test_merge_transcript'})
+
+    df = pd.DataFrame({'video_id': ['a', 'a'], 'start_time': [0, 10], 'text': ['x', 'y']})
+    helper_functions.merge_dataframe(cur, 'test_merge_transcript', df, ['video_id'])
+    helper_functions.merge_dataframe(cur, 'test_merge_transcript', df.iloc[::-1], ['video_id'])
+
+    assert rows(cur, 'test_merge_transcript') == [('a', 0, 'x'), ('a', 10, 'y')]
+    assert '0 rows written for 0 new or changed keys (0 existing rows replaced), 1 unchanged keys skipped' in capsys.readouterr().out
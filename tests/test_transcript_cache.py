@@ -0,0 +1,87 @@
+import sqlite3
+from pathlib import Path
+import pandas as pd
+import pytest
+import backfill_transcripts
+import transcript_cache
+import transcript_processing
+import video_timestamps
+
+VIDEO_ID = 'abc123'
+
+# Speech from 12.5s to 61s with a pause in the middle, in 95s of audio - VAD leaves the silence at both ends unsegmented
+SEGMENTS = [(12.5, 20.0, 'hello'), (20.0, 31.25, 'there'), (40.0, 61.0, 'again')]
+DURATION = 95.004
+
+
+@pytest.fixture
+def paths(tmp_path):
+    audio_path = tmp_path / f'{VIDEO_ID}.flac'
+    audio_path.write_bytes(b'audio')
+    return str(tmp_path / 'manifest.sqlite3'), str(audio_path), str(tmp_path / f'{VIDEO_ID}.txt')
+
+
+def fresh_transcript(transcript_path, duration):
+    # What the pipeline loads straight from Whisper, writing the transcript file as it goes
+    segments = video_timestamps.write_transcript_segments(iter(SEGMENTS), transcript_path)
+    rows = list(video_timestamps.fill_transcript_gaps(VIDEO_ID, segments, duration))
+    return pd.DataFrame(rows, columns=['video_id', 'start_time', 'end_time', 'text'])
+
+
+@pytest.mark.parametrize('vad', [True, False])
+def test_cached_transcript_matches_fresh_one(paths, vad):
+    manifest_path, audio_path, transcript_path = paths
+    df_fresh = fresh_transcript(transcript_path, DURATION if vad else None)
+
+    cache = transcript_cache.TranscriptCache(manifest_path, transcript_cache.transcript_settings(vad=vad))
+    cache.store(VIDEO_ID, audio_path, transcript_path, df_fresh['end_time'].iloc[-1] if vad else None)
+    cached_path, duration = cache.lookup(VIDEO_ID, audio_path)
+    cache.close()
+
+    df_cached = transcript_processing.clean_transcript_file(cached_path, VIDEO_ID, duration=duration)
+
+    if vad:
+        assert (df_fresh['start_time'].iloc[0], df_fresh['end_time'].iloc[-1]) == (0.0, 95.0)
+    pd.testing.assert_frame_equal(df_cached, df_fresh, check_dtype=False)
+
+
+def test_vad_lookup_misses_without_a_stored_duration(paths):
+    manifest_path, audio_path, transcript_path = paths
+    fresh_transcript(transcript_path, DURATION)
+
+    # A manifest from before durations were stored
+    conn = sqlite3.connect(manifest_path)
+    conn.execute('CREATE TABLE transcripts (video_id TEXT PRIMARY KEY, audio_hash TEXT NOT NULL, settings_key TEXT NOT NULL, transcript_path TEXT NOT NULL, stored_at REAL NOT NULL)')
+    conn.commit()
+    conn.close()
+
+    settings = transcript_cache.transcript_settings(vad=True)
+    cache = transcript_cache.TranscriptCache(manifest_path, settings)
+    with cache.lock:
+        cache.conn.execute(
+            'INSERT INTO transcripts (video_id, audio_hash, settings_key, transcript_path, stored_at) VALUES (?, ?, ?, ?, 0)',
+            (VIDEO_ID, transcript_cache.file_hash(audio_path), cache.settings_key, transcript_path)
+        )
+    assert cache.lookup(VIDEO_ID, audio_path) is None
+
+    cache.store(VIDEO_ID, audio_path, transcript_path, 95.0)
+    assert cache.lookup(VIDEO_ID, audio_path) == (transcript_path, 95.0)
+    cache.close()
+
+
+def test_backfill_cleans_vad_transcripts_like_the_pipeline(paths, monkeypatch):
+    manifest_path, audio_path, transcript_path = paths
+    df_fresh = fresh_transcript(transcript_path, DURATION)
+
+    cache = transcript_cache.TranscriptCache(manifest_path, transcript_cache.transcript_settings(vad=True))
+    cache.store(VIDEO_ID, audio_path, transcript_path, df_fresh['end_time'].iloc[-1])
+    cache.store('no_vad', audio_path, transcript_path)
+    durations = cache.durations()
+    cache.close()
+
+    assert durations == {VIDEO_ID: 95.0}
+
+    monkeypatch.setattr(backfill_transcripts, 'TRANSCRIPT_DIR', str(Path(transcript_path).parent))
+    df_backfill = backfill_transcripts.clean_video_transcript(VIDEO_ID, durations.get(VIDEO_ID))
+
+    pd.testing.assert_frame_equal(df_backfill, df_fresh, check_dtype=False)